@@ -0,0 +1,179 @@
+# benchmarks/bench_checker.py
+"""
+asyncio 验证引擎吞吐基准 (每分钟完成验证的代理数)。
+对比各验证阶段单独建连 (check_keepalive=False) 与复用 keep-alive 隧道 (check_keepalive=True)。
+本机模拟慢速的免费 SOCKS5 代理: 建连与每个握手应答各延迟 RTT；目标站点每个响应延迟 RTT。
+分别测量三个阶段同源 (同默认验证目标，一条隧道即可完成) 与延迟/测速、匿名度分属两个站点两种情形。
+然后对比关闭与开启握手探测 (handshake_probe): 候选中 80% 为接受连接却从不应答的端口，20% 为代理。
+最后对比关闭与开启协议识别 (protocol_detect): 一是每个 SOCKS5 代理地址同时出现在 http/socks4/socks5 三个标注下
+(多个来源合并的情形)，二是 SOCKS5 代理被来源标注为 http (或导入时未标注协议)。
+
+用法: python benchmarks/bench_checker.py [代理数, 默认400] [并发数, 默认100] [RTT毫秒, 默认50]
+"""
+
+import asyncio
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.checker import ProxyChecker
+
+SPEED_BODY = b'x' * 100 * 1024
+
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+def _slow_socks5(rtt):
+    async def handle(reader, writer):
+        try:
+            await asyncio.sleep(rtt) # TCP 建连
+            head = await reader.readexactly(2)
+            await reader.readexactly(head[1])
+            await asyncio.sleep(rtt)
+            writer.write(b'\x05\x00')
+            head = await reader.readexactly(4)
+            if head[3] == 1:
+                host = socket.inet_ntoa(await reader.readexactly(4))
+            else:
+                host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+            port = struct.unpack('!H', await reader.readexactly(2))[0]
+            target_reader, target_writer = await asyncio.open_connection(host, port)
+            await asyncio.sleep(rtt)
+            writer.write(b'\x05\x00\x00\x01' + bytes(6))
+            await asyncio.gather(_pipe(reader, target_writer), _pipe(target_reader, writer))
+        except (OSError, asyncio.IncompleteReadError):
+            writer.close()
+    return handle
+
+
+def _slow_target(rtt):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                if b'/get' in head.split(b' ', 2)[1]:
+                    body = json.dumps({'origin': '203.0.113.7', 'headers': {}}).encode()
+                else:
+                    body = SPEED_BODY
+                await asyncio.sleep(rtt)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body))
+                if not head.startswith(b'HEAD'):
+                    writer.write(body)
+                await writer.drain()
+                if b'connection: close' in head.lower():
+                    break
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def _silent(reader, writer):
+    """接受连接但从不应答的端口 (扫描结果中大多数开放端口的情形)。"""
+    try:
+        await reader.read()
+    except OSError:
+        pass
+    writer.close()
+
+
+def _start_servers(rtt, distinct):
+    """启动模拟服务器；另启动 distinct 个互不相同的代理地址 (ports['proxies'])，用于协议识别的对比。"""
+    loop = asyncio.new_event_loop()
+    ports = {'proxies': []}
+    ready = threading.Event()
+
+    async def setup():
+        for name, handler in (('proxy', _slow_socks5(rtt)), ('site_a', _slow_target(rtt)), ('site_b', _slow_target(rtt)),
+                              ('silent', _silent)):
+            server = await asyncio.start_server(handler, '127.0.0.1', 0, backlog=4096)
+            ports[name] = server.sockets[0].getsockname()[1]
+        for _ in range(distinct):
+            server = await asyncio.start_server(_slow_socks5(rtt), '127.0.0.1', 0)
+            ports['proxies'].append(server.sockets[0].getsockname()[1])
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.create_task(setup())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return ports
+
+
+def run_checks(ports, candidates, concurrency, keepalive, same_origin, probe=True, detect=False):
+    """candidates 为 {标注协议: [地址, ...]}。"""
+    checker = ProxyChecker(timeout=10, engine='asyncio')
+    checker.async_concurrency = concurrency
+    checker.check_keepalive = keepalive
+    checker.handshake_probe = probe
+    checker.protocol_detect = detect
+    checker.public_ip = '198.51.100.1'
+    checker.location_cache['127.0.0.1'] = '本地'
+    site_a = f"http://127.0.0.1:{ports['site_a']}"
+    site_b = site_a if same_origin else f"http://127.0.0.1:{ports['site_b']}"
+    checker.validation_targets = {
+        'latency_check': f"{site_a}/", 'anonymity_check': f"{site_b}/get", 'speed_check': f"{site_a}/100kb",
+    }
+    result_queue, log_queue = queue.Queue(), queue.Queue()
+    started = time.perf_counter()
+    checker.validate_all(candidates, result_queue, log_queue, 'offline')
+    elapsed = time.perf_counter() - started
+    working = 0
+    while (result := result_queue.get()) is not None:
+        working += result['status'] == 'Working'
+    return elapsed, working
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rtt = (int(sys.argv[3]) if len(sys.argv) > 3 else 50) / 1000
+    ports = _start_servers(rtt, count // 3)
+    proxies = {'socks5': [f"127.0.0.1:{ports['proxy']}"] * count}
+    for same_origin, label in ((True, '三阶段同源'), (False, '两个站点')):
+        for keepalive in (False, True):
+            elapsed, working = run_checks(ports, proxies, concurrency, keepalive, same_origin)
+            mode = 'keep-alive 隧道' if keepalive else '每阶段单独建连'
+            print(f"{label}  {mode:<14} {count} 个代理  {elapsed:6.2f} s  {working / elapsed * 60:>8.0f} 个/分钟  可用 {working}")
+
+    mixed = {'socks5': [f"127.0.0.1:{ports['proxy'] if i % 5 == 0 else ports['silent']}" for i in range(count)]}
+    for probe in (False, True):
+        elapsed, working = run_checks(ports, mixed, concurrency, True, True, probe)
+        mode = '握手探测' if probe else '无握手探测'
+        print(f"80% 无应答端口  {mode:<10} {count} 个候选  {elapsed:6.2f} s  {working / elapsed * 60:>8.0f} 个/分钟  可用 {working}")
+
+    addresses = [f"127.0.0.1:{port}" for port in ports['proxies']]
+    for label, candidates in (('三种标注重复', {proto: list(addresses) for proto in ('http', 'socks4', 'socks5')}),
+                              ('标注错误    ', {'http': list(addresses)})):
+        entries = sum(len(v) for v in candidates.values())
+        for detect in (False, True):
+            elapsed, working = run_checks(ports, candidates, concurrency, True, True, True, detect)
+            mode = '协议识别' if detect else '按标注验证'
+            print(f"{label}  {mode:<10} {entries} 个条目  {elapsed:6.2f} s  {working / elapsed * 60:>8.0f} 个/分钟  可用 {working}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/bench_geoip.py
+"""
+离线IP地址库基准: 加载耗时与查询吞吐 (次/秒)。
+默认生成一个与 DB-IP Country Lite 的 IPv4 部分规模相当的 CSV 区间表 (30 万个区间)，
+测量首次加载 (解析 CSV 并编译 .idx)、再次加载 (mmap .idx) 与随机 IP 的查询速度；
+也可以指定现成的 .mmdb 或 CSV 地址库。对照: 在线接口每次查询至少一个网络往返 (通常数百毫秒) 且有频率限制。
+
+用法: python benchmarks/bench_geoip.py [地址库路径，默认生成临时 CSV] [查询次数, 默认200000]
+"""
+
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.geoip import open_geoip
+
+RANGES = 300000
+CODES = ('CN', 'US', 'HK', 'JP', 'DE', 'GB', 'FR', 'SG', 'KR', 'RU', 'BR', 'IN', 'AU', 'NL', 'ZZ')
+
+
+def _generate_csv(path):
+    rng = random.Random(1)
+    starts = sorted(rng.sample(range(1 << 24, 0xE0000000), RANGES))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('ip_start,ip_end,country\n')
+        for start, next_start in zip(starts, starts[1:] + [0xE0000000]):
+            end = rng.randint(start, next_start - 1)
+            f.write(f"{socket.inet_ntoa(struct.pack('!I', start))},{socket.inet_ntoa(struct.pack('!I', end))},{rng.choice(CODES)}\n")
+
+
+def _timed_open(path):
+    started = time.perf_counter()
+    db = open_geoip(path)
+    return db, time.perf_counter() - started
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    tmpdir = None
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, 'ranges.csv')
+        _generate_csv(path)
+
+    db, elapsed = _timed_open(path)
+    print(f"首次加载        {elapsed * 1000:9.1f} ms  ({len(db)} 条)")
+    db.close()
+    db, elapsed = _timed_open(path)
+    print(f"再次加载        {elapsed * 1000:9.1f} ms")
+
+    rng = random.Random(2)
+    ips = [socket.inet_ntoa(struct.pack('!I', rng.getrandbits(32))) for _ in range(lookups)]
+    started = time.perf_counter()
+    found = sum(1 for ip in ips if db.lookup(ip))
+    elapsed = time.perf_counter() - started
+    print(f"随机查询        {lookups:>9} 次  {elapsed:6.2f} s  {lookups / elapsed:>10.0f} 次/秒  命中 {found}")
+    db.close()
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
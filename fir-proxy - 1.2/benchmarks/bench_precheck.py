@@ -0,0 +1,121 @@
+# benchmarks/bench_precheck.py
+"""
+TCP预检吞吐基准 (候选/秒)。
+对比旧版线程池 (500 线程，每个候选一次阻塞 create_connection) 与 ConnectScanner (单 selector 非阻塞 connect)。
+候选均指向本机: 约 1% 为正在监听的端口，约 10% 为连接队列已满的端口 (SYN 被丢弃，等到超时)，
+其余为已关闭的端口 (连接被拒绝)。
+旧版只在前 min(候选数, 20000) 个候选上测量，ConnectScanner 测量全部候选，并报告进程峰值内存。
+
+用法: python benchmarks/bench_precheck.py [候选数, 默认200000] [同时在途连接数, 默认10000]
+"""
+
+import os
+import resource
+import select
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.scanner import ConnectScanner
+
+LEGACY_SAMPLE = 20000
+
+
+def legacy_pre_check(proxy):
+    """优化前的 _pre_check_proxy 实现，作为对照组。"""
+    try:
+        ip, port_str = proxy.split(':')
+        with socket.create_connection((ip, int(port_str)), timeout=1.5):
+            return True
+    except Exception:
+        return False
+
+
+def legacy_scan(candidates):
+    survivors = 0
+    with ThreadPoolExecutor(max_workers=500) as executor:
+        futures = [executor.submit(legacy_pre_check, p) for p in candidates]
+        for future in as_completed(futures):
+            if future.result():
+                survivors += 1
+    return survivors
+
+
+def _listeners(count):
+    socks = []
+    for _ in range(count):
+        sock = socket.create_server(('127.0.0.1', 0), backlog=4096)
+        socks.append(sock)
+
+    def accept_loop():
+        while True:
+            readable, _, _ = select.select(socks, [], [], 1)
+            for sock in readable:
+                try:
+                    sock.accept()[0].close()
+                except OSError:
+                    pass
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return [sock.getsockname()[1] for sock in socks]
+
+
+def _stalled_port():
+    """连接队列已满、不再响应 SYN 的端口，连接它只能等到超时。"""
+    listener = socket.create_server(('127.0.0.1', 0), backlog=0)
+    port = listener.getsockname()[1]
+    held = [listener]
+    while True:
+        try:
+            held.append(socket.create_connection(('127.0.0.1', port), timeout=0.3))
+        except OSError:
+            return port, held
+
+
+def _closed_ports(count):
+    ports = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        ports.append(sock.getsockname()[1])
+        sock.close()
+    return ports
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    inflight = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    open_ports = _listeners(16)
+    closed_ports = _closed_ports(64)
+    stalled_port, _held = _stalled_port()
+
+    def port_of(i):
+        if i % 100 == 0:
+            return open_ports[i % len(open_ports)]
+        if i % 10 == 1:
+            return stalled_port
+        return closed_ports[i % len(closed_ports)]
+
+    candidates = [f"127.0.0.1:{port_of(i)}" for i in range(total)]
+    expected = (total + 99) // 100
+
+    sample = candidates[:min(total, LEGACY_SAMPLE)]
+    started = time.perf_counter()
+    survivors = legacy_scan(sample)
+    elapsed = time.perf_counter() - started
+    print(f"旧版线程池      {len(sample):>9} 个候选  {elapsed:7.2f} s  {len(sample) / elapsed:>10.0f} 个/秒  幸存 {survivors}")
+
+    started = time.perf_counter()
+    survivors = sum(1 for _ in ConnectScanner(max_inflight=inflight).scan(candidates))
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"ConnectScanner  {total:>9} 个候选  {elapsed:7.2f} s  {total / elapsed:>10.0f} 个/秒  幸存 {survivors} (应为 {expected})")
+    print(f"进程峰值内存: {peak_mb:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
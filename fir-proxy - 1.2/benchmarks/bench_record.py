@@ -0,0 +1,67 @@
+# benchmarks/bench_record.py
+"""
+代理记录内存占用与字段访问耗时基准。
+对比原先的代理信息字典与 ProxyRecord 在大规模代理池下的内存占用。
+
+用法: python benchmarks/bench_record.py [代理数, 默认200000]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.record import ProxyRecord
+
+
+def make_dicts(count):
+    rng = random.Random(count)
+    return [{
+        'proxy': f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}:{rng.randrange(1024, 65536)}",
+        'protocol': rng.choice(('HTTP', 'SOCKS4', 'SOCKS5')),
+        'status': 'Working',
+        'latency': rng.uniform(0.05, 3.0),
+        'speed': rng.uniform(0.1, 10.0),
+        'anonymity': rng.choice(('Transparent', 'Anonymous', 'Elite')),
+        'location': rng.choice(('US', 'JP', 'DE', 'CN', 'SG')),
+        'score': rng.uniform(0, 200),
+        'consecutive_failures': 0,
+    } for _ in range(count)]
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return items, used
+
+
+def access_ns(items, key, rounds=5):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for item in items:
+            item.get(key)
+    return (time.perf_counter() - started) / (rounds * len(items)) * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    source = make_dicts(count)
+    # 两组都从同一份数据逐项复制构造，字符串等共享对象不计入差异
+    dicts, dict_bytes = measure(lambda: [dict(p) for p in source])
+    records, record_bytes = measure(lambda: [ProxyRecord.from_dict(p) for p in source])
+    assert all(r.to_dict() == p for r, p in zip(records[:1000], source))
+
+    print(f"{count} 条代理")
+    print(f"{'':<12}{'字节/条':>10}{'get(score) ns':>16}{'get(proxy) ns':>16}")
+    for name, items, used in (("dict", dicts, dict_bytes), ("ProxyRecord", records, record_bytes)):
+        print(f"{name:<12}{used / count:>10.0f}{access_ns(items, 'score'):>16.0f}{access_ns(items, 'proxy'):>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
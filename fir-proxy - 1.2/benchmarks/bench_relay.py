@@ -0,0 +1,107 @@
+# benchmarks/bench_relay.py
+"""
+单条隧道转发吞吐基准 (MB/s)。
+对比旧版 recv(8192) + sendall 循环、可复用缓冲区 recv_into 路径以及 Linux splice 路径。
+
+用法: python benchmarks/bench_relay.py [传输MB数, 默认512] [重复次数, 默认3]
+"""
+
+import os
+import queue
+import select
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.server import ProxyServer, SPLICE_SUPPORTED
+
+
+def legacy_forward(server, sock1, sock2):
+    """优化前的 _forward_data 实现，作为对照组。"""
+    while server._running:
+        try:
+            readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
+            if exceptional or not readable:
+                break
+            for sock in readable:
+                other_sock = sock2 if sock is sock1 else sock1
+                data = sock.recv(8192)
+                if not data:
+                    return
+                other_sock.sendall(data)
+        except (ConnectionResetError, BrokenPipeError, OSError, select.error):
+            break
+
+
+def _tcp_pair():
+    listener = socket.create_server(('127.0.0.1', 0))
+    a = socket.create_connection(listener.getsockname())
+    b, _ = listener.accept()
+    listener.close()
+    return a, b
+
+
+def run_once(forward, total_bytes):
+    source, relay_in = _tcp_pair()
+    relay_out, sink = _tcp_pair()
+
+    meters = {relay_in: ('firproxy_bytes_total', 'bench', 'bench', 'out'),
+              relay_out: ('firproxy_bytes_total', 'bench', 'bench', 'in')}
+    relay = threading.Thread(target=forward, args=(relay_in, relay_out, meters), daemon=True)
+    relay.start()
+
+    received = [0]
+
+    def drain():
+        buf = bytearray(1 << 20)
+        while received[0] < total_bytes:
+            n = sink.recv_into(buf)
+            if not n:
+                break
+            received[0] += n
+
+    reader = threading.Thread(target=drain, daemon=True)
+    payload = os.urandom(1 << 20)
+    start = time.perf_counter()
+    reader.start()
+    sent = 0
+    while sent < total_bytes:
+        source.sendall(payload)
+        sent += len(payload)
+    reader.join()
+    elapsed = time.perf_counter() - start
+
+    for sock in (source, relay_in, relay_out, sink):
+        sock.close()
+    relay.join(timeout=5)
+    return received[0] / elapsed / (1 << 20)
+
+
+def main():
+    total_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    total_bytes = total_mb << 20
+
+    server = ProxyServer('127.0.0.1', 0, '127.0.0.1', 0, rotator=None, log_queue=queue.Queue())
+    server._running = True
+
+    variants = [
+        ("legacy recv(8192)", lambda a, b, meters: legacy_forward(server, a, b)),
+        ("buffered recv_into", server._forward_data_buffered),
+    ]
+    if SPLICE_SUPPORTED:
+        variants.append(("splice", server._forward_data_splice))
+    else:
+        print("当前平台不支持 os.splice，跳过 splice 测试。")
+
+    print(f"单隧道传输 {total_mb} MB，取 {repeats} 次中的最好成绩:")
+    for name, forward in variants:
+        best = max(run_once(forward, total_bytes) for _ in range(repeats))
+        print(f"  {name:<20} {best:10.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,10 @@ def deduce_protocol(original_line, default_protocol):
     否则，使用源定义的默认协议。
     """
     line_lower = original_line.lower()
-    if 'socks5' in line_lower or 'socks' in line_lower:  # 包含 "socks" 但不包含 "socks5" 的也归为 SOCKS5
-        return 'socks5'
     if 'socks4' in line_lower:
-        return 'socks4'  # 也可以单独处理 SOCKS4
+        return 'socks4'
+    if 'socks' in line_lower:  # 包含 "socks" 但不包含 "socks4" 的归为 SOCKS5
+        return 'socks5'
     if 'http' in line_lower:
         return 'http'
     # 如果行内没有明确标识，则返回该源的默认协议
@@ -11,13 +11,18 @@ import re
 import json
 import os
 import base64
+import multiprocessing
 
 # 导入核心模块
 from modules.fetcher import ProxyFetcher
 from modules.checker import ProxyChecker
 from modules.rotator import ProxyRotator
+from modules.query import ProxyQuery
 from modules.server import ProxyServer
 from modules.asset_searcher import AssetSearcher
+from modules.store import ProxyStore
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class SettingsWindow(tk.Toplevel):
     """设置窗口的UI和逻辑, 包含通用设置和自动爬取功能。"""
@@ -67,10 +72,16 @@ class SettingsWindow(tk.Toplevel):
         # 通用设置
         general_cfg = self.settings.get('general', {})
         self.validation_threads_var = tk.IntVar(value=general_cfg.get('validation_threads', 100))
+        self.checker_engine_var = tk.StringVar(value=general_cfg.get('checker_engine', 'thread'))
+        self.geoip_path_var = tk.StringVar(value=general_cfg.get('geoip_path', ''))
         self.failure_threshold_var = tk.IntVar(value=general_cfg.get('failure_threshold', 3))
         self.auto_retest_enabled_var = tk.BooleanVar(value=general_cfg.get('auto_retest_enabled', False))
         self.auto_retest_interval_var = tk.IntVar(value=general_cfg.get('auto_retest_interval', 10))
 
+        # 服务设置
+        server_cfg = self.settings.get('server', {})
+        self.server_engine_var = tk.StringVar(value=server_cfg.get('engine', 'thread'))
+
         # 自动爬取设置
         fetch_cfg = self.settings.get('auto_fetch', {})
         # Fofa
@@ -92,6 +103,13 @@ class SettingsWindow(tk.Toplevel):
         validation_frame.pack(fill=tk.X, expand=True, pady=(0, 10))
         ttk.Label(validation_frame, text="质量验证线程数:").pack(side=tk.LEFT, padx=(0, 10))
         ttk.Spinbox(validation_frame, from_=10, to=500, increment=10, textvariable=self.validation_threads_var, width=15).pack(side=tk.LEFT)
+        ttk.Label(validation_frame, text="验证引擎:").pack(side=tk.LEFT, padx=(20, 10))
+        ttk.Combobox(validation_frame, textvariable=self.checker_engine_var, values=('thread', 'asyncio'), state="readonly", width=13).pack(side=tk.LEFT)
+
+        geoip_frame = ttk.Labelframe(self.general_frame, text="离线IP地址库 (.mmdb / CSV，留空则使用在线接口查询归属地)", padding=10)
+        geoip_frame.pack(fill=tk.X, expand=True, pady=(0, 10))
+        ttk.Entry(geoip_frame, textvariable=self.geoip_path_var).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+        ttk.Button(geoip_frame, text="浏览...", command=self._browse_geoip).pack(side=tk.LEFT)
 
         failure_frame = ttk.Labelframe(self.general_frame, text="失败代理清理设置", padding=10)
         failure_frame.pack(fill=tk.X, expand=True, pady=(0, 10))
@@ -107,6 +125,19 @@ class SettingsWindow(tk.Toplevel):
         ttk.Label(retest_interval_frame, text="重测间隔 (分钟):").pack(side=tk.LEFT, padx=(0, 10))
         ttk.Spinbox(retest_interval_frame, from_=1, to=120, textvariable=self.auto_retest_interval_var, width=15).pack(side=tk.LEFT)
 
+        server_frame = ttk.Labelframe(self.general_frame, text="服务设置", padding=10)
+        server_frame.pack(fill=tk.X, expand=True, pady=(0, 10))
+        ttk.Label(server_frame, text="服务引擎:").pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Combobox(server_frame, textvariable=self.server_engine_var, values=('thread', 'asyncio'), state="readonly", width=13).pack(side=tk.LEFT)
+
+    def _browse_geoip(self):
+        path = filedialog.askopenfilename(
+            parent=self, title="选择离线IP地址库",
+            filetypes=[("IP地址库", "*.mmdb *.csv"), ("All files", "*.*")]
+        )
+        if path:
+            self.geoip_path_var.set(path)
+
     def _create_auto_fetch_tab(self):
         """创建自动爬取选项卡的内容"""
         # --- FOFA ---
@@ -177,11 +208,18 @@ class SettingsWindow(tk.Toplevel):
         """从所有变量中收集设置数据"""
         return {
             'general': {
+                **self.settings.get('general', {}),
                 'validation_threads': self.validation_threads_var.get(),
+                'checker_engine': self.checker_engine_var.get(),
+                'geoip_path': self.geoip_path_var.get().strip(),
                 'failure_threshold': self.failure_threshold_var.get(),
                 'auto_retest_enabled': self.auto_retest_enabled_var.get(),
                 'auto_retest_interval': self.auto_retest_interval_var.get()
             },
+            'server': {
+                **self.settings.get('server', {}),
+                'engine': self.server_engine_var.get(),
+            },
             'auto_fetch': {
                 'fofa': {
                     'enabled': self.fofa_enabled_var.get(),
@@ -236,9 +274,46 @@ class ProxyPoolApp:
         self.settings = {
             'general': {
                 'validation_threads': 100,
+                'checker_engine': 'thread',
+                'async_concurrency': 1000,
+                'precheck_concurrency': 10000,
+                'check_keepalive': True,
+                'handshake_probe': True,
+                'protocol_detect': True,
+                'geoip_path': '',
                 'failure_threshold': 3,
                 'auto_retest_enabled': False,
-                'auto_retest_interval': 10
+                'auto_retest_interval': 10,
+                'store_enabled': True,
+                'store_path': 'proxy_pool.db',
+                'store_max_age': 24
+            },
+            'server': {
+                'engine': 'thread',
+                'connect_timeout': 10,
+                'idle_timeout': 300,
+                'pool_size': 2,
+                'pool_top_n': 3,
+                'pool_idle_timeout': 30,
+                'relay_mode': 'auto',
+                'race_count': 1,
+                'race_delay': 0.3,
+                'selection_strategy': 'round_robin',
+                'max_attempts': 3,
+                'retry_deadline': 15,
+                'workers': 1,
+                'socks5_early_reply': False,
+                'metrics_port': 1802,
+                'session_affinity': 'off',
+                'session_ttl': 600,
+                'max_connections': 2000,
+                'max_per_upstream': 256,
+                'listen_backlog': 128,
+                'breaker_window': 20,
+                'breaker_failure_ratio': 0.5,
+                'breaker_min_calls': 5,
+                'breaker_cooldown': 30,
+                'breaker_half_open_trials': 2,
             },
             'auto_fetch': {
                 'fofa': {'enabled': True, 'key': '', 'query': 'protocol=="socks5" && country=="CN" && banner="Method:No"', 'size': 500},
@@ -255,6 +330,7 @@ class ProxyPoolApp:
         self.asset_searcher = AssetSearcher(self.log_queue)
         self.checker = ProxyChecker()
         self.rotator = ProxyRotator()
+        self.store = None
         self.displayed_proxies = set()
         self.proxy_to_tree_item_map = {}
 
@@ -278,12 +354,73 @@ class ProxyPoolApp:
         
         # 2. Now it's safe to load settings, which might call self.log()
         self.load_settings_from_file()
+        self.checker.configure(self.settings['general'])
+        self._open_geoip()
+        self._open_store()
 
         # 3. Set up remaining parts of the application
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
         threading.Thread(target=self.checker.initialize_public_ip, args=(self.log_queue,), daemon=True).start()
         threading.Thread(target=self._run_builtin_check, daemon=True).start()
         self.process_log_queue()
+        self._warm_start()
+
+    def _open_geoip(self):
+        """加载设置中的离线IP地址库，失败时归属地查询仍使用在线接口。"""
+        path = self.settings['general'].get('geoip_path', '')
+        loaded = self.checker.geoip
+        try:
+            geoip = self.checker.load_geoip(path)
+        except (OSError, ValueError) as e:
+            self.log(f"[!] 加载离线IP地址库失败，归属地查询使用在线接口: {e}")
+            return
+        if geoip is not None and geoip is not loaded:
+            self.log(f"[Checker] 已加载离线IP地址库: {path} ({len(geoip)} 条)")
+
+    def _open_store(self):
+        """打开持久化存储，失败时仅在内存中运行。相对路径以程序所在目录为准，而非当前工作目录。"""
+        general = self.settings['general']
+        if not general.get('store_enabled', True):
+            return
+        path = os.path.join(APP_DIR, os.path.expanduser(general.get('store_path') or 'proxy_pool.db'))
+        try:
+            self.store = ProxyStore(path, self.log_queue)
+        except Exception as e:
+            self.store = None
+            self.log(f"[!] 打开代理存储失败，本次仅在内存中保存代理池: {e}")
+
+    def _warm_start(self):
+        """从存储中恢复上次的代理池并立即投入使用，随后在后台重新验证其有效性。"""
+        if not self.store:
+            return
+        try:
+            records = self.store.load(max_age_hours=self.settings['general'].get('store_max_age'))
+            checks = self.store.recent_checks(self.rotator.scorer.window)
+        except Exception as e:
+            self.log(f"[!] 读取代理存储失败: {e}")
+            return
+        if not records:
+            return
+        # 先恢复评分历史，之后的验证在历史基础上继续累积，而不是从零开始
+        scorer = self.rotator.scorer
+        with self.rotator.batch():
+            for record in records:
+                for ok, latency, speed in checks.get(record['proxy'], ()):
+                    scorer.record_check(record['proxy'], ok, latency, speed)
+                self.rotator.add_proxy(record)
+                self.displayed_proxies.add(record['proxy'])
+        self._refresh_treeview()
+        self.sort_treeview_column('score', True)
+        working = self.rotator.get_active_proxies_count()
+        self.log(f"已从存储恢复 {len(records)} 个代理 (可用 {working} 个)，即将在后台重新验证。")
+        self.root.after(1000, self._perform_freshness_check)
+
+    def _perform_freshness_check(self):
+        if self.is_running_task:
+            # 有任务在运行 (例如用户已开始获取代理)，稍后再试
+            self.root.after(5000, self._perform_freshness_check)
+            return
+        self.start_revalidate_thread()
 
     def _create_widgets(self):
         main_frame = ttk.Frame(self.root, padding=10)
@@ -326,6 +463,16 @@ class ProxyPoolApp:
         self.region_combobox.bind('<<ComboboxSelected>>', self._refresh_treeview)
         self.region_combobox.set("全部国家")
 
+        self.protocol_combobox = ttk.Combobox(region_panel, state="readonly", width=8, values=["全部协议", "HTTP", "SOCKS4", "SOCKS5"])
+        self.protocol_combobox.pack(side=tk.LEFT, padx=(0, 5), pady=5)
+        self.protocol_combobox.bind('<<ComboboxSelected>>', self._refresh_treeview)
+        self.protocol_combobox.set("全部协议")
+
+        self.anonymity_combobox = ttk.Combobox(region_panel, state="readonly", width=10, values=["全部匿名度", "Elite", "Anonymous", "Transparent"])
+        self.anonymity_combobox.pack(side=tk.LEFT, padx=(0, 5), pady=5)
+        self.anonymity_combobox.bind('<<ComboboxSelected>>', self._refresh_treeview)
+        self.anonymity_combobox.set("全部匿名度")
+
         quality_filter_frame = ttk.Frame(region_panel)
         quality_filter_frame.pack(side=tk.LEFT, padx=5, pady=5)
         
@@ -408,6 +555,8 @@ class ProxyPoolApp:
         """保存设置回调函数"""
         self.settings.update(new_settings)
         self.save_settings_to_file()
+        self.checker.configure(self.settings['general'])
+        self._open_geoip()
         self.log("设置已保存。")
         
         if self.settings['general']['auto_retest_enabled']:
@@ -522,40 +671,45 @@ class ProxyPoolApp:
         except (ValueError, TclError):
             return None
 
-    def _refresh_treeview(self, event=None):
-        quality_latency = self._get_quality_latency_ms()
-        self._update_regions_and_counts(quality_latency=quality_latency)
-        
+    def _get_selected_region(self):
+        """下拉框中选择的国家/地区，选择全部时返回 None。"""
         selected_item = self.region_combobox.get()
-        region_key = "全部国家"
         if selected_item and selected_item != "全部国家":
             match = re.match(r"(.+?)\s*\(\d+\)", selected_item)
             if match:
-                region_key = match.group(1).strip()
+                return match.group(1).strip()
+        return None
+
+    def _build_query(self, **overrides):
+        """按界面上的筛选条件 (国家/地区、协议、匿名度、优质延迟) 构造查询，用于列表、轮换与导出。"""
+        protocol = self.protocol_combobox.get()
+        anonymity = self.anonymity_combobox.get()
+        conditions = {
+            'regions': self._get_selected_region(),
+            'protocols': None if protocol == "全部协议" else protocol,
+            'anonymity': None if anonymity == "全部匿名度" else anonymity,
+            'max_latency_ms': self._get_quality_latency_ms(),
+        }
+        conditions.update(overrides)
+        return ProxyQuery(**conditions)
+
+    def _refresh_treeview(self, event=None):
+        quality_latency = self._get_quality_latency_ms()
+        self._update_regions_and_counts(quality_latency=quality_latency)
+        region_key = self._get_selected_region() or "全部国家"
         
-        all_proxies = sorted(
-            self.rotator.get_all_proxies_for_revalidation(),
-            key=lambda p: (p.get('status') == 'Working', p.get('score', 0)),
-            reverse=True
-        )
+        if self.use_quality_filter_var.get():
+            all_proxies = self.rotator.query(self._build_query())
+        else:
+            # 未启用优质筛选时同时列出失效代理，排在可用代理之后
+            all_proxies = self.rotator.query(self._build_query(status=None))
+            all_proxies.sort(key=lambda p: p.get('status') != 'Working')
         
         self.tree.delete(*self.tree.get_children())
         self.proxy_to_tree_item_map.clear()
         
         for p_info in all_proxies:
-            region_match = (region_key == "全部国家" or p_info.get('location') == region_key)
-            if not region_match:
-                continue
-            
             is_working = p_info.get('status') == 'Working'
-            
-            if self.use_quality_filter_var.get():
-                if not is_working: continue
-                
-                latency_ms = p_info.get('latency', float('inf')) * 1000
-                if quality_latency is not None and latency_ms > quality_latency:
-                    continue
-
             score = p_info.get('score', 0)
             latency_val = p_info.get('latency', float('inf'))
             tags = () if is_working else ('unavailable',)
@@ -623,29 +777,16 @@ class ProxyPoolApp:
         is_first_proxy = self.rotator.get_active_proxies_count() == 0
         
         latency, speed, anonymity = result_dict['latency'], result_dict['speed'], result_dict['anonymity']
-        score = 0
-        if latency != float('inf'): score += (1 / latency) * 50
-        score += speed * 10
-        if anonymity == 'Elite': score += 50
-        elif anonymity == 'Anonymous': score += 20
+        self.rotator.scorer.record_check(proxy_address, True, latency, speed)
+        score = self.rotator.scorer.score(proxy_address, anonymity)
         result_dict['score'] = score
         
         self.rotator.add_proxy(result_dict)
+        if self.store:
+            self.store.save(result_dict)
+            self.store.record_check(proxy_address, True, latency, speed)
         
-        region_key = "全部国家"
-        selected_item = self.region_combobox.get()
-        if selected_item and selected_item != "全部国家":
-            match = re.match(r"(.+?)\s*\(\d+\)", selected_item)
-            if match: region_key = match.group(1).strip()
-        
-        quality_latency = self._get_quality_latency_ms()
-        
-        region_match = (region_key == "全部国家" or result_dict.get('location') == region_key)
-        quality_match = True
-        if quality_latency is not None:
-            quality_match = (latency * 1000 <= quality_latency)
-
-        if region_match and quality_match:
+        if self._build_query().matches(result_dict):
             display_values = (
                 f"{score:.1f}", anonymity, result_dict['protocol'], proxy_address,
                 f"{latency * 1000:.1f}", f"{speed:.2f}", result_dict['location']
@@ -670,7 +811,7 @@ class ProxyPoolApp:
             except (AttributeError, TclError):
                 pass
 
-        regions_with_counts = self.rotator.get_available_regions_with_counts(quality_latency_ms=quality_latency)
+        regions_with_counts = self.rotator.get_available_regions_with_counts(query=self._build_query(max_latency_ms=quality_latency))
         current_selection = self.region_combobox.get()
         
         if regions_with_counts:
@@ -784,6 +925,7 @@ class ProxyPoolApp:
         if self.rotator.remove_proxy(proxy_address):
             if proxy_address in self.displayed_proxies:
                 self.displayed_proxies.remove(proxy_address)
+            if self.store: self.store.delete(proxy_address)
             
             self.log(f"已手动删除代理: {proxy_address}")
             self._refresh_treeview()
@@ -791,19 +933,10 @@ class ProxyPoolApp:
             self.log(f"错误: 尝试删除的代理 {proxy_address} 在后端未找到。")
 
     def rotate_proxy(self):
-        selected_item = self.region_combobox.get()
-        region_key = "All"
-        display_region = "全部国家"
-        
-        if selected_item and selected_item != "全部国家":
-            match = re.match(r"(.+?)\s*\(\d+\)", selected_item)
-            if match:
-                region_key = match.group(1).strip()
-                display_region = region_key
-    
+        display_region = self._get_selected_region() or "全部国家"
         quality_latency = self._get_quality_latency_ms()
         
-        self.rotator.set_filters(region=region_key, quality_latency_ms=quality_latency)
+        self.rotator.set_query(self._build_query())
         proxy_info = self.rotator.get_next_proxy()
         
         mode_str = f"优质(<{quality_latency}ms)" if quality_latency is not None else "常规"
@@ -833,6 +966,7 @@ class ProxyPoolApp:
             self.log("正在清空所有代理...")
             self.rotator.clear()
             self.displayed_proxies.clear()
+            if self.store: self.store.clear()
             self._stop_auto_retest_timer()
             self.log("所有代理已清空。")
             self._refresh_treeview()
@@ -870,7 +1004,8 @@ class ProxyPoolApp:
             filetypes=[("Text and JSON files", "*.txt *.json"), ("All files", "*.*")]
         )
         if not file_path: return
-        proxies_by_protocol = {'http': [], 'socks4': [], 'socks5': []}
+        # 未标注协议的代理放在 'auto' 下，由验证器识别实际协议
+        proxies_by_protocol = {'http': [], 'socks4': [], 'socks5': [], 'auto': []}
         valid_parse_protocols = {'http', 'https', 'socks4', 'socks5'}
         try:
             _, ext = os.path.splitext(file_path)
@@ -879,7 +1014,7 @@ class ProxyPoolApp:
                     data = json.load(f)
                     if isinstance(data, list):
                         for item in data:
-                            url, protocol = item.get('url'), item.get('protocol', 'http').lower()
+                            url, protocol = item.get('url'), item.get('protocol', 'auto').lower()
                             if url:
                                 parsed = re.match(r'(\w+)://(.+)', url)
                                 if parsed: protocol, proxy = parsed.groups()
@@ -892,7 +1027,7 @@ class ProxyPoolApp:
                     for line in f:
                         line = line.strip()
                         if not line or line.startswith('#'): continue
-                        protocol, proxy_address = 'http', line
+                        protocol, proxy_address = 'auto', line
                         match = re.match(r'(\w+)://(.+)', line)
                         if match:
                             proto_part, proxy_part = match.groups()
@@ -929,14 +1064,14 @@ class ProxyPoolApp:
 
         self.run_validation_task(proxies_by_protocol, validation_mode='online')
 
-    def run_validation_task(self, proxies_by_protocol, validation_mode='online'):
+    def run_validation_task(self, proxies_by_protocol, validation_mode='online', detect_protocols=None):
         total_to_validate = sum(len(v) for v in proxies_by_protocol.values())
         if self.root.winfo_exists(): self.root.after(0, self.progress_bar.config, {'maximum': total_to_validate})
         if total_to_validate > 0:
             self.checker.validate_all(
                 proxies_by_protocol, self.result_queue, self.log_queue, validation_mode,
                 max_workers=self.settings['general']['validation_threads'],
-                cancel_event=self.cancel_event
+                cancel_event=self.cancel_event, detect_protocols=detect_protocols
             )
         else:
             self.result_queue.put(None) 
@@ -971,7 +1106,8 @@ class ProxyPoolApp:
             proxy = p_info.get('proxy')
             if proxy:
                 proxies_by_protocol[protocol].append(proxy)
-        self.run_validation_task(proxies_by_protocol, 'online')
+        # 池中代理的协议已经识别过，重测时不再探测
+        self.run_validation_task(proxies_by_protocol, 'online', detect_protocols=False)
 
     def process_revalidate_queue(self):
         if not self.is_running_task:
@@ -996,11 +1132,8 @@ class ProxyPoolApp:
             
             if result_dict.get('status') == 'Working':
                 latency, speed, anonymity = result_dict['latency'], result_dict['speed'], result_dict['anonymity']
-                score = 0
-                if latency != float('inf'): score += (1 / latency) * 50
-                score += speed * 10
-                if anonymity == 'Elite': score += 50
-                elif anonymity == 'Anonymous': score += 20
+                self.rotator.scorer.record_check(proxy_address, True, latency, speed)
+                score = self.rotator.scorer.score(proxy_address, anonymity)
                 
                 update_data = {
                     'score': score, 'status': 'Working', 'consecutive_failures': 0,
@@ -1008,6 +1141,9 @@ class ProxyPoolApp:
                     'location': result_dict['location']
                 }
                 self.rotator.update_proxy(proxy_address, update_data)
+                if self.store:
+                    self.store.save(original_proxy_info)
+                    self.store.record_check(proxy_address, True, latency, speed)
 
                 if self.tree.exists(tree_item_id):
                     display_values = (
@@ -1018,18 +1154,28 @@ class ProxyPoolApp:
                 self.log(f"更新: {proxy_address} | 分数: {score:.1f} | 延迟: {latency*1000:.1f}ms")
             else: 
                 new_failures = original_proxy_info.get('consecutive_failures', 0) + 1
+                self.rotator.scorer.record_check(proxy_address, False)
+                if self.store: self.store.record_check(proxy_address, False)
                 
                 if new_failures >= self.settings['general']['failure_threshold']:
                     self.log(f"测试失败超阈值({self.settings['general']['failure_threshold']}次)，正在移除: {proxy_address}")
                     if self.rotator.remove_proxy(proxy_address):
                         if proxy_address in self.displayed_proxies:
                             self.displayed_proxies.remove(proxy_address)
+                        if self.store: self.store.delete(proxy_address)
                         if self.tree.exists(tree_item_id):
                             self.tree.delete(tree_item_id)
                 else:
                     self.log(f"测试失败: {proxy_address} (第 {new_failures} 次)")
-                    update_data = {'status': 'Unavailable', 'consecutive_failures': new_failures}
+                    update_data = {
+                        'status': 'Unavailable', 'consecutive_failures': new_failures,
+                        'score': self.rotator.scorer.score(
+                            proxy_address, original_proxy_info.get('anonymity'),
+                            original_proxy_info.get('latency'), original_proxy_info.get('speed')
+                        )
+                    }
                     self.rotator.update_proxy(proxy_address, update_data)
+                    if self.store: self.store.save(original_proxy_info)
                     if self.tree.exists(tree_item_id):
                         values = list(self.tree.item(tree_item_id, 'values'))
                         values[0] = "N/A"
@@ -1076,9 +1222,10 @@ class ProxyPoolApp:
         self.log(f"已复制到剪贴板: {proxy_address}")
         
     def export_proxies(self):
-        working_proxies = [p for p in self.rotator.get_all_proxies_for_revalidation() if p.get('status') == 'Working']
+        # 按界面上当前的筛选条件导出
+        working_proxies = self.rotator.query(self._build_query())
         if not working_proxies:
-            messagebox.showwarning("无内容", "没有可用的代理可以导出。")
+            messagebox.showwarning("无内容", "当前筛选条件下没有可用的代理可以导出。")
             return
         
         file_path = filedialog.asksaveasfilename(title="导出可用代理到文件", defaultextension=".txt", filetypes=[("Text files", "*.txt"), ("CSV files", "*.csv"), ("JSON files", "*.json")])
@@ -1143,6 +1290,7 @@ class ProxyPoolApp:
                 messagebox.showwarning("启动失败", "代理池中无可用代理，无法启动服务。")
                 return
             if not self.rotator.get_current_proxy(): self.rotate_proxy()
+            self.proxy_server.configure(self.settings['server'])
             self.proxy_server.start_all()
             self.server_button.config(text="停止服务", style='danger.TButton')
             self.is_server_running = True
@@ -1152,6 +1300,7 @@ class ProxyPoolApp:
         self._stop_auto_retest_timer()
         self._stop_auto_rotate_timer()
         self.save_settings_to_file()
+        if self.store: self.store.close()
         self.root.destroy()
         
     def _stop_auto_rotate_timer(self):
@@ -1208,6 +1357,8 @@ class ProxyPoolApp:
             if self.is_auto_rotating: self.toggle_auto_rotate()
 
 if __name__ == "__main__":
+    # 多进程工作模式以 spawn 启动子进程，打包为可执行文件时需要
+    multiprocessing.freeze_support()
     # 确保在Windows上获得更清晰的字体渲染
     try:
         from ctypes import windll
@@ -0,0 +1,54 @@
+# modules/admission.py
+
+import threading
+from collections import defaultdict
+
+
+class AdmissionController:
+    """
+    并发准入控制：限制同时处理的客户端连接总数，以及经每个上游代理同时打开的连接数。上限为 0 表示不限制。
+    客户端连接数是硬上限，超出时应立即拒绝；上游连接数是选择上游时参考的软上限，
+    已满的上游会被跳过，请求溢出到下一个有余量的上游。
+    """
+    def __init__(self, max_connections=0, max_per_upstream=0):
+        self.max_connections = max_connections
+        self.max_per_upstream = max_per_upstream
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._upstreams = defaultdict(int)   # 代理地址 -> 当前打开的连接数
+
+    @property
+    def connections(self) -> int:
+        return self._connections
+
+    def try_admit(self) -> bool:
+        """为一个新的客户端连接占用名额，已满时返回 False。"""
+        with self._lock:
+            if self.max_connections and self._connections >= self.max_connections:
+                return False
+            self._connections += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._connections -= 1
+
+    def has_capacity(self, proxy_address: str) -> bool:
+        """判断上游是否还能再承担一个连接。"""
+        return not self.max_per_upstream or self._upstreams.get(proxy_address, 0) < self.max_per_upstream
+
+    def upstream_load(self, proxy_address: str) -> int:
+        """返回经该上游当前打开的连接数。"""
+        return self._upstreams.get(proxy_address, 0)
+
+    def acquire_upstream(self, proxy_address: str):
+        with self._lock:
+            self._upstreams[proxy_address] += 1
+
+    def release_upstream(self, proxy_address: str):
+        with self._lock:
+            remaining = self._upstreams[proxy_address] - 1
+            if remaining > 0:
+                self._upstreams[proxy_address] = remaining
+            else:
+                del self._upstreams[proxy_address]
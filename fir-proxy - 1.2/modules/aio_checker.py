@@ -0,0 +1,320 @@
+# modules/aio_checker.py
+
+import asyncio
+import json
+import ssl
+from urllib.parse import urlsplit
+
+from .aio_engine import _raise_nofile_limit
+from .handshake import async_open_tunnel, parse_proxy_info, ProxyHandshakeError
+from .http11 import HttpParseError, parse_response_head, response_body_framer
+from .scanner import ConnectScanner
+
+# 单次验证中视为代理不可用 (而非程序错误) 的异常
+_CHECK_ERRORS = (OSError, ValueError, EOFError, ProxyHandshakeError, HttpParseError,
+                 asyncio.TimeoutError, asyncio.LimitOverrunError)
+
+_END = object()
+
+
+def _dechunk(body: bytes) -> bytes:
+    """解码完整的 chunked 报文体。"""
+    out = bytearray()
+    pos = 0
+    while True:
+        nl = body.find(b"\r\n", pos)
+        if nl < 0:
+            raise HttpParseError("chunked 报文体不完整")
+        try:
+            size = int(body[pos:nl].split(b';', 1)[0], 16)
+        except ValueError:
+            raise HttpParseError("无效的 chunk 大小")
+        if size == 0:
+            return bytes(out)
+        out += body[nl + 2:nl + 2 + size]
+        pos = nl + 2 + size + 2
+
+
+async def _start_tls(reader, writer, server_hostname, context):
+    """在已建立的隧道上进行 TLS 握手，返回新的 (reader, writer)。"""
+    if hasattr(writer, 'start_tls'):
+        await writer.start_tls(context, server_hostname=server_hostname)
+        return reader, writer
+    # Python 3.10 没有 StreamWriter.start_tls，改用事件循环接口并重建 writer
+    loop = asyncio.get_running_loop()
+    protocol = writer.transport.get_protocol()
+    transport = await loop.start_tls(writer.transport, protocol, context, server_hostname=server_hostname)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+class AsyncCheckEngine:
+    """
+    基于 asyncio 的代理验证引擎，验证流程与判定标准同 ProxyChecker._full_check_proxy。
+    所有验证在一个事件循环上进行，同时进行的验证数由 ProxyChecker.async_concurrency 限制，
+    不再为每个验证占用一个线程，也不受 requests 连接池大小的限制；只有地理位置查询仍走线程池。
+    ProxyChecker.check_keepalive 为真时，一个代理的各验证阶段复用 keep-alive 隧道 (见 _CheckSession)，
+    结果中另外记录首个请求的建连耗时 connect_time 与首字节耗时 ttfb (秒)，speed 为不含建连的传输速率。
+    validate_all() 与 ProxyChecker.validate_all 的约定相同: 结果逐个放入 result_queue，正常结束时放入 None，
+    cancel_event 被设置后尽快停止且不放入 None。
+    """
+    CHUNK_SIZE = 65536
+    # 检查取消信号的间隔 (秒)
+    CANCEL_POLL = 0.2
+    SPEED_TIMEOUT = 15
+
+    def __init__(self, checker):
+        self._checker = checker
+        self._ssl = ssl.create_default_context()
+        self._user_agent = checker.session.headers.get('User-Agent', 'Mozilla/5.0')
+
+    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', cancel_event=None, detect_protocols=None):
+        _raise_nofile_limit()
+        concurrency = self._checker.async_concurrency
+        # 阶段一由 ConnectScanner 在单独的线程中批量预检，通过预检的代理经队列立即交给阶段二的协程
+        scanner = ConnectScanner(max_inflight=self._checker.precheck_concurrency, fd_reserve=ConnectScanner.FD_RESERVE + 2 * concurrency)
+        survivors = self._checker._precheck(proxies_by_protocol, scanner, log_queue, detect_protocols, cancel_event)
+        log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 (asyncio, 并发 {concurrency}，预检通过即开始) " + "="*20)
+        asyncio.run(self._validate_all(survivors, result_queue, log_queue, validation_mode, cancel_event))
+
+    # --- 任务调度 ---
+    async def _run_bounded(self, source: asyncio.Queue, handle, concurrency, cancel_event):
+        """以 concurrency 个协程依次处理 source 中的条目直到取到 _END，cancel_event 被设置时取消全部。返回是否被取消。"""
+        async def worker():
+            while True:
+                item = await source.get()
+                if item is _END:
+                    source.put_nowait(_END) # 留给其他协程
+                    return
+                await handle(item)
+
+        pending = {asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))}
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=self.CANCEL_POLL)
+            for task in done:
+                task.result()
+            if cancel_event and cancel_event.is_set():
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                return True
+        return False
+
+    async def _validate_all(self, prechecked, result_queue, log_queue, validation_mode, cancel_event):
+        loop = asyncio.get_running_loop()
+        survivors = asyncio.Queue()
+
+        def precheck():
+            try:
+                for p_info in prechecked:
+                    loop.call_soon_threadsafe(survivors.put_nowait, p_info)
+            finally:
+                loop.call_soon_threadsafe(survivors.put_nowait, _END)
+
+        prechecking = loop.run_in_executor(None, precheck)
+
+        async def full_check(p_info):
+            try:
+                result = await self._full_check(p_info, validation_mode, cancel_event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_queue.put(f"[!] 验证协程出现异常: {e}")
+                return
+            if result:
+                result_queue.put(result)
+
+        cancelled = await self._run_bounded(survivors, full_check, self._checker.async_concurrency, cancel_event)
+        await prechecking # 取消时预检线程也会在 CANCEL_POLL 内退出
+        if cancelled:
+            log_queue.put("[Checker] 任务在完整验证阶段被用户取消。")
+        else:
+            result_queue.put(None)
+
+    # --- 单个代理的验证 ---
+    async def _full_check(self, proxy_info: dict, validation_mode: str, cancel_event=None):
+        checker = self._checker
+        targets = checker.validation_targets
+        loop = asyncio.get_running_loop()
+        proxy = proxy_info['proxy']
+        result = {
+            'proxy': proxy, 'protocol': proxy_info['protocol'].upper(), 'status': 'Failed',
+            'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
+        }
+        if 'protocols' in proxy_info:
+            result['protocols'] = proxy_info['protocols']
+        cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+        session = _CheckSession(self, proxy_info, checker.check_keepalive)
+
+        try:
+            response = await session.request('HEAD', targets['latency_check'], checker.timeout)
+            if response.status >= 400:
+                return result
+            result['latency'] = response.elapsed
+            result['connect_time'] = response.connect_time
+            result['ttfb'] = response.ttfb
+            if cancelled(): return None
+
+            response = await session.request('GET', targets['anonymity_check'], checker.timeout)
+            if response.status >= 400:
+                return result
+            result['anonymity'] = checker._classify_anonymity(json.loads(response.body))
+            if result['anonymity'] == 'Transparent':
+                return result # 透明代理，直接返回，不再测速
+            if cancelled(): return None
+
+            # 延迟低于7秒的才进行测速
+            if result['latency'] <= 7.0:
+                speed_check_url = targets['latency_check'] if validation_mode == 'online' else targets['speed_check']
+                try:
+                    response = await session.request('GET', speed_check_url, checker.timeout, self.SPEED_TIMEOUT)
+                    # 传输速率只计发出请求到收完报文体的时间，不含建连与代理握手
+                    transfer_time = response.elapsed - response.connect_time
+                    if response.status < 400 and transfer_time > 0 and response.body:
+                        result['speed'] = (len(response.body) / transfer_time) * 8 / (1000**2)
+                except _CHECK_ERRORS:
+                    pass # 测速失败不影响整体结果
+            if cancelled(): return None
+
+            ip = proxy.split(":")[0]
+            # 离线地址库能查到时直接在事件循环中完成，否则在线程中调用在线接口
+            result['location'] = checker._get_offline_location(ip) or \
+                await loop.run_in_executor(None, checker._get_proxy_location, ip)
+            result['status'] = 'Working'
+            return result
+        except _CHECK_ERRORS:
+            return result
+        finally:
+            session.close()
+
+    # --- 经代理的 HTTP 请求 ---
+    async def _open(self, proxy_info, scheme, host, port, timeout):
+        """连接到能发出请求的位置，返回 (reader, writer, 是否使用绝对 URL)。"""
+        proxy_host, proxy_port, proto = parse_proxy_info(proxy_info)
+        if proto == 'HTTP' and scheme == 'http':
+            # 明文请求直接发给 HTTP 代理，与 requests 的行为一致
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy_host, proxy_port), timeout)
+            return reader, writer, True
+        tunnel_host = host
+        if proto == 'SOCKS4':
+            # 与握手探测及线程引擎相同，目标域名在本地解析 (TLS 仍以原域名握手)
+            tunnel_host = self._checker._socks4_targets.get(host) or \
+                await asyncio.get_running_loop().run_in_executor(None, self._checker._socks4_target, host)
+        reader, writer = await async_open_tunnel(proxy_info, tunnel_host, port, timeout)
+        if scheme == 'https':
+            try:
+                reader, writer = await asyncio.wait_for(_start_tls(reader, writer, host, self._ssl), timeout)
+            except BaseException:
+                writer.close()
+                raise
+        return reader, writer, False
+
+    async def _read_response(self, reader, method):
+        """读取一个完整响应，返回 (响应头, 报文体, 收到响应头的时刻, 连接能否继续复用)。"""
+        buf = bytearray()
+        while True:
+            parsed = parse_response_head(buf)
+            if parsed is None:
+                data = await reader.read(self.CHUNK_SIZE)
+                if not data:
+                    raise ConnectionResetError("响应头未接收完整时连接已关闭")
+                buf += data
+                continue
+            head, consumed = parsed
+            del buf[:consumed]
+            if 100 <= head.status < 200:
+                continue # 跳过 1xx 中间响应
+            break
+        head_at = asyncio.get_running_loop().time()
+
+        framer = response_body_framer(head, method)
+        body = bytearray()
+        while not framer.done:
+            if not buf:
+                data = await reader.read(self.CHUNK_SIZE)
+                if not data:
+                    if framer.mode == 'eof':
+                        break
+                    raise ConnectionResetError("报文体未接收完整时连接已关闭")
+                buf += data
+            n = framer.feed(buf)
+            body += buf[:n]
+            del buf[:n]
+        reusable = head.keep_alive and framer.mode != 'eof' and not buf
+        if framer.mode == 'chunked':
+            return head, _dechunk(bytes(body)), head_at, reusable
+        return head, bytes(body), head_at, reusable
+
+
+class _Response:
+    __slots__ = ('status', 'body', 'connect_time', 'ttfb', 'elapsed')
+
+    def __init__(self, status, body, connect_time, ttfb, elapsed):
+        self.status = status
+        self.body = body
+        self.connect_time = connect_time  # 建立连接 (含代理握手与 TLS) 的耗时，复用连接时为 0
+        self.ttfb = ttfb                  # 发出请求到收到响应头的耗时
+        self.elapsed = elapsed            # 整个请求的耗时
+
+
+class _CheckSession:
+    """
+    一个代理一次验证中各阶段的请求。keep_alive 为真时，同一目标 (协议、主机、端口) 的请求复用同一条隧道，
+    经 HTTP 代理的明文请求复用同一条到代理的连接，省去重复的建连、代理握手与 TLS 握手；
+    否则每个请求单独建连并以 Connection: close 结束。
+    """
+
+    def __init__(self, engine, proxy_info, keep_alive=True):
+        self._engine = engine
+        self._proxy_info = proxy_info
+        self._keep_alive = keep_alive
+        self._is_http_proxy = proxy_info['protocol'].upper() == 'HTTP'
+        self._conns = {}       # 连接键 -> (reader, writer, 是否使用绝对 URL)
+        self.connections = 0   # 本次验证建立的连接数
+
+    async def request(self, method, url, timeout, read_timeout=None) -> _Response:
+        """经代理发出一个请求并读完响应。timeout 限制建连，read_timeout 限制读取响应 (默认同 timeout)。"""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = 'proxy' if self._is_http_proxy and scheme == 'http' else (scheme, parts.hostname, port)
+        loop = asyncio.get_running_loop()
+
+        started = loop.time()
+        conn = self._conns.pop(key, None)
+        reused = conn is not None
+        if conn is None:
+            conn = await self._engine._open(self._proxy_info, scheme, parts.hostname, port, timeout)
+            self.connections += 1
+        sent = loop.time()
+        reader, writer, absolute = conn
+        target = url if absolute else (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        try:
+            writer.write((
+                f"{method} {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: {self._engine._user_agent}\r\n"
+                f"Accept: */*\r\nConnection: {'keep-alive' if self._keep_alive else 'close'}\r\n\r\n"
+            ).encode('latin-1'))
+            await writer.drain()
+            head, body, head_at, reusable = await asyncio.wait_for(
+                self._engine._read_response(reader, method), read_timeout or timeout
+            )
+        except ConnectionError:
+            writer.close()
+            if reused:
+                # 复用的连接可能已被对端关闭，换一条新连接重试一次
+                return await self.request(method, url, timeout, read_timeout)
+            raise
+        except BaseException:
+            writer.close()
+            raise
+        finished = loop.time()
+
+        if self._keep_alive and reusable:
+            self._conns[key] = conn
+        else:
+            writer.close()
+        return _Response(head.status, body, sent - started, head_at - sent, finished - started)
+
+    def close(self):
+        for _, writer, _ in self._conns.values():
+            writer.close()
+        self._conns.clear()
@@ -0,0 +1,534 @@
+# modules/aio_engine.py
+
+import asyncio
+import threading
+
+from .handshake import async_open_tunnel, async_open_tunnel_on, ProxyHandshakeError, TargetConnectError
+from .http11 import (
+    HttpParseError, parse_request_head, parse_response_head, request_body_framer, response_body_framer,
+    CONNECT_ESTABLISHED, BAD_REQUEST, BAD_GATEWAY,
+)
+from .socks5 import Socks5Handshake, Socks5ParseError, build_reply, REPLY_SUCCEEDED, REPLY_HOST_UNREACHABLE
+
+
+def _raise_nofile_limit(target=65536):
+    """尽量提高进程文件描述符上限，以容纳上万条并发隧道（Windows 下无此限制接口）。"""
+    try:
+        import resource
+    except ImportError:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY:
+            target = min(target, hard)
+        if soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ValueError, OSError):
+        pass
+
+
+class _Tunnel:
+    """一条已建立隧道的轻量状态，供空闲清理使用。"""
+    __slots__ = ('last_active', 'client_writer', 'remote_writer')
+
+    def __init__(self, now, client_writer, remote_writer):
+        self.last_active = now
+        self.client_writer = client_writer
+        self.remote_writer = remote_writer
+
+    def close(self):
+        self.client_writer.close()
+        self.remote_writer.close()
+
+
+class AsyncioEngine:
+    """
+    asyncio 服务引擎：在单个事件循环线程中同时运行 HTTP 和 SOCKS5 监听。
+    每条隧道只占用两个协程，而不是一个阻塞线程，可以承载上万条空闲长连接。
+    """
+    CHUNK_SIZE = 65536
+    SWEEP_INTERVAL = 30
+
+    def __init__(self, server):
+        self._server = server
+        self._loop = None
+        self._thread = None
+        self._stop_event = None
+        self._ready = threading.Event()
+        self._tunnels = set()
+
+    def log(self, message):
+        self._server.log(message)
+
+    def start(self):
+        _raise_nofile_limit()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """从其他线程请求事件循环退出，并等待其结束。"""
+        self._ready.wait(timeout=5)
+        loop = self._loop
+        if loop and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        try:
+            loop.run_until_complete(self._serve())
+        finally:
+            loop.close()
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        self._ready.set()
+        s = self._server
+        listeners = (
+            ("HTTP", self._handle_http_client, s._http_host, s._http_port),
+            ("SOCKS5", self._handle_socks5_client, s._socks5_host, s._socks5_port),
+        )
+        servers = []
+        for name, handler, host, port in listeners:
+            try:
+                srv = await asyncio.start_server(handler, host, port, reuse_address=True,
+                                                 reuse_port=s.reuse_port or None, backlog=s.listen_backlog)
+                servers.append(srv)
+                self.log(f"{name} 代理服务接口已启动于 {host}:{port} (asyncio)")
+            except Exception as e:
+                self.log(f"[!] 启动 {name} 服务失败: {e}")
+
+        sweeper = asyncio.create_task(self._sweep_idle())
+        await self._stop_event.wait()
+
+        sweeper.cancel()
+        for srv in servers:
+            srv.close()
+        for tunnel in list(self._tunnels):
+            tunnel.close()
+        pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.log("asyncio 代理服务循环已退出。")
+
+    async def _sweep_idle(self):
+        """定期关闭长时间没有数据往来的隧道。"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            deadline = loop.time() - self._server.idle_timeout
+            for tunnel in [t for t in self._tunnels if t.last_active < deadline]:
+                tunnel.close()
+
+    async def _open_pooled(self, proxy_info, target_host, target_port, timeout):
+        """
+        尝试在连接池的预热连接上完成握手，预热连接失效时返回 None 以便回退到新建连接；
+        目标不可达 (TargetConnectError) 与连接新旧无关，直接抛出。
+        """
+        pool = self._server._pool
+        sock = pool.acquire(proxy_info) if pool else None
+        if not sock:
+            return None
+        try:
+            return await async_open_tunnel_on(sock, proxy_info, target_host, target_port,
+                                              timeout=timeout, greeted=True)
+        except TargetConnectError:
+            sock.close()
+            raise
+        except (OSError, ProxyHandshakeError, asyncio.TimeoutError):
+            sock.close()
+            return None
+
+    async def _connect_via(self, proxy_info, target_host, target_port, timeout=None):
+        """经指定上游代理建立到目标地址的隧道，优先使用连接池中的预热连接。"""
+        timeout = timeout or self._server.connect_timeout
+        loop_time = asyncio.get_running_loop().time
+        started = loop_time()
+        tunnel = await self._open_pooled(proxy_info, target_host, target_port, timeout)
+        if not tunnel:
+            tunnel = await async_open_tunnel(proxy_info, target_host, target_port, timeout=timeout)
+        self._server._record_connect(proxy_info.get('proxy'), loop_time() - started)
+        return tunnel
+
+    async def _attempt(self, proxy_info, target_host, target_port, timeout=None):
+        """单次连接尝试，返回 (代理信息, 隧道或 None, 错误或 None)。"""
+        try:
+            return proxy_info, await self._connect_via(proxy_info, target_host, target_port, timeout), None
+        except (OSError, ValueError, ProxyHandshakeError, asyncio.TimeoutError) as e:
+            return proxy_info, None, e
+
+    async def _race_upstream(self, candidates, target_host, target_port, timeout):
+        """
+        按 race_delay 错开依次经多个候选上游连接目标，采用最先完成握手的隧道，返回 (代理信息, (reader, writer))。
+        其余尝试立即取消；取消前已经结束的尝试照常关闭隧道或上报失败。全部失败时返回 None。
+        """
+        delay = self._server.race_delay
+        pending = set()
+        winner = None
+        waiting = list(candidates)
+        while (waiting or pending) and not winner:
+            if waiting:
+                pending.add(asyncio.create_task(self._attempt(waiting.pop(0), target_host, target_port, timeout)))
+            done, pending = await asyncio.wait(pending, timeout=delay if waiting else None,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                proxy_info, tunnel, error = task.result()
+                if tunnel and winner is None:
+                    winner = (proxy_info, tunnel)
+                elif tunnel:
+                    tunnel[1].close()  # 同时完成的落败者
+                else:
+                    self._server._on_upstream_failure(proxy_info, error)
+
+        for task in pending:
+            task.cancel()  # 握手中途取消时 async_open_tunnel 会自行关闭连接
+        if pending:
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, BaseException):
+                    continue  # 被取消的尝试，失败并非上游所致
+                proxy_info, tunnel, error = result
+                if tunnel:
+                    tunnel[1].close()
+                else:
+                    self._server._on_upstream_failure(proxy_info, error)
+        return winner
+
+    async def _open_upstream(self, target_host, target_port, session=None):
+        """
+        从轮换器获取上游代理并异步建立到目标地址的隧道，返回 (代理信息, (reader, writer))，全部失败时返回 None。
+        返回的隧道占用该上游的一个并发名额，须经 _close_upstream 关闭。
+        失败时在总时限内换下一批上游重试，上游自身的故障会立即反馈给轮换器。
+        session 为会话粘滞的会话键，重试成功时会话改绑到新的代理。
+        """
+        s = self._server
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + s.retry_deadline
+        tried = set()
+        for attempt_no in range(max(1, s.max_attempts)):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            candidates = s._pick_candidates(tried, session)
+            if not candidates:
+                if not tried:
+                    self.log("[!] 代理池为空、无符合条件的代理或代理均已达到并发上限，无法转发请求。")
+                break
+            tried.update(p.get('proxy') for p in candidates)
+            timeout = min(s.connect_timeout, remaining)
+
+            if len(candidates) > 1:
+                winner = await self._race_upstream(candidates, target_host, target_port, timeout)
+                if not winner:
+                    continue
+                upstream_proxy_info, tunnel = winner
+                if session:
+                    s._sticky.bind(session, upstream_proxy_info.get('proxy'))
+                elif s.rotate_per_request or attempt_no or upstream_proxy_info is not s._rotator.get_current_proxy():
+                    self.log(f"竞速: {upstream_proxy_info.get('proxy')} -> {target_host}:{target_port}")
+                s._admission.acquire_upstream(upstream_proxy_info.get('proxy'))
+                return winner
+
+            upstream_proxy_info, tunnel, error = await self._attempt(candidates[0], target_host, target_port, timeout)
+            if not tunnel:
+                s._on_upstream_failure(upstream_proxy_info, error)
+                continue
+            addr = upstream_proxy_info.get('proxy')
+            if session:
+                if attempt_no:
+                    s._sticky.bind(session, addr)
+                    self.log(f"会话 {session} 改用: {addr}")
+            elif s.rotate_per_request:
+                self.log(f"轮换: {addr} -> {target_host}:{target_port}")
+            elif attempt_no:
+                self.log(f"重试: {addr} -> {target_host}:{target_port}")
+            s._admission.acquire_upstream(addr)
+            return upstream_proxy_info, tunnel
+
+        if tried:
+            self.log(f"[!] 已尝试 {len(tried)} 个上游代理，均无法连接 {target_host}:{target_port}")
+        return None
+
+    def _close_upstream(self, proxy_address, remote_writer):
+        """关闭经 _open_upstream 获得的隧道，并归还该上游的并发名额。"""
+        remote_writer.close()
+        self._server._admission.release_upstream(proxy_address)
+
+    def _reject(self, writer, listener):
+        """超出并发上限时立即拒绝客户端。"""
+        writer.write(self._server._rejection(listener))
+        writer.close()
+
+    async def _pipe(self, reader, writer, tunnel, meter):
+        loop_time = asyncio.get_running_loop().time
+        metrics = self._server.metrics
+        try:
+            while True:
+                data = await reader.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                tunnel.last_active = loop_time()
+                metrics.add(meter, len(data))
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            # 任意一方关闭即断开整条隧道，另一方向的读取随之收到 EOF
+            tunnel.close()
+
+    async def _relay(self, client_reader, client_writer, remote_reader, remote_writer, listener, upstream_addr):
+        """在客户端与上游之间双向转发数据，直到任意一方关闭。"""
+        tunnel = _Tunnel(asyncio.get_running_loop().time(), client_writer, remote_writer)
+        self._tunnels.add(tunnel)
+        meter_in = ('firproxy_bytes_total', listener, upstream_addr, 'in')
+        meter_out = ('firproxy_bytes_total', listener, upstream_addr, 'out')
+        downstream = asyncio.create_task(self._pipe(remote_reader, client_writer, tunnel, meter_in))
+        try:
+            await self._pipe(client_reader, remote_writer, tunnel, meter_out)
+            await downstream
+        finally:
+            downstream.cancel()
+            self._tunnels.discard(tunnel)
+
+    async def _recv_head(self, reader, buf, parse):
+        """读取直到 buf 中有一个完整的报文头，返回 (报文头, 原始字节)；连接在新报文开始前关闭时返回 None。"""
+        while True:
+            parsed = parse(buf)
+            if parsed:
+                head, consumed = parsed
+                raw = bytes(buf[:consumed])
+                del buf[:consumed]
+                return head, raw
+            data = await reader.read(self.CHUNK_SIZE)
+            if not data:
+                if buf:
+                    raise HttpParseError("报文头未接收完整时连接已关闭")
+                return None
+            buf += data
+
+    async def _relay_body(self, reader, writer, buf, framer, meter):
+        """按 framer 给出的边界把报文体原样转发，多读到的字节留在 buf 中属于下一个报文。meter 为字节计数的指标 key。"""
+        while not framer.done:
+            if not buf:
+                data = await asyncio.wait_for(reader.read(self.CHUNK_SIZE), self._server.idle_timeout)
+                if not data:
+                    if framer.mode == 'eof':
+                        return
+                    raise ConnectionResetError("报文体未接收完整时连接已关闭")
+                buf += data
+            n = framer.feed(buf)
+            if n:
+                writer.write(bytes(buf[:n]))
+                del buf[:n]
+                self._server.metrics.add(meter, n)
+                await writer.drain()
+
+    async def _relay_response(self, remote_reader, writer, remote_buf, request_method, meter):
+        """转发一个完整的响应（含 1xx 中间响应），返回 (最终响应头, 报文体 framer)；上游未作任何应答即关闭时返回 None。"""
+        while True:
+            received = await asyncio.wait_for(self._recv_head(remote_reader, remote_buf, parse_response_head),
+                                              self._server.idle_timeout)
+            if received is None:
+                return None
+            response, raw = received
+            writer.write(raw)
+            self._server.metrics.add(meter, len(raw))
+            if 100 <= response.status < 200 and response.status != 101:
+                continue
+            framer = response_body_framer(response, request_method)
+            if response.status != 101:
+                await self._relay_body(remote_reader, writer, remote_buf, framer, meter)
+            await writer.drain()
+            return response, framer
+
+    async def _handle_http_client(self, reader, writer):
+        """处理单个HTTP客户端连接。支持 keep-alive: 同一连接上的每个请求都按其自身的目标地址转发。"""
+        s = self._server
+        metrics = s.metrics
+        metrics.add(('firproxy_accepts_total', 'http'))
+        if not s._admission.try_admit():
+            self._reject(writer, 'http')
+            return
+        remote_reader = remote_writer = None
+        upstream_addr = None
+        remote_target = None
+        client_buf = bytearray()
+        remote_buf = bytearray()
+        try:
+            # 客户端已断开时 peername 为 None，放在 try 内以保证准入名额总能释放
+            client_host = (writer.get_extra_info('peername') or ('',))[0]
+            while True:
+                try:
+                    # 空闲的 keep-alive 客户端不能无限占用准入名额，_sweep_idle 只覆盖隧道
+                    received = await asyncio.wait_for(self._recv_head(reader, client_buf, parse_request_head),
+                                                      s.idle_timeout)
+                    if received is None:
+                        return
+                    request = received[0]
+                    target_host, target_port = request.target_address()
+                    body_framer = request_body_framer(request)
+                    session = s._session_key(client_host, target_host, request.proxy_username())
+                except (HttpParseError, ValueError):
+                    metrics.add(('firproxy_listener_errors_total', 'http', 'bad_request'))
+                    writer.write(BAD_REQUEST)
+                    await writer.drain()
+                    return
+
+                if request.method == 'CONNECT':
+                    if remote_writer:
+                        self._close_upstream(upstream_addr, remote_writer)
+                        remote_writer = None # 已释放，建立新连接期间被取消时 finally 中不能再次释放
+                    upstream = await self._open_upstream(target_host, target_port, session)
+                    if not upstream:
+                        metrics.add(('firproxy_listener_errors_total', 'http', 'no_upstream'))
+                        writer.write(BAD_GATEWAY)
+                        await writer.drain()
+                        return
+                    upstream_proxy_info, (remote_reader, remote_writer) = upstream
+                    upstream_addr = upstream_proxy_info.get('proxy')
+                    writer.write(CONNECT_ESTABLISHED)
+                    if client_buf:
+                        remote_writer.write(bytes(client_buf))  # 客户端在隧道建立前已发送的数据
+                    await self._relay(reader, writer, remote_reader, remote_writer, 'http', upstream_addr)
+                    return
+
+                # 同一目标 (及同一会话) 的后续请求复用上游连接；逐请求轮换模式下每个请求都换新的上游，会话粘滞时除外
+                reused = (remote_writer is not None and remote_target == (target_host, target_port, session)
+                          and (session or not s.rotate_per_request))
+                if not reused:
+                    if remote_writer:
+                        self._close_upstream(upstream_addr, remote_writer)
+                        remote_writer = None
+                    remote_buf.clear()
+                    remote_target = (target_host, target_port, session)
+                    upstream = await self._open_upstream(target_host, target_port, session)
+                    if not upstream:
+                        metrics.add(('firproxy_listener_errors_total', 'http', 'no_upstream'))
+                        writer.write(BAD_GATEWAY)
+                        await writer.drain()
+                        return
+                    upstream_proxy_info, (remote_reader, remote_writer) = upstream
+                    upstream_addr = upstream_proxy_info.get('proxy')
+                    meter_out = ('firproxy_bytes_total', 'http', upstream_addr, 'out')
+                    meter_in = ('firproxy_bytes_total', 'http', upstream_addr, 'in')
+
+                request_bytes = request.to_bytes()
+                remote_writer.write(request_bytes)
+                metrics.add(meter_out, len(request_bytes))
+                await self._relay_body(reader, remote_writer, client_buf, body_framer, meter_out)
+                await remote_writer.drain()
+                result = await self._relay_response(remote_reader, writer, remote_buf, request.method, meter_in)
+
+                if result is None and reused and body_framer.mode == 'none':
+                    # 复用的上游连接可能已被目标服务器关闭，无请求体时换新连接重发一次
+                    self._close_upstream(upstream_addr, remote_writer)
+                    remote_writer = None
+                    remote_buf.clear()
+                    upstream = await self._open_upstream(target_host, target_port, session)
+                    if upstream:
+                        upstream_proxy_info, (remote_reader, remote_writer) = upstream
+                        upstream_addr = upstream_proxy_info.get('proxy')
+                        meter_out = ('firproxy_bytes_total', 'http', upstream_addr, 'out')
+                        meter_in = ('firproxy_bytes_total', 'http', upstream_addr, 'in')
+                        remote_writer.write(request_bytes)
+                        metrics.add(meter_out, len(request_bytes))
+                        result = await self._relay_response(remote_reader, writer, remote_buf, request.method, meter_in)
+                if result is None:
+                    metrics.add(('firproxy_listener_errors_total', 'http', 'no_response'))
+                    writer.write(BAD_GATEWAY)
+                    await writer.drain()
+                    return
+
+                response, response_framer = result
+                if response.status == 101:
+                    # 协议升级 (如 WebSocket)，之后按隧道方式转发
+                    if remote_buf:
+                        writer.write(bytes(remote_buf))
+                    if client_buf:
+                        remote_writer.write(bytes(client_buf))
+                    await self._relay(reader, writer, remote_reader, remote_writer, 'http', upstream_addr)
+                    return
+
+                upstream_reusable = response.keep_alive and response_framer.mode != 'eof'
+                if not upstream_reusable:
+                    self._close_upstream(upstream_addr, remote_writer)
+                    remote_writer = None
+                if not (request.keep_alive and upstream_reusable):
+                    return
+        except asyncio.CancelledError:
+            pass  # 服务停止时取消，作为连接回调正常结束以免事件循环报告异常
+        except Exception as e:
+            if not isinstance(e, (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+                                  HttpParseError)):
+                metrics.add(('firproxy_listener_errors_total', 'http', 'exception'))
+                self.log(f"处理 HTTP 请求时出错: {e}")
+        finally:
+            metrics.add(('firproxy_connections_closed_total', 'http'))
+            s._admission.release()
+            if remote_writer: self._close_upstream(upstream_addr, remote_writer)
+            writer.close()
+
+    async def _handle_socks5_client(self, reader, writer):
+        """处理单个SOCKS5客户端连接。握手报文按缓冲区增量解析，客户端提前发来的数据在隧道建立后转发给上游。"""
+        s = self._server
+        metrics = s.metrics
+        metrics.add(('firproxy_accepts_total', 'socks5'))
+        if not s._admission.try_admit():
+            self._reject(writer, 'socks5')
+            return
+        remote_writer = None
+        try:
+            handshake = Socks5Handshake()
+            while handshake.request is None:
+                data = await reader.read(4096)
+                if not data: return
+                try:
+                    reply = handshake.feed(data)
+                except Socks5ParseError as e:
+                    metrics.add(('firproxy_listener_errors_total', 'socks5', 'bad_request'))
+                    if e.reply:
+                        writer.write(e.reply)
+                        await writer.drain()
+                    return
+                if reply: writer.write(reply)
+            request = handshake.request
+
+            early_reply = s.socks5_early_reply
+            if early_reply:
+                writer.write(build_reply(REPLY_SUCCEEDED))
+
+            session = s._session_key((writer.get_extra_info('peername') or ('',))[0], request.host, handshake.username)
+            upstream = await self._open_upstream(request.host, request.port, session)
+            if not upstream:
+                metrics.add(('firproxy_listener_errors_total', 'socks5', 'no_upstream'))
+                if not early_reply:
+                    writer.write(build_reply(REPLY_HOST_UNREACHABLE))
+                    await writer.drain()
+                return
+            upstream_proxy_info, (remote_reader, remote_writer) = upstream
+            upstream_addr = upstream_proxy_info.get('proxy')
+
+            if not early_reply:
+                writer.write(build_reply(REPLY_SUCCEEDED))
+            early_data = handshake.take_early_data()
+            if early_data:
+                remote_writer.write(early_data)
+
+            await self._relay(reader, writer, remote_reader, remote_writer, 'socks5', upstream_addr)
+        except asyncio.CancelledError:
+            pass  # 服务停止时取消，作为连接回调正常结束以免事件循环报告异常
+        except Exception as e:
+            if not isinstance(e, (ConnectionError, OSError, asyncio.IncompleteReadError)):
+                metrics.add(('firproxy_listener_errors_total', 'socks5', 'exception'))
+                self.log(f"处理 SOCKS5 请求时出错: {e}")
+        finally:
+            metrics.add(('firproxy_connections_closed_total', 'socks5'))
+            s._admission.release()
+            if remote_writer: self._close_upstream(upstream_addr, remote_writer)
+            writer.close()
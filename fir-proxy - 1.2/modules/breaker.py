@@ -0,0 +1,146 @@
+# modules/breaker.py
+
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Breaker:
+    __slots__ = ('state', 'outcomes', 'failures', 'retry_at', 'trips', 'trials', 'last_trial', 'successes')
+
+    def __init__(self, window):
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)   # 最近的连接结果，True 为成功
+        self.failures = 0
+        self.retry_at = 0.0
+        self.trips = 0           # 连续熔断次数，用于冷却时间的指数退避
+        self.trials = 0          # 半开状态下已放行的试探连接数
+        self.last_trial = 0.0
+        self.successes = 0       # 半开状态下成功的试探连接数
+
+    def push(self, ok):
+        if len(self.outcomes) == self.outcomes.maxlen and not self.outcomes[0]:
+            self.failures -= 1
+        self.outcomes.append(ok)
+        if not ok:
+            self.failures += 1
+
+
+class CircuitBreakers:
+    """
+    每个上游代理一个熔断器。
+    关闭: 正常放行，记录最近 window 次连接结果，至少 min_calls 次 (不少于 half_open_trials，不超过 window)
+          且失败比例达到 failure_ratio 时熔断，单次偶发失败不会让上游退出轮换；
+    打开: 不再放行，冷却 cooldown 秒 (连续熔断时指数退避，最长 MAX_COOLDOWN) 后由 poll() 转为半开；
+    半开: 最多放行 half_open_trials 个试探连接，全部成功则恢复关闭，任何一个失败则再次熔断。
+    只维护状态，熔断与恢复时如何处理代理 (标记不可用、重新加入轮换) 由调用方决定。
+    """
+    MAX_COOLDOWN = 600
+    # 半开状态下放行的试探连接超过此时间 (秒) 仍无结果 (例如竞速中被取消)，视为放弃并允许新的试探
+    TRIAL_TIMEOUT = 30
+
+    def __init__(self, window=20, failure_ratio=0.5, min_calls=5, cooldown=30, half_open_trials=2):
+        self.window = window
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.half_open_trials = half_open_trials
+        self._breakers = {}     # 代理地址 -> _Breaker
+        self._open = set()
+        self._next_due = float('inf')
+        self._lock = threading.Lock()
+
+    def state(self, proxy_address: str) -> str:
+        breaker = self._breakers.get(proxy_address)
+        return breaker.state if breaker else CLOSED
+
+    def allow(self, proxy_address: str) -> bool:
+        """判断此时能否经该上游建立连接。半开状态下放行即占用一个试探名额。"""
+        breaker = self._breakers.get(proxy_address)
+        if breaker is None or breaker.state == CLOSED:
+            return True
+        with self._lock:
+            if breaker.state == OPEN:
+                return False
+            if breaker.state == HALF_OPEN:
+                now = time.monotonic()
+                if breaker.trials >= self.half_open_trials and now - breaker.last_trial < self.TRIAL_TIMEOUT:
+                    return False
+                breaker.trials += 1
+                breaker.last_trial = now
+            return True
+
+    def _get(self, proxy_address):
+        breaker = self._breakers.get(proxy_address)
+        if breaker is None:
+            breaker = self._breakers[proxy_address] = _Breaker(self.window)
+        return breaker
+
+    def record_success(self, proxy_address: str):
+        with self._lock:
+            breaker = self._get(proxy_address)
+            if breaker.state == CLOSED:
+                breaker.push(True)
+            elif breaker.state == HALF_OPEN:
+                breaker.successes += 1
+                if breaker.successes >= self.half_open_trials:
+                    breaker.state = CLOSED
+                    breaker.outcomes.clear()
+                    breaker.failures = 0
+                    breaker.trips = 0
+
+    def record_failure(self, proxy_address: str) -> bool:
+        """记录一次上游自身的故障，该上游因此熔断时返回 True。"""
+        with self._lock:
+            breaker = self._get(proxy_address)
+            if breaker.state == CLOSED:
+                breaker.push(False)
+                calls = len(breaker.outcomes)
+                if calls < self._min_sample() or breaker.failures < self.failure_ratio * calls:
+                    return False
+            elif breaker.state == OPEN:
+                return False
+            self._trip(proxy_address, breaker)
+            return True
+
+    def _min_sample(self):
+        return min(max(self.min_calls, self.half_open_trials), self.window)
+
+    def _trip(self, proxy_address, breaker):
+        breaker.state = OPEN
+        breaker.retry_at = time.monotonic() + self.cooldown_for(breaker.trips)
+        breaker.trips += 1
+        self._open.add(proxy_address)
+        self._next_due = min(self._next_due, breaker.retry_at)
+
+    def cooldown_for(self, trips: int) -> float:
+        return min(self.cooldown * (2 ** trips), self.MAX_COOLDOWN)
+
+    def poll(self) -> list:
+        """把冷却结束的上游转为半开，返回这些上游的地址。"""
+        if time.monotonic() < self._next_due:
+            return []
+        with self._lock:
+            now = time.monotonic()
+            due = []
+            self._next_due = float('inf')
+            for proxy_address in list(self._open):
+                breaker = self._breakers[proxy_address]
+                if breaker.retry_at <= now:
+                    breaker.state = HALF_OPEN
+                    breaker.trials = breaker.successes = 0
+                    self._open.discard(proxy_address)
+                    due.append(proxy_address)
+                else:
+                    self._next_due = min(self._next_due, breaker.retry_at)
+            return due
+
+    def forget(self, proxy_address: str):
+        """丢弃某个上游的熔断状态，例如它已从代理池中移除。"""
+        with self._lock:
+            self._breakers.pop(proxy_address, None)
+            self._open.discard(proxy_address)
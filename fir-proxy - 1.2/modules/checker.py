@@ -4,24 +4,50 @@ import requests
 import json
 import socket
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from operator import itemgetter
+from urllib.parse import urlsplit
 import subprocess
 
+from .aio_checker import AsyncCheckEngine
+from .geoip import open_geoip
+from .handshake import build_probe, check_probe_reply
+from .scanner import ConnectScanner, detect_protocols
+
 class ProxyChecker:
     """
     一个经过优化的多阶段代理验证器，结合TCP预检和完整质量验证。
     """
-    def __init__(self, timeout: int = 5):
+    # 验证引擎: 'thread' 为线程池 + requests; 'asyncio' 为单事件循环承载大量并发验证
+    ENGINES = ('thread', 'asyncio')
+    # 协议识别后，来源标注的协议不受支持时按此顺序选用一个受支持的协议
+    PROTOCOL_PREFERENCE = ('SOCKS5', 'HTTP', 'SOCKS4')
+
+    def __init__(self, timeout: int = 5, engine: str = 'thread'):
         self.timeout = timeout
+        self.engine = engine if engine in self.ENGINES else 'thread'
+        # asyncio 引擎同时进行的验证数上限
+        self.async_concurrency = 1000
+        # TCP预检同时在途的连接数上限 (另受进程文件描述符上限约束)
+        self.precheck_concurrency = ConnectScanner.MAX_INFLIGHT
+        # asyncio 引擎的各验证阶段是否复用同一条 keep-alive 隧道
+        self.check_keepalive = True
+        # TCP预检连通后是否再做一次代理握手探测，只有应答握手的代理才进入完整验证
+        self.handshake_probe = True
+        # 是否按地址去重并同时探测 SOCKS5/SOCKS4/HTTP，以实际支持的协议验证 (不再信任来源标注)
+        self.protocol_detect = True
         self.session = requests.Session()
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36"
         })
         
+        # 各阶段的目标同源: 一个代理的全部阶段经同一条连接完成 (asyncio 引擎的 _CheckSession 与
+        # 线程引擎 requests.Session 的连接池都按代理与目标复用连接)。匿名度检测需要明文 HTTP 才能看到代理添加的请求头
         self.validation_targets = {
-            'latency_check': 'https://www.baidu.com',
+            'latency_check': 'http://httpbin.org/bytes/102400',
             'anonymity_check': 'http://httpbin.org/get?show_env=1',
-            'speed_check': 'http://cachefly.cachefly.net/100kb.test',
+            'speed_check': 'http://httpbin.org/bytes/102400',
         }
         
         # 国家名称中文映射
@@ -44,8 +70,21 @@ class ProxyChecker:
             'Thailand': '泰国',
         }
         self.location_cache = {}
+        self._socks4_targets = {}   # 域名 -> 经 SOCKS4 代理连接时使用的目标，见 _socks4_target
+        # 离线IP地址库 (见 load_geoip)，未加载或查不到时使用在线接口
+        self.geoip = None
         self.public_ip = None
 
+    def configure(self, settings: dict):
+        """应用配置中的 general 设置 (验证引擎及其并发、连接复用参数)，对下一次验证任务生效。"""
+        engine = settings.get('checker_engine', self.engine)
+        self.engine = engine if engine in self.ENGINES else 'thread'
+        self.async_concurrency = settings.get('async_concurrency', self.async_concurrency)
+        self.precheck_concurrency = settings.get('precheck_concurrency', self.precheck_concurrency)
+        self.check_keepalive = settings.get('check_keepalive', self.check_keepalive)
+        self.handshake_probe = settings.get('handshake_probe', self.handshake_probe)
+        self.protocol_detect = settings.get('protocol_detect', self.protocol_detect)
+
     def initialize_public_ip(self, log_queue=None):
         """通过调用系统 'curl' 命令获取本机公网IP，作为匿名度检测的基准。"""
         try:
@@ -70,13 +109,40 @@ class ProxyChecker:
             if log_queue:
                 log_queue.put(f"[Checker] [!] 调用系统curl获取本机公网IP失败: {e}")
 
-    # --- IP地理位置查询 (聚合多个API) ---
+    def load_geoip(self, path: str):
+        """
+        加载离线IP地址库 (.mmdb 或 CSV 区间表，见 modules/geoip.py)，返回加载的库；path 为空时卸载。
+        已加载同一文件时不重复加载。加载失败时抛出 OSError 或 ValueError，当前的库保持不变。
+        """
+        if self.geoip is not None and self.geoip.path == path:
+            return self.geoip
+        if not path and self.geoip is None:
+            return None
+        # 正在进行的验证可能仍在使用旧库，不主动关闭，交给垃圾回收释放映射
+        self.geoip = open_geoip(path) if path else None
+        self.location_cache.clear()
+        return self.geoip
+
+    def _get_offline_location(self, ip: str):
+        """只查缓存与离线地址库，不发网络请求；都查不到时返回 None。"""
+        location = self.location_cache.get(ip)
+        if location is not None or self.geoip is None:
+            return location
+        country = self.geoip.lookup(ip)
+        if not country:
+            return None
+        location = self.COUNTRY_NAME_MAP.get(country, country)
+        self.location_cache[ip] = location
+        return location
+
+    # --- IP地理位置查询 (离线地址库优先，其次聚合多个API) ---
     def _get_proxy_location(self, ip: str):
         """
-        查询IP的地理位置，聚合多个API源并带缓存，优先国内源，结果翻译为中文。
+        查询IP的地理位置，带缓存；先查离线地址库，查不到时聚合多个API源，结果翻译为中文。
         """
-        if ip in self.location_cache:
-            return self.location_cache[ip]
+        location = self._get_offline_location(ip)
+        if location is not None:
+            return location
 
         location = "未知"
         
@@ -129,7 +195,7 @@ class ProxyChecker:
         return location
 
     def _pre_check_proxy(self, proxy: str):
-        """TCP预检，快速判断端口是否开放。"""
+        """TCP预检，快速判断单个代理端口是否开放 (批量预检见 ConnectScanner)。"""
         try:
             ip, port_str = proxy.split(':')
             with socket.create_connection((ip, int(port_str)), timeout=1.5):
@@ -137,6 +203,103 @@ class ProxyChecker:
         except Exception:
             return False
 
+    def _make_handshake_probe(self, force=False):
+        """
+        返回供 ConnectScanner.scan 使用的握手探测函数，探测目标为延迟验证站点 (完整验证首先连接的目标)；
+        未启用握手探测且 force 为假时返回 None。
+        """
+        if not (self.handshake_probe or force):
+            return None
+        parts = urlsplit(self.validation_targets['latency_check'])
+        host = parts.hostname
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        socks4_host = self._socks4_target(host)
+
+        def probe(p_info):
+            proto = p_info['protocol'].upper()
+            if proto not in ('HTTP', 'SOCKS4', 'SOCKS5'):
+                return None
+            target = socks4_host if proto == 'SOCKS4' else host
+            return build_probe(proto, target, port), partial(check_probe_reply, proto)
+        return probe
+
+    def _socks4_target(self, host: str) -> str:
+        """
+        经 SOCKS4 代理连接 host 时请求中的目标: 与 requests 的 socks4:// 一致，在本地解析为 IPv4 地址，
+        不依赖代理支持 SOCKS4a；解析失败时才保留域名。握手探测与两种引擎的完整验证都经此确定目标，
+        结果在一次验证任务内缓存。
+        """
+        target = self._socks4_targets.get(host)
+        if target is None:
+            try:
+                target = socket.gethostbyname(host)
+            except OSError:
+                target = host
+            self._socks4_targets[host] = target
+        return target
+
+    def _precheck(self, proxies_by_protocol: dict, scanner: ConnectScanner, log_queue, detect=None, cancel_event=None):
+        """
+        阶段一: 返回一个逐个产出通过预检的 {'proxy', 'protocol'[, 'protocols']} 的迭代器，迭代结束时记录幸存数。
+        detect 为真 (默认取 protocol_detect) 时按地址去重并识别协议，每个地址只产出一次:
+        protocol 为实际支持的协议 (标注的协议受支持时沿用标注)，protocols 为探测到的全部协议。
+        否则按标注的协议预检，未标注协议的 'auto' 条目按 HTTP 处理。
+        """
+        detect = self.protocol_detect if detect is None else detect
+        total_entries = sum(len(proxies) for proxies in proxies_by_protocol.values())
+        cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+
+        if not detect:
+            all_proxies_flat = [{'proxy': p, 'protocol': 'http' if proto == 'auto' else proto}
+                                for proto, proxies in proxies_by_protocol.items() for p in proxies]
+            probe = self._make_handshake_probe()
+            log_queue.put(f"[*] 阶段一：TCP预检{'与握手探测' if probe else ''}开始，总数: {total_entries}...")
+
+            def survivors():
+                count = 0
+                for p_info in scanner.scan(all_proxies_flat, key=itemgetter('proxy'), probe=probe, cancel_event=cancel_event):
+                    count += 1
+                    yield p_info
+                if not cancelled():
+                    log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {count} / {total_entries}。")
+            return survivors()
+
+        labels = {}   # 地址 -> 首个标注的协议 (大写)
+        for proto, proxies in proxies_by_protocol.items():
+            label = 'HTTP' if proto.upper() == 'HTTPS' else proto.upper()
+            for p in proxies:
+                labels.setdefault(p, label)
+        probe = self._make_handshake_probe(force=True)
+        log_queue.put(f"[*] 阶段一：TCP预检与协议识别开始，地址数: {len(labels)} (条目数: {total_entries})...")
+
+        def detected():
+            count = relabelled = 0
+            for address, protocols in detect_protocols(scanner, labels, probe, cancel_event=cancel_event):
+                if not protocols:
+                    continue
+                label = labels[address]
+                if label in protocols:
+                    chosen = label
+                else:
+                    chosen = next(p for p in self.PROTOCOL_PREFERENCE if p in protocols)
+                    relabelled += label != 'AUTO'
+                count += 1
+                yield {'proxy': address, 'protocol': chosen.lower(), 'protocols': protocols}
+            if not cancelled():
+                note = f"，其中 {relabelled} 个的实际协议与标注不同" if relabelled else ""
+                log_queue.put(f"[+] 阶段一：TCP预检与协议识别完成，幸存者: {count} / {len(labels)}{note}。")
+        return detected()
+
+    def _classify_anonymity(self, data: dict) -> str:
+        """根据 httpbin 回显的请求信息判断匿名度。"""
+        origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
+        origin_ips = [ip.strip() for ip in origin_ips_str.split(',')]
+        if self.public_ip and any(self.public_ip in ip for ip in origin_ips):
+            return 'Transparent'
+        if len(origin_ips) > 1 or 'Via' in data.get('headers', {}):
+            return 'Anonymous'
+        return 'Elite'
+
     def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online', cancel_event=None):
         """
         对单个代理进行完整的质量验证，此过程可随时取消。
@@ -150,6 +313,8 @@ class ProxyChecker:
             'proxy': proxy, 'protocol': protocol.upper(), 'status': 'Failed',
             'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
         }
+        if 'protocols' in proxy_info:
+            result['protocols'] = proxy_info['protocols']
 
         try:
             if cancel_event and cancel_event.is_set(): return None
@@ -162,17 +327,9 @@ class ProxyChecker:
 
             res_anon = self.session.get(self.validation_targets['anonymity_check'], proxies=proxies_dict, timeout=self.timeout)
             res_anon.raise_for_status()
-            data = res_anon.json()
-            origin_ips_str = data.get('headers', {}).get('X-Forwarded-For', data.get('origin', ''))
-            origin_ips = [ip.strip() for ip in origin_ips_str.split(',')]
-            
-            if self.public_ip and any(self.public_ip in ip for ip in origin_ips):
-                result['anonymity'] = 'Transparent'
+            result['anonymity'] = self._classify_anonymity(res_anon.json())
+            if result['anonymity'] == 'Transparent':
                 return result # 透明代理，直接返回，不再测速
-            elif len(origin_ips) > 1 or 'Via' in data.get('headers', {}):
-                result['anonymity'] = 'Anonymous'
-            else:
-                result['anonymity'] = 'Elite'
 
             if cancel_event and cancel_event.is_set(): return None
 
@@ -212,56 +369,57 @@ class ProxyChecker:
             return result
 
     # --- 优化了验证任务的取消逻辑 ---
-    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None):
-        all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
-        total_proxies = len(all_proxies_flat)
-        
-        survivors = []
-        # 代理数量太多时，跳过TCP预检，避免开销过大
-        if total_proxies > 10000:
-            log_queue.put(f"[!] 代理总数 ({total_proxies}) 超过10000，跳过TCP预检。")
-            survivors = all_proxies_flat
-        else:
-            log_queue.put(f"[*] 阶段一：TCP预检开始，总数: {total_proxies}...")
-            executor = ThreadPoolExecutor(max_workers=500)
+    def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online', max_workers=100, cancel_event=None,
+                     detect_protocols=None):
+        """
+        验证 {协议: [地址, ...]} 中的代理，结果逐个放入 result_queue，正常结束时放入 None。
+        协议未知的地址可放在 'auto' 下；detect_protocols 为 None 时按 protocol_detect 设置决定是否识别协议
+        (对已确认协议的代理池重测时可传入 False)。
+        """
+        self._socks4_targets.clear()
+        if self.engine == 'asyncio':
+            # 结果与取消的约定相同，max_workers 由 async_concurrency 代替
+            return AsyncCheckEngine(self).validate_all(
+                proxies_by_protocol, result_queue, log_queue, validation_mode, cancel_event=cancel_event,
+                detect_protocols=detect_protocols
+            )
+        cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+
+        # 阶段一在单个 selector 上批量预检，通过预检的代理立即交给阶段二的线程池，两个阶段并行进行
+        scanner = ConnectScanner(max_inflight=self.precheck_concurrency, fd_reserve=ConnectScanner.FD_RESERVE + 2 * max_workers)
+        prechecked = self._precheck(proxies_by_protocol, scanner, log_queue, detect_protocols, cancel_event)
+        log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 (预检通过即开始) " + "="*20)
+        pending = set()
+
+        def on_done(future):
+            pending.discard(future)
+            if future.cancelled() or cancelled():
+                return
             try:
-                future_to_proxy = {executor.submit(self._pre_check_proxy, p['proxy']): p for p in all_proxies_flat}
-                for future in as_completed(future_to_proxy):
-                    if cancel_event and cancel_event.is_set(): break
-                    if future.result():
-                        survivors.append(future_to_proxy[future])
-            finally:
-                # 如果任务被取消，不等线程池执行完毕
-                executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
-            log_queue.put(f"[+] 阶段一：TCP预检完成，幸存者: {len(survivors)} / {total_proxies}。")
-
-        if cancel_event and cancel_event.is_set():
-            log_queue.put("[Checker] 任务在TCP预检后被用户取消。")
-            return # 直接返回，不往队列放任何东西
-
-        log_queue.put("\n" + "="*20 + f" 阶段二：开始完整质量验证 " + "="*20)
-        
-        if not survivors:
-            result_queue.put(None) # 正常结束
-            return
+                result = future.result()
+                if result:
+                    result_queue.put(result)
+            except Exception as e:
+                log_queue.put(f"[!] 验证器线程出现异常: {e}")
 
         executor = ThreadPoolExecutor(max_workers=max_workers)
         try:
-            futures = [executor.submit(self._full_check_proxy, p, validation_mode, cancel_event) for p in survivors]
-            for future in as_completed(futures):
-                if cancel_event and cancel_event.is_set():
-                    break
-                try:
-                    result = future.result()
-                    if result:
-                        result_queue.put(result)
-                except Exception as e:
-                    log_queue.put(f"[!] 验证器线程出现异常: {e}")
+            for p_info in prechecked:
+                future = executor.submit(self._full_check_proxy, p_info, validation_mode, cancel_event)
+                pending.add(future)
+                future.add_done_callback(on_done)
+            if cancelled():
+                log_queue.put("[Checker] 任务在TCP预检阶段被用户取消。")
+                return # 直接返回，不往队列放任何东西
+
+            while pending and not cancelled():
+                wait(list(pending), timeout=ConnectScanner.CANCEL_POLL)
         finally:
-            executor.shutdown(wait=not (cancel_event and cancel_event.is_set()))
+            # 如果任务被取消，不等线程池执行完毕；否则等全部回调 (放入结果) 执行完毕
+            executor.shutdown(wait=not cancelled(), cancel_futures=cancelled())
 
         # 只有在任务未被取消的情况下，才发送结束信号(None)
-        if not (cancel_event and cancel_event.is_set()):
+        if not cancelled():
             result_queue.put(None)
         else:
             log_queue.put("[Checker] 任务在完整验证阶段被用户取消。")
\ No newline at end of file
@@ -0,0 +1,328 @@
+# modules/geoip.py
+
+import array
+import bisect
+import csv
+import mmap
+import os
+import socket
+import struct
+import sys
+
+# ISO 3166 两字母代码 -> 英文国名 (与 ProxyChecker.COUNTRY_NAME_MAP 的键一致)。
+# 各数据库对同一国家的英文名写法不一 (如 "Korea (Republic of)"、"Russian Federation")，有代码时优先按代码取名。
+_COUNTRY_CODES = {
+    'CN': 'China', 'HK': 'Hong Kong', 'SG': 'Singapore', 'US': 'United States', 'JP': 'Japan',
+    'KR': 'South Korea', 'RU': 'Russia', 'DE': 'Germany', 'GB': 'United Kingdom', 'FR': 'France',
+    'CA': 'Canada', 'TW': 'Taiwan', 'NL': 'Netherlands', 'IN': 'India', 'VN': 'Vietnam', 'TH': 'Thailand',
+}
+# 数据库中表示"未知/保留地址"的代码
+_UNKNOWN_CODES = {'', '-', 'ZZ', 'XX'}
+
+
+class GeoIPFormatError(ValueError):
+    """地址库文件格式无法识别或已损坏。"""
+
+
+def _country_name(code, name=None):
+    """由国家代码与 (可选的) 英文名得到统一的英文国名；都无效时返回 None。"""
+    code = (code or '').strip().upper()
+    if code in _COUNTRY_CODES:
+        return _COUNTRY_CODES[code]
+    name = (name or '').strip()
+    if name and name != '-':
+        return name
+    return None if code in _UNKNOWN_CODES else code
+
+
+def _ipv4_to_int(ip: str):
+    """点分 IPv4 地址转为整数，不是 IPv4 地址时返回 None。"""
+    try:
+        return struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+    except (OSError, TypeError):
+        return None
+
+
+def _parse_range_bound(text: str):
+    """CSV 中的区间端点: 点分 IPv4 或整数 (IP2Location 格式)。IPv6 及无法解析的值返回 None。"""
+    text = text.strip()
+    if text.isdigit():
+        value = int(text)
+        return value if value <= 0xFFFFFFFF else None
+    return _ipv4_to_int(text)
+
+
+class RangeDatabase:
+    """
+    CSV 格式的 IPv4 区间库: 每行 "起始IP,结束IP,国家代码[,国家名,...]"，端点可为点分地址或整数
+    (DB-IP Country Lite、IP2Location LITE DB1 等)；表头、IPv6 区间及无法解析的行被跳过。
+    首次加载时把区间按起始地址排序，编译为同目录下的 .idx 二进制文件 (起始/结束地址数组 + 国家下标数组 + 国名表)，
+    之后直接 mmap 该文件，加载不再解析 CSV，查询在起始地址数组上二分查找，不把整张表读入内存。
+    CSV 比 .idx 新时自动重新编译；目录不可写时在内存中使用编译结果。
+    """
+    MAGIC = b'FIRGEO01'
+    # 魔数, 字节序 (0 小端 / 1 大端), 区间数, 国名表字节数
+    HEADER = struct.Struct('<8sBxxxII')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._mmap = self._view = None
+        if not self._load_index():
+            self._build_index()
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _load_index(self) -> bool:
+        """映射已编译的 .idx 文件，不存在、过期或与本机字节序不符时返回 False。"""
+        try:
+            if os.path.getmtime(self.index_path) < os.path.getmtime(self.path):
+                return False
+            with open(self.index_path, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        try:
+            magic, big_endian, count, names_size = self.HEADER.unpack_from(buf, 0)
+        except struct.error:
+            magic = None
+        if magic != self.MAGIC or big_endian != (sys.byteorder == 'big') \
+                or len(buf) != self.HEADER.size + count * 10 + names_size:
+            buf.close()
+            return False
+        view = memoryview(buf)
+        offset = self.HEADER.size
+        self._starts = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._ends = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self._countries = view[offset:offset + count * 2].cast('H')
+        offset += count * 2
+        self._names = bytes(view[offset:offset + names_size]).decode('utf-8').split('\n')
+        self._view = view
+        self._mmap = buf
+        return True
+
+    def _build_index(self):
+        ranges = []
+        name_ids = {}
+        with open(self.path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                start, end = _parse_range_bound(row[0]), _parse_range_bound(row[1])
+                if start is None or end is None or end < start:
+                    continue
+                country = _country_name(row[2], row[3] if len(row) > 3 else None)
+                if country is None:
+                    continue
+                ranges.append((start, end, name_ids.setdefault(country, len(name_ids))))
+        if not ranges:
+            raise GeoIPFormatError(f"{self.path} 中没有可识别的 IPv4 区间")
+        if len(name_ids) > 0xFFFF:
+            raise GeoIPFormatError(f"{self.path} 中的国家/地区名过多")
+        ranges.sort()
+
+        self._starts = array.array('I', (r[0] for r in ranges))
+        self._ends = array.array('I', (r[1] for r in ranges))
+        self._countries = array.array('H', (r[2] for r in ranges))
+        self._names = list(name_ids)
+        names = '\n'.join(self._names).encode('utf-8')
+        try:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, sys.byteorder == 'big', len(ranges), len(names)))
+                for column in (self._starts, self._ends, self._countries):
+                    column.tofile(f)
+                f.write(names)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            return # 无法写入时只在内存中使用本次的编译结果
+        self._release()
+        self._load_index()
+
+    def lookup(self, ip: str):
+        """返回 IP 所属国家的英文名，不在库中 (或不是 IPv4 地址) 时返回 None。"""
+        value = _ipv4_to_int(ip)
+        if value is None:
+            return None
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i < 0 or value > self._ends[i]:
+            return None
+        return self._names[self._countries[i]]
+
+    def _release(self):
+        if self._mmap is not None:
+            for view in (self._starts, self._ends, self._countries, self._view):
+                view.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def close(self):
+        self._release()
+        self._starts = self._ends = self._countries = array.array('I')
+
+
+class MMDBDatabase:
+    """
+    MaxMind DB (.mmdb) 格式的地址库 (GeoLite2-Country/City、DB-IP、IPinfo 等)，无需第三方库。
+    文件整体 mmap 后按 IP 的各位走二叉搜索树，找到数据记录后只取其中的国家信息；
+    同一数据记录被大量 IP 共享，解析结果按记录偏移缓存。支持 IPv4 与 IPv6。
+    """
+    METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+    # 元数据位于文件末尾的 128KB 之内
+    METADATA_MAX_SIZE = 128 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self._buf
+        marker = buf.rfind(self.METADATA_MARKER, max(0, len(buf) - self.METADATA_MAX_SIZE))
+        if marker < 0:
+            buf.close()
+            raise GeoIPFormatError(f"{path} 不是 MaxMind DB 文件")
+        self._data_base = 0
+        try:
+            metadata, _ = self._decode(marker + len(self.METADATA_MARKER))
+            self._node_count = metadata['node_count']
+            self._record_size = metadata['record_size']
+            self._ip_version = metadata['ip_version']
+        except (KeyError, TypeError, IndexError, ValueError, struct.error) as e:
+            buf.close()
+            raise GeoIPFormatError(f"{path} 的元数据无效: {e}") from None
+        if self._record_size not in (24, 28, 32):
+            buf.close()
+            raise GeoIPFormatError(f"{path} 的记录长度 {self._record_size} 不受支持")
+        self._node_size = self._record_size // 4
+        self._search_size = self._node_count * self._node_size
+        self._data_base = self._search_size + 16 # 搜索树之后是 16 字节的分隔区
+        self._countries = {}
+
+        # IPv6 库中 IPv4 地址位于 ::/96 之下，预先走完前 96 位
+        self._ipv4_start = 0
+        if self._ip_version == 6:
+            node = 0
+            for _ in range(96):
+                if node >= self._node_count:
+                    break
+                node = self._read_record(node, 0)
+            self._ipv4_start = node
+
+    def __len__(self):
+        return self._node_count
+
+    def _read_record(self, node: int, bit: int) -> int:
+        buf = self._buf
+        offset = node * self._node_size
+        if self._record_size == 24:
+            offset += bit * 3
+            return int.from_bytes(buf[offset:offset + 3], 'big')
+        if self._record_size == 28:
+            if bit:
+                return ((buf[offset + 3] & 0x0F) << 24) | int.from_bytes(buf[offset + 4:offset + 7], 'big')
+            return ((buf[offset + 3] & 0xF0) << 20) | int.from_bytes(buf[offset:offset + 3], 'big')
+        offset += bit * 4
+        return int.from_bytes(buf[offset:offset + 4], 'big')
+
+    def _decode(self, offset: int):
+        """解析 offset 处的一个数据字段，返回 (值, 下一字段的偏移)。"""
+        buf = self._buf
+        ctrl = buf[offset]
+        offset += 1
+        kind = ctrl >> 5
+        if kind == 1: # 指针，指向数据区中的另一字段
+            size = (ctrl >> 3) & 0x3
+            value = ctrl & 0x7
+            if size == 3:
+                pointer = int.from_bytes(buf[offset:offset + 4], 'big')
+            else:
+                pointer = ((value << (8 * (size + 1))) | int.from_bytes(buf[offset:offset + size + 1], 'big')) \
+                          + (0, 2048, 526336)[size]
+            return self._decode(self._data_base + pointer)[0], offset + size + 1
+        if kind == 0: # 扩展类型
+            kind = 7 + buf[offset]
+            offset += 1
+        size = ctrl & 0x1F
+        if size >= 29:
+            n = size - 28
+            size = (29, 285, 65821)[n - 1] + int.from_bytes(buf[offset:offset + n], 'big')
+            offset += n
+        end = offset + size
+        if kind == 2:       # UTF-8 字符串
+            return buf[offset:end].decode('utf-8'), end
+        if kind == 7:       # map
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset)
+                result[key], offset = self._decode(offset)
+            return result, offset
+        if kind == 11:      # array
+            result = []
+            for _ in range(size):
+                value, offset = self._decode(offset)
+                result.append(value)
+            return result, offset
+        if kind in (5, 6, 9, 10):   # uint16 / uint32 / uint64 / uint128
+            return int.from_bytes(buf[offset:end], 'big'), end
+        if kind == 8:       # int32
+            return int.from_bytes(buf[offset:end].rjust(4, b'\0'), 'big', signed=True), end
+        if kind == 3:       # double
+            return struct.unpack('!d', buf[offset:offset + 8])[0], offset + 8
+        if kind == 15:      # float
+            return struct.unpack('!f', buf[offset:offset + 4])[0], offset + 4
+        if kind == 14:      # boolean，值即 size
+            return bool(size), offset
+        if kind == 4:       # bytes
+            return bytes(buf[offset:end]), end
+        raise GeoIPFormatError(f"未知的数据类型 {kind} (偏移 {offset - 1})")
+
+    @staticmethod
+    def _country_of(record):
+        if not isinstance(record, dict):
+            return None
+        country = record.get('country') or record.get('registered_country')
+        if isinstance(country, dict):
+            return _country_name(country.get('iso_code'), (country.get('names') or {}).get('en'))
+        if isinstance(country, str):    # DB-IP / IPinfo 的精简格式直接给出代码或国名
+            return _country_name(country, None) if len(country) == 2 else _country_name(record.get('country_code'), country)
+        return _country_name(record.get('country_code'), None)
+
+    def lookup(self, ip: str):
+        """返回 IP 所属国家的英文名，不在库中时返回 None。"""
+        try:
+            if ':' in ip:
+                if self._ip_version != 6:
+                    return None
+                packed, node = socket.inet_pton(socket.AF_INET6, ip), 0
+            else:
+                packed, node = socket.inet_pton(socket.AF_INET, ip), self._ipv4_start
+        except (OSError, TypeError):
+            return None
+        value = int.from_bytes(packed, 'big')
+        bits = len(packed) * 8
+        node_count = self._node_count
+        for i in range(bits - 1, -1, -1):
+            if node >= node_count:
+                break
+            node = self._read_record(node, (value >> i) & 1)
+        if node <= node_count:  # 等于 node_count 表示库中没有该地址
+            return None
+        offset = node - node_count + self._search_size
+        if offset not in self._countries:
+            try:
+                self._countries[offset] = self._country_of(self._decode(offset)[0])
+            except (IndexError, ValueError, struct.error):
+                self._countries[offset] = None
+        return self._countries[offset]
+
+    def close(self):
+        self._buf.close()
+
+
+def open_geoip(path: str):
+    """按扩展名打开地址库: .mmdb 为 MaxMind DB，其余按 CSV 区间表处理。"""
+    if path.lower().endswith('.mmdb'):
+        return MMDBDatabase(path)
+    return RangeDatabase(path)
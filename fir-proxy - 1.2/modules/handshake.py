@@ -0,0 +1,285 @@
+# modules/handshake.py
+
+import asyncio
+import ipaddress
+import socket
+import struct
+
+SOCKS5_REPLY_MESSAGES = {
+    0x01: "general SOCKS server failure",
+    0x02: "connection not allowed by ruleset",
+    0x03: "network unreachable",
+    0x04: "host unreachable",
+    0x05: "connection refused",
+    0x06: "TTL expired",
+    0x07: "command not supported",
+    0x08: "address type not supported",
+}
+
+
+# 表示目标地址本身不可达的应答，不应归咎于上游代理
+_SOCKS5_TARGET_FAILURES = {0x03, 0x04, 0x05, 0x06}
+_HTTP_TARGET_FAILURES = {'502', '503', '504'}
+
+
+class ProxyHandshakeError(Exception):
+    """上游代理握手失败（协议错误或上游拒绝连接目标）。"""
+
+
+class TargetConnectError(ProxyHandshakeError):
+    """上游代理工作正常，但报告目标地址无法连接。"""
+
+
+def is_upstream_fault(error) -> bool:
+    """判断一次连接失败是否应归咎于上游代理本身（连不上、超时、协议错误），而非目标地址。"""
+    if isinstance(error, TargetConnectError):
+        return False
+    return isinstance(error, (OSError, ProxyHandshakeError, asyncio.TimeoutError))
+
+
+def parse_proxy_info(proxy_info: dict):
+    """从代理信息字典中解析出 (host, port, protocol)，格式错误时抛出 ValueError。"""
+    addr = proxy_info.get('proxy')
+    proto = proxy_info.get('protocol')
+    if not addr or not proto:
+        raise ValueError(f"代理信息格式不正确: {proxy_info}")
+    host, _, port_str = addr.rpartition(':')
+    proto = proto.upper()
+    if proto not in ('HTTP', 'SOCKS4', 'SOCKS5'):
+        raise ValueError(f"不支持的上游代理协议: {proto}")
+    return host, int(port_str), proto
+
+
+# --- 报文构造 ---
+def build_socks5_greeting() -> bytes:
+    """SOCKS5 问候报文，仅声明无认证方式。"""
+    return b"\x05\x01\x00"
+
+
+def build_socks5_connect(host: str, port: int) -> bytes:
+    """SOCKS5 CONNECT 请求，域名交由上游解析（远程DNS）。"""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        encoded = host.encode('idna')
+        return b"\x05\x01\x00\x03" + bytes([len(encoded)]) + encoded + struct.pack('!H', port)
+    atyp = b"\x01" if ip.version == 4 else b"\x04"
+    return b"\x05\x01\x00" + atyp + ip.packed + struct.pack('!H', port)
+
+
+def build_socks4_connect(host: str, port: int) -> bytes:
+    """SOCKS4 CONNECT 请求，目标为域名时使用 SOCKS4a 扩展。"""
+    try:
+        packed = ipaddress.IPv4Address(host).packed
+        return b"\x04\x01" + struct.pack('!H', port) + packed + b"\x00"
+    except ValueError:
+        pass
+    return b"\x04\x01" + struct.pack('!H', port) + b"\x00\x00\x00\x01\x00" + host.encode('idna') + b"\x00"
+
+
+def build_http_connect(host: str, port: int) -> bytes:
+    """HTTP CONNECT 请求头。"""
+    authority = f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+    return f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n\r\n".encode('ascii')
+
+
+# --- 应答解析 ---
+def check_socks5_method(reply: bytes):
+    if len(reply) != 2 or reply[0] != 5:
+        raise ProxyHandshakeError("上游不是有效的 SOCKS5 服务")
+    if reply[1] != 0:
+        raise ProxyHandshakeError("上游 SOCKS5 要求认证")
+
+
+def socks5_reply_length(head: bytes) -> int:
+    """根据 SOCKS5 应答的前5个字节计算完整应答长度。"""
+    atyp = head[3]
+    if atyp == 1:
+        return 10
+    if atyp == 4:
+        return 22
+    if atyp == 3:
+        return 7 + head[4]
+    raise ProxyHandshakeError(f"上游 SOCKS5 应答地址类型无效: {atyp}")
+
+
+def check_socks5_reply(head: bytes):
+    if head[0] != 5:
+        raise ProxyHandshakeError("上游 SOCKS5 应答版本错误")
+    if head[1] != 0:
+        error = TargetConnectError if head[1] in _SOCKS5_TARGET_FAILURES else ProxyHandshakeError
+        raise error(f"上游 SOCKS5 拒绝连接: {SOCKS5_REPLY_MESSAGES.get(head[1], head[1])}")
+
+
+def check_socks4_reply(reply: bytes):
+    if len(reply) != 8 or reply[0] != 0:
+        raise ProxyHandshakeError("上游不是有效的 SOCKS4 服务")
+    if reply[1] != 0x5A:
+        raise TargetConnectError(f"上游 SOCKS4 拒绝连接: 0x{reply[1]:02x}")
+
+
+def check_http_connect_reply(head: bytes):
+    status_line = head.split(b"\r\n", 1)[0].decode('latin-1')
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise ProxyHandshakeError("上游不是有效的 HTTP 代理")
+    if parts[1] != '200':
+        error = TargetConnectError if parts[1] in _HTTP_TARGET_FAILURES else ProxyHandshakeError
+        raise error(f"上游 HTTP 代理拒绝 CONNECT: {status_line}")
+
+
+# --- 握手探测 ---
+# 只发送握手的首个报文并检查应答，用于在完整验证前低成本地筛除不是代理的端口
+_PROBE_REPLY_PREFIX = {'SOCKS5': b"\x05", 'SOCKS4': b"\x00", 'HTTP': b"HTTP/"}
+
+
+def build_probe(proto: str, host: str, port: int) -> bytes:
+    """探测报文: SOCKS5 为问候报文，SOCKS4 与 HTTP 为到目标地址的 CONNECT 请求。"""
+    if proto == 'SOCKS5':
+        return build_socks5_greeting()
+    if proto == 'SOCKS4':
+        return build_socks4_connect(host, port)
+    return build_http_connect(host, port)
+
+
+def check_probe_reply(proto: str, reply) -> bool:
+    """
+    检查探测应答: 应答尚不完整时返回 None，否则返回该端口是否为无需认证、可连接目标的 proto 代理。
+    开头的字节已不符合协议时 (例如 SSH 等服务主动发送的横幅) 立即判定为否。
+    """
+    prefix = _PROBE_REPLY_PREFIX[proto]
+    if not prefix.startswith(bytes(reply[:len(prefix)])):
+        return False
+    try:
+        if proto == 'SOCKS5':
+            if len(reply) < 2:
+                return None
+            check_socks5_method(bytes(reply[:2]))
+        elif proto == 'SOCKS4':
+            if len(reply) < 8:
+                return None
+            check_socks4_reply(bytes(reply[:8]))
+        else:
+            if b"\r\n\r\n" not in reply:
+                return None if len(reply) <= 16384 else False
+            check_http_connect_reply(bytes(reply))
+    except ProxyHandshakeError:
+        return False
+    return True
+
+
+# --- 阻塞 socket 握手 ---
+def _recv_exact(sock, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ProxyHandshakeError("上游代理在握手期间关闭了连接")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_http_head(sock, limit: int = 16384) -> bytes:
+    buf = bytearray()
+    while b"\r\n\r\n" not in buf:
+        if len(buf) > limit:
+            raise ProxyHandshakeError("上游 HTTP 代理应答头过长")
+        # 逐字节读取，避免吞掉应答头之后属于隧道的数据
+        chunk = sock.recv(1)
+        if not chunk:
+            raise ProxyHandshakeError("上游代理在握手期间关闭了连接")
+        buf += chunk
+    return bytes(buf)
+
+
+def socks5_greet(sock):
+    """完成 SOCKS5 方法协商，之后该连接只差一个 CONNECT 请求即可使用。"""
+    sock.sendall(build_socks5_greeting())
+    check_socks5_method(_recv_exact(sock, 2))
+
+
+def negotiate(sock, proto: str, host: str, port: int, greeted: bool = False):
+    """在已连上上游代理的 socket 上完成到目标地址的握手。greeted 表示 SOCKS5 方法协商已完成。"""
+    if proto == 'SOCKS5':
+        if not greeted:
+            socks5_greet(sock)
+        sock.sendall(build_socks5_connect(host, port))
+        head = _recv_exact(sock, 5)
+        check_socks5_reply(head)
+        _recv_exact(sock, socks5_reply_length(head) - 5)
+    elif proto == 'SOCKS4':
+        sock.sendall(build_socks4_connect(host, port))
+        check_socks4_reply(_recv_exact(sock, 8))
+    else:
+        sock.sendall(build_http_connect(host, port))
+        check_http_connect_reply(_recv_http_head(sock))
+
+
+def open_tunnel(proxy_info: dict, target_host: str, target_port: int, timeout: float = 10):
+    """通过上游代理建立到目标地址的隧道，返回阻塞模式的 socket。"""
+    host, port, proto = parse_proxy_info(proxy_info)
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        negotiate(sock, proto, target_host, target_port)
+    except BaseException:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return sock
+
+
+# --- asyncio 握手 ---
+async def _async_negotiate(reader, writer, proto, host, port, greeted=False):
+    if proto == 'SOCKS5':
+        if not greeted:
+            writer.write(build_socks5_greeting())
+            await writer.drain()
+            check_socks5_method(await reader.readexactly(2))
+        writer.write(build_socks5_connect(host, port))
+        await writer.drain()
+        head = await reader.readexactly(5)
+        check_socks5_reply(head)
+        await reader.readexactly(socks5_reply_length(head) - 5)
+    elif proto == 'SOCKS4':
+        writer.write(build_socks4_connect(host, port))
+        await writer.drain()
+        check_socks4_reply(await reader.readexactly(8))
+    else:
+        writer.write(build_http_connect(host, port))
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        check_http_connect_reply(head)
+
+
+async def _async_handshake(reader, writer, proto, target_host, target_port, greeted=False):
+    """完成握手，失败 (含超时取消) 时关闭连接。时限由调用方统一施加。"""
+    try:
+        await _async_negotiate(reader, writer, proto, target_host, target_port, greeted)
+    except asyncio.IncompleteReadError:
+        writer.close()
+        raise ProxyHandshakeError("上游代理在握手期间关闭了连接")
+    except asyncio.LimitOverrunError:
+        writer.close()
+        raise ProxyHandshakeError("上游 HTTP 代理应答头过长")
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def async_open_tunnel(proxy_info: dict, target_host: str, target_port: int, timeout: float = 10):
+    """通过上游代理建立到目标地址的隧道，返回 (reader, writer)。连接与握手共用 timeout 秒的时限。"""
+    host, port, proto = parse_proxy_info(proxy_info)
+
+    async def connect():
+        reader, writer = await asyncio.open_connection(host, port)
+        return await _async_handshake(reader, writer, proto, target_host, target_port)
+    return await asyncio.wait_for(connect(), timeout)
+
+
+async def async_open_tunnel_on(sock, proxy_info: dict, target_host: str, target_port: int, timeout: float = 10, greeted: bool = False):
+    """在一个已连上上游代理的 socket（例如连接池中的预热连接）上异步完成握手，返回 (reader, writer)。"""
+    _, _, proto = parse_proxy_info(proxy_info)
+    sock.setblocking(False)
+    reader, writer = await asyncio.open_connection(sock=sock)
+    return await asyncio.wait_for(_async_handshake(reader, writer, proto, target_host, target_port, greeted), timeout)
@@ -0,0 +1,264 @@
+# modules/http11.py
+
+import base64
+from urllib.parse import urlsplit
+
+MAX_HEAD_SIZE = 64 * 1024
+MAX_CHUNK_LINE = 4096
+
+# 仅对本地代理有意义、不应转发给目标服务器的请求头
+_PROXY_ONLY_HEADERS = {'proxy-connection', 'proxy-authorization'}
+
+CONNECT_ESTABLISHED = b'HTTP/1.1 200 Connection Established\r\n\r\n'
+BAD_REQUEST = b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+BAD_GATEWAY = b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+SERVICE_UNAVAILABLE = b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n'
+
+
+class HttpParseError(Exception):
+    """HTTP 报文格式错误或头部过大。"""
+
+
+def _split_head(buf):
+    """从缓冲区中切出完整的报文头，返回 (行列表, 消耗字节数)；头部尚不完整时返回 None。"""
+    end = buf.find(b"\r\n\r\n")
+    if end < 0:
+        if len(buf) > MAX_HEAD_SIZE:
+            raise HttpParseError("报文头超过大小限制")
+        return None
+    lines = bytes(buf[:end]).decode('latin-1').split("\r\n")
+    return lines, end + 4
+
+
+def _parse_headers(lines):
+    headers = []
+    for line in lines:
+        name, sep, value = line.partition(':')
+        if not sep or not name or name != name.strip():
+            raise HttpParseError(f"无效的报文头: {line!r}")
+        headers.append((name, value.strip()))
+    return headers
+
+
+class _Message:
+    __slots__ = ('version', 'headers')
+
+    def header(self, name):
+        """返回指定头部的最后一个值，不存在时返回 None。"""
+        name = name.lower()
+        value = None
+        for k, v in self.headers:
+            if k.lower() == name:
+                value = v
+        return value
+
+    def _tokens(self, *names):
+        tokens = set()
+        for k, v in self.headers:
+            if k.lower() in names:
+                tokens.update(t.strip().lower() for t in v.split(','))
+        return tokens
+
+    @property
+    def keep_alive(self):
+        tokens = self._tokens('connection', 'proxy-connection')
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in tokens
+        return 'close' not in tokens
+
+    @property
+    def is_chunked(self):
+        te = self.header('transfer-encoding')
+        return bool(te) and te.lower().split(',')[-1].strip() == 'chunked'
+
+    def content_length(self):
+        value = self.header('content-length')
+        if value is None:
+            return None
+        try:
+            length = int(value)
+        except ValueError:
+            raise HttpParseError(f"无效的 Content-Length: {value!r}")
+        if length < 0:
+            raise HttpParseError(f"无效的 Content-Length: {value!r}")
+        return length
+
+
+class RequestHead(_Message):
+    __slots__ = ('method', 'target')
+
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+
+    def target_address(self):
+        """返回请求要连接的 (host, port)。"""
+        if self.method == 'CONNECT':
+            host, _, port = self.target.rpartition(':')
+            return host.strip('[]'), int(port)
+        if '://' in self.target:
+            parts = urlsplit(self.target)
+            return parts.hostname, parts.port or 80
+        host = self.header('host')
+        if not host:
+            raise HttpParseError("请求缺少目标地址")
+        parts = urlsplit(f"//{host}")
+        return parts.hostname, parts.port or 80
+
+    def proxy_username(self):
+        """取出 Proxy-Authorization (Basic) 中的用户名，不存在或格式不符时返回 None。"""
+        value = self.header('proxy-authorization')
+        if not value:
+            return None
+        scheme, _, credentials = value.partition(' ')
+        if scheme.lower() != 'basic':
+            return None
+        try:
+            decoded = base64.b64decode(credentials.strip(), validate=True).decode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return decoded.partition(':')[0] or None
+
+    def to_bytes(self) -> bytes:
+        """序列化为发往目标服务器的请求头: 请求目标改为 origin-form，去掉代理专用头部。"""
+        path = self.target
+        host_value = None
+        if '://' in path:
+            parts = urlsplit(path)
+            host_value = parts.netloc.rpartition('@')[2]
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+        lines = [f"{self.method} {path} {self.version}"]
+        has_host = False
+        for name, value in self.headers:
+            lname = name.lower()
+            if lname in _PROXY_ONLY_HEADERS:
+                continue
+            if lname == 'host':
+                has_host = True
+            lines.append(f"{name}: {value}")
+        if not has_host and host_value:
+            lines.insert(1, f"Host: {host_value}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+class ResponseHead(_Message):
+    __slots__ = ('status', 'reason')
+
+    def __init__(self, version, status, reason, headers):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+
+def parse_request_head(buf):
+    """解析请求头，返回 (RequestHead, 消耗字节数)；数据不足时返回 None。"""
+    split = _split_head(buf)
+    if split is None:
+        return None
+    lines, consumed = split
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+        raise HttpParseError(f"无效的请求行: {lines[0]!r}")
+    return RequestHead(parts[0].upper(), parts[1], parts[2], _parse_headers(lines[1:])), consumed
+
+
+def parse_response_head(buf):
+    """解析响应头，返回 (ResponseHead, 消耗字节数)；数据不足时返回 None。"""
+    split = _split_head(buf)
+    if split is None:
+        return None
+    lines, consumed = split
+    parts = lines[0].split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/1.') or not parts[1].isdigit():
+        raise HttpParseError(f"无效的状态行: {lines[0]!r}")
+    reason = parts[2] if len(parts) > 2 else ''
+    return ResponseHead(parts[0], int(parts[1]), reason, _parse_headers(lines[1:])), consumed
+
+
+class BodyFramer:
+    """
+    与 I/O 无关的报文体边界跟踪器，两种服务引擎共用。
+    feed() 返回本次属于报文体的字节数，调用方原样转发这些字节（chunked 编码不解码），剩余字节属于下一个报文。
+    mode: 'none' 无报文体, 'length' 定长, 'chunked' 分块, 'eof' 读到连接关闭为止。
+    """
+    __slots__ = ('mode', 'remaining', 'done', '_state', '_line')
+
+    def __init__(self, mode, length=0):
+        self.mode = mode
+        self.remaining = length
+        self.done = mode == 'none' or (mode == 'length' and length == 0)
+        self._state = 'size'
+        self._line = bytearray()
+
+    def feed(self, data) -> int:
+        if self.done:
+            return 0
+        if self.mode == 'eof':
+            return len(data)
+        if self.mode == 'length':
+            n = min(self.remaining, len(data))
+            self.remaining -= n
+            self.done = self.remaining == 0
+            return n
+        return self._feed_chunked(data)
+
+    def _feed_chunked(self, data) -> int:
+        pos = 0
+        end = len(data)
+        while pos < end and not self.done:
+            if self._state == 'data':
+                n = min(self.remaining, end - pos)
+                pos += n
+                self.remaining -= n
+                if self.remaining == 0:
+                    self._state = 'size'
+                continue
+            # 'size' 与 'trailer' 状态都按行处理
+            nl = data.find(b"\n", pos)
+            if nl < 0:
+                self._line += data[pos:]
+                if len(self._line) > MAX_CHUNK_LINE:
+                    raise HttpParseError("chunk 行过长")
+                return end
+            self._line += data[pos:nl]
+            pos = nl + 1
+            line = bytes(self._line).strip()
+            self._line.clear()
+            if self._state == 'size':
+                if not line:
+                    continue  # 上一个分块数据之后的 CRLF
+                try:
+                    size = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise HttpParseError(f"无效的 chunk 大小: {line!r}")
+                if size == 0:
+                    self._state = 'trailer'
+                else:
+                    self._state = 'data'
+                    self.remaining = size
+            elif not line:
+                self.done = True
+        return pos
+
+
+def request_body_framer(head: RequestHead) -> BodyFramer:
+    if head.is_chunked:
+        return BodyFramer('chunked')
+    length = head.content_length()
+    return BodyFramer('length', length) if length else BodyFramer('none')
+
+
+def response_body_framer(head: ResponseHead, request_method: str) -> BodyFramer:
+    if request_method == 'HEAD' or head.status in (204, 304) or 100 <= head.status < 200:
+        return BodyFramer('none')
+    if head.is_chunked:
+        return BodyFramer('chunked')
+    length = head.content_length()
+    if length is not None:
+        return BodyFramer('length', length)
+    return BodyFramer('eof')
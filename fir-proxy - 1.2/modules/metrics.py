@@ -0,0 +1,198 @@
+# modules/metrics.py
+
+import bisect
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 上游建连耗时直方图的桶上界 (秒)，最后隐含一个 +Inf 桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标名 -> (类型, 说明, 标签名)。记录时的 key 为 (指标名, 标签值...)，标签值顺序与此处一致
+METRICS = {
+    'firproxy_accepts_total': ('counter', '接受的客户端连接数', ('listener',)),
+    'firproxy_connections_active': ('gauge', '当前打开的客户端连接数', ('listener',)),
+    'firproxy_connections_closed_total': ('counter', '已关闭的客户端连接数', ('listener',)),
+    'firproxy_listener_errors_total': ('counter', '未能完成转发的客户端请求数', ('listener', 'reason')),
+    'firproxy_upstream_connects_total': ('counter', '经上游代理成功建立的隧道数', ('upstream',)),
+    'firproxy_upstream_errors_total': ('counter', '上游连接失败次数, kind=upstream 为上游自身故障, target 为目标不可达', ('upstream', 'kind')),
+    'firproxy_upstream_breaker_trips_total': ('counter', '上游熔断次数', ('upstream',)),
+    'firproxy_upstream_connect_seconds': ('histogram', '经上游代理建立到目标隧道的耗时', ('upstream',)),
+    'firproxy_bytes_total': ('counter', '转发的字节数, direction=out 为发往上游, in 为来自上游', ('listener', 'upstream', 'direction')),
+}
+
+
+def _merge(dst: dict, src: dict):
+    for key, value in src.items():
+        if isinstance(value, list):
+            current = dst.get(key)
+            if current is None:
+                dst[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    current[i] += v
+        else:
+            dst[key] = dst.get(key, 0) + value
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Metrics:
+    """
+    进程内指标。每个线程只写自己的分片（一个普通 dict），记录时既不加锁也不格式化字符串，
+    导出时才把各分片合并。已退出线程的分片并入累计值后丢弃: 导出时如此，
+    新线程注册分片时若登记的分片数已翻倍也会清理一次，无人导出时分片数也只与存活线程数成正比。
+    """
+    # 登记的分片数达到该值 (及上次清理后存活数的两倍) 时，在注册新分片时清理已退出线程的分片
+    PRUNE_THRESHOLD = 64
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []     # [(线程, 分片)]
+        self._prune_at = self.PRUNE_THRESHOLD
+        self._retired = {}
+        self._remote = {}     # 来源 -> 其他进程（多进程模式的工作进程）上报的合并值
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                if len(self._shards) >= self._prune_at:
+                    self._prune()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _prune(self):
+        """把已退出线程的分片并入累计值并丢弃。调用方需持有锁。"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = live
+        self._prune_at = max(self.PRUNE_THRESHOLD, 2 * len(live))
+
+    def add(self, key, n=1):
+        """计数器加 n。key 为 (指标名, 标签值...)。"""
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + n
+
+    def observe(self, key, value):
+        """记录一次直方图观测值。"""
+        shard = self._shard()
+        buckets = shard.get(key)
+        if buckets is None:
+            # 各桶计数，之后一项是 +Inf 桶，最后一项是观测值之和
+            buckets = shard[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        buckets[-1] += value
+
+    def set_remote(self, source, totals: dict):
+        """更新来自其他进程的指标（整份替换），导出时与本进程的值相加。"""
+        with self._lock:
+            self._remote[source] = totals
+
+    def collect(self) -> dict:
+        """合并所有分片，返回 {key: 计数或直方图列表}。"""
+        totals = {}
+        with self._lock:
+            self._prune()
+            _merge(totals, self._retired)
+            for _, shard in self._shards:
+                _merge(totals, dict(shard))
+            for remote in self._remote.values():
+                _merge(totals, remote)
+        return totals
+
+    def render(self) -> str:
+        """以 Prometheus 文本格式导出全部指标。"""
+        samples = defaultdict(dict)
+        for key, value in self.collect().items():
+            samples[key[0]][key[1:]] = value
+
+        # 活动连接数由接受数与关闭数相减得出，无需在热路径上维护计数
+        closed = samples.get('firproxy_connections_closed_total', {})
+        for labels, accepted in samples.get('firproxy_accepts_total', {}).items():
+            samples['firproxy_connections_active'][labels] = accepted - closed.get(labels, 0)
+
+        lines = []
+        for name, (kind, help_text, label_names) in METRICS.items():
+            series = samples.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_values in sorted(series):
+                value = series[label_values]
+                if kind != 'histogram':
+                    lines.append(f"{name}{_labels(label_names, label_values)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), value):
+                    cumulative += count
+                    bucket_labels = _labels(label_names + ('le',), label_values + (bound,))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_labels(label_names, label_values)} {value[-1]}")
+                lines.append(f"{name}_count{_labels(label_names, label_values)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsEndpoint:
+    """在本地端口上以 HTTP 提供 /metrics，供 Prometheus 抓取。"""
+    def __init__(self, metrics, host, port, log_queue):
+        self._metrics = metrics
+        self._host = host
+        self._port = port
+        self._log_queue = log_queue
+        self._httpd = None
+        self._thread = None
+
+    def log(self, message):
+        self._log_queue.put(f"[Metrics] {message}")
+
+    def start(self):
+        metrics = self._metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._httpd = ThreadingHTTPServer((self._host, self._port), Handler)
+        except OSError as e:
+            self.log(f"[!] 启动指标接口失败: {e}")
+            return
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        self.log(f"指标接口已启动于 http://{self._host}:{self._port}/metrics")
+
+    def stop(self):
+        if not self._httpd:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._httpd = None
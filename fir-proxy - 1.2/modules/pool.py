@@ -0,0 +1,169 @@
+# modules/pool.py
+
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .handshake import parse_proxy_info, socks5_greet
+
+
+def _is_alive(sock) -> bool:
+    """非阻塞地窥探一个空闲连接，判断它是否已被对端关闭。"""
+    prev_timeout = sock.gettimeout()
+    try:
+        sock.setblocking(False)
+        # 空闲连接上不应出现任何数据：读到 EOF 或意外数据都视为不可用
+        sock.recv(1, socket.MSG_PEEK)
+        return False
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        try:
+            sock.settimeout(prev_timeout)
+        except OSError:
+            pass
+
+
+class UpstreamPool:
+    """
+    上游连接池：为评分最高的若干上游代理预先建立 TCP 连接（SOCKS5 上游还会提前完成方法协商），
+    请求到来时直接取用，只需再发送一次 CONNECT 请求。
+    后台线程负责补充连接，并清理空闲超时或已不在可用列表中的代理的连接。
+    """
+    WARM_FAILURE_BACKOFF = 10
+
+    def __init__(self, rotator, log_queue, size_per_proxy=2, top_n=3, idle_timeout=30, connect_timeout=5, refill_interval=1.0):
+        self._rotator = rotator
+        self._log_queue = log_queue
+        self.size_per_proxy = size_per_proxy
+        self.top_n = top_n
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.refill_interval = refill_interval
+
+        self._idle = {}                      # 代理地址 -> deque[(socket, 建立时间)]
+        self._warming = defaultdict(int)     # 代理地址 -> 正在建立中的连接数
+        self._backoff_until = {}             # 代理地址 -> 预热失败后的暂停截止时间
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        self._executor = None
+
+    def log(self, message):
+        self._log_queue.put(f"[Pool] {message}")
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=8)
+        self._thread = threading.Thread(target=self._maintain_loop, daemon=True)
+        self._thread.start()
+        self.log(f"上游连接池已启动: 前 {self.top_n} 个代理, 每个保持 {self.size_per_proxy} 条预热连接。")
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            conns = [sock for dq in self._idle.values() for sock, _ in dq]
+            self._idle.clear()
+        for sock in conns:
+            sock.close()
+
+    def acquire(self, proxy_info: dict):
+        """取出一条指定代理的预热连接，没有可用连接时返回 None。"""
+        addr = proxy_info.get('proxy')
+        found = None
+        stale = []
+        with self._lock:
+            conns = self._idle.get(addr)
+            while conns:
+                sock, _ = conns.pop()  # 优先使用最新建立的连接
+                if _is_alive(sock):
+                    found = sock
+                    break
+                stale.append(sock)
+        for sock in stale:
+            sock.close()
+        if conns is not None:
+            self._wakeup.set()  # 有连接被取走，立即补充
+        return found
+
+    def _maintain_loop(self):
+        while self._running:
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                self._maintain()
+            except Exception as e:
+                self.log(f"[!] 连接池维护出错: {e}")
+
+    def _maintain(self):
+        targets = {p['proxy']: p for p in self._rotator.get_top_proxies(self.top_n)}
+        current = self._rotator.get_current_proxy()
+        if current:
+            targets.setdefault(current['proxy'], current)
+
+        now = time.monotonic()
+        stale = []
+        jobs = []
+        with self._lock:
+            for addr in list(self._idle):
+                conns = self._idle[addr]
+                if addr not in targets:
+                    # 代理已被标记为不可用、移除或跌出前列
+                    stale.extend(sock for sock, _ in conns)
+                    del self._idle[addr]
+                    continue
+                while conns and now - conns[0][1] > self.idle_timeout:
+                    stale.append(conns.popleft()[0])
+
+            for addr, proxy_info in targets.items():
+                if self._backoff_until.get(addr, 0) > now:
+                    continue
+                have = len(self._idle.get(addr, ())) + self._warming[addr]
+                for _ in range(self.size_per_proxy - have):
+                    self._warming[addr] += 1
+                    jobs.append(proxy_info)
+
+        for sock in stale:
+            sock.close()
+        for proxy_info in jobs:
+            self._executor.submit(self._warm, proxy_info)
+
+    def _warm(self, proxy_info: dict):
+        """建立一条到上游代理的连接，SOCKS5 上游同时完成方法协商。"""
+        addr = proxy_info['proxy']
+        sock = None
+        try:
+            host, port, proto = parse_proxy_info(proxy_info)
+            sock = socket.create_connection((host, port), timeout=self.connect_timeout)
+            if proto == 'SOCKS5':
+                socks5_greet(sock)
+        except Exception:
+            if sock:
+                sock.close()
+                sock = None
+
+        with self._lock:
+            self._warming[addr] -= 1
+            if not sock:
+                self._backoff_until[addr] = time.monotonic() + self.WARM_FAILURE_BACKOFF
+            elif self._running:
+                self._backoff_until.pop(addr, None)
+                self._idle.setdefault(addr, deque()).append((sock, time.monotonic()))
+                sock = None
+        if sock:
+            sock.close()
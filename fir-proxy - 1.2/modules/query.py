@@ -0,0 +1,268 @@
+# modules/query.py
+
+import bisect
+
+_INF = float('inf')
+
+
+def _as_set(values):
+    if values is None or values == "All":
+        return None
+    if isinstance(values, str):
+        return frozenset((values,))
+    return frozenset(values) or None
+
+
+def _popcount(bits):
+    return bits.bit_count() if hasattr(bits, 'bit_count') else bin(bits).count('1')
+
+
+def _iter_bits(bits):
+    """按从低到高的顺序返回位图中置位的下标。"""
+    digits = bin(bits)[:1:-1]
+    i = digits.find('1')
+    while i >= 0:
+        yield i
+        i = digits.find('1', i + 1)
+
+
+def _latency_ms(p_info):
+    latency = p_info.get('latency')
+    return _INF if latency is None else latency * 1000
+
+
+class ProxyQuery:
+    """
+    代理筛选条件: 国家/地区、协议、匿名度可各给多个取值 (任一匹配即可)，延迟上限 (毫秒) 与速度下限 (Mbps)。
+    取值为 None 表示不限；status 默认只要 'Working'，为 None 时不限状态。
+    不可变且可哈希，可作为候选列表的键。
+    """
+    __slots__ = ('regions', 'protocols', 'anonymity', 'max_latency_ms', 'min_speed', 'status', '_key')
+
+    def __init__(self, regions=None, protocols=None, anonymity=None, max_latency_ms=None, min_speed=None, status='Working'):
+        self.regions = _as_set(regions)
+        self.protocols = _as_set(protocols)
+        self.anonymity = _as_set(anonymity)
+        self.max_latency_ms = max_latency_ms
+        self.min_speed = min_speed
+        self.status = status
+        self._key = (self.regions, self.protocols, self.anonymity, max_latency_ms, min_speed, status)
+
+    @classmethod
+    def from_filters(cls, region="All", quality_latency_ms=None):
+        """由原先的 (地区, 延迟上限) 筛选条件构造。"""
+        return cls(regions=region, max_latency_ms=quality_latency_ms)
+
+    def replace(self, **changes):
+        """返回修改了部分条件的新查询。"""
+        fields = {name: getattr(self, name) for name in ('regions', 'protocols', 'anonymity', 'max_latency_ms', 'min_speed', 'status')}
+        fields.update(changes)
+        return ProxyQuery(**fields)
+
+    def matches(self, p_info) -> bool:
+        if self.status is not None and p_info.get('status') != self.status:
+            return False
+        if self.regions is not None and p_info.get('location') not in self.regions:
+            return False
+        if self.protocols is not None and p_info.get('protocol') not in self.protocols:
+            return False
+        if self.anonymity is not None and p_info.get('anonymity') not in self.anonymity:
+            return False
+        if self.max_latency_ms is not None and _latency_ms(p_info) > self.max_latency_ms:
+            return False
+        if self.min_speed is not None and (p_info.get('speed') or 0) < self.min_speed:
+            return False
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, ProxyQuery) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __getstate__(self):
+        return self._key
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return f"ProxyQuery{self._key!r}"
+
+
+
+
+class QueryIndex:
+    """
+    代理池的多属性位图索引: 每条记录占一个槽位，每个属性取值对应一个位图 (bytearray，按槽位置位)。
+    状态、国家/地区、协议、匿名度按取值建位图；延迟与速度按数值分桶 (LATENCY_BUCKETS / SPEED_BUCKETS) 建位图。
+    查询时把所涉位图转为整数按位与/或: 分类条件取对应取值的位图，数值条件取整桶都满足条件的位图，
+    只有跨越阈值的那一个桶需要逐条比较原值。增删改只改动有变化的属性位图中的一位，为 O(1)。
+    不是线程安全的，由调用方 (ProxyRotator) 加锁；frozen() 得到的只读副本可供多个线程无锁查询。
+    """
+    CATEGORIES = ('status', 'location', 'protocol', 'anonymity')
+    # 分桶上界 (含)，最后一桶为无穷大
+    LATENCY_BUCKETS = (50, 100, 150, 200, 300, 400, 500, 600, 800, 1000, 1500, 2000, 3000, 5000, 7000, 10000, _INF)
+    SPEED_BUCKETS = (0.1, 0.2, 0.5, 1, 2, 3, 5, 8, 10, 20, 50, 100, _INF)
+
+    def __init__(self):
+        self._slots = {}        # 记录 -> 槽位
+        self._records = []      # 槽位 -> 记录，空闲槽位为 None
+        self._free = []
+        self._values = []       # 槽位 -> 建索引时的 (状态, 地区, 协议, 匿名度, 延迟毫秒, 速度)
+        # 属性 -> {取值 (数值属性为所在桶的上界): 位图}
+        self._bitmaps = {attr: {} for attr in self.CATEGORIES + ('latency', 'speed')}
+        self._all = bytearray()
+
+    def __len__(self):
+        return len(self._slots)
+
+    @staticmethod
+    def _set(bitmap, slot):
+        byte = slot >> 3
+        if byte >= len(bitmap):
+            bitmap.extend(bytes(byte + 1 - len(bitmap)))
+        bitmap[byte] |= 1 << (slot & 7)
+
+    @staticmethod
+    def _unset(bitmap, slot):
+        bitmap[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+
+    def _keys(self, values):
+        """槽位在各属性位图中的键: 分类属性为取值本身，数值属性为所在桶的上界。"""
+        return values[:4] + (self.LATENCY_BUCKETS[bisect.bisect_left(self.LATENCY_BUCKETS, values[4])],
+                             self.SPEED_BUCKETS[bisect.bisect_left(self.SPEED_BUCKETS, values[5])])
+
+    def add(self, p_info):
+        """加入一条记录；已在索引中时按其当前字段更新，只改动有变化的属性。"""
+        values = tuple(p_info.get(attr) for attr in self.CATEGORIES) + (_latency_ms(p_info), p_info.get('speed') or 0)
+        slot = self._slots.get(p_info)
+        old_keys = None
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._records)
+                self._records.append(None)
+                self._values.append(None)
+            self._slots[p_info] = slot
+            self._records[slot] = p_info
+            self._set(self._all, slot)
+        elif values == self._values[slot]:
+            return
+        else:
+            old_keys = self._keys(self._values[slot])
+        self._values[slot] = values
+        for i, (bitmaps, key) in enumerate(zip(self._bitmaps.values(), self._keys(values))):
+            if old_keys is not None:
+                if old_keys[i] == key:
+                    continue
+                self._unset(bitmaps[old_keys[i]], slot)
+            bitmap = bitmaps.get(key)
+            if bitmap is None:
+                bitmap = bitmaps[key] = bytearray()
+            self._set(bitmap, slot)
+
+    def remove(self, p_info):
+        slot = self._slots.pop(p_info, None)
+        if slot is None:
+            return
+        for bitmaps, key in zip(self._bitmaps.values(), self._keys(self._values[slot])):
+            self._unset(bitmaps[key], slot)
+        self._unset(self._all, slot)
+        self._records[slot] = self._values[slot] = None
+        self._free.append(slot)
+
+    def clear(self):
+        self.__init__()
+
+    def frozen(self) -> 'QueryIndex':
+        """返回当前状态的只读副本 (位图为 bytes)，之后对本索引的增删改不影响副本。副本只能查询。"""
+        view = QueryIndex.__new__(QueryIndex)
+        view._slots = dict(self._slots)
+        view._records = list(self._records)
+        view._free = ()
+        view._values = list(self._values)
+        view._bitmaps = {attr: {key: bytes(bitmap) for key, bitmap in bitmaps.items()}
+                         for attr, bitmaps in self._bitmaps.items()}
+        view._all = bytes(self._all)
+        return view
+
+    def _any_of(self, attr, keys) -> int:
+        bitmaps = self._bitmaps[attr]
+        bits = 0
+        for key in keys:
+            bitmap = bitmaps.get(key)
+            if bitmap:
+                bits |= int.from_bytes(bitmap, 'little')
+        return bits
+
+    def _to_bits(self, slots) -> int:
+        marks = bytearray(len(self._all))
+        for slot in slots:
+            marks[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(marks, 'little')
+
+    def _range(self, bits, attr, buckets, field, threshold, upper) -> int:
+        """
+        在 bits 中保留数值满足条件的槽位: upper 为真时要求 值 <= threshold，否则要求 值 >= threshold。
+        整桶满足条件的直接取位图，阈值所在的桶逐条比较。
+        """
+        edge = bisect.bisect_left(buckets, threshold)
+        # 桶 i 的取值范围为 (buckets[i-1], buckets[i]]
+        if upper:
+            whole = buckets[:edge]
+        else:
+            whole = buckets[edge + 1:]
+        partial = buckets[edge] if edge < len(buckets) else None
+        result = bits & self._any_of(attr, whole)
+        if partial is not None:
+            boundary = bits & self._any_of(attr, (partial,))
+            if boundary:
+                values = self._values
+                if upper:
+                    keep = (slot for slot in _iter_bits(boundary) if values[slot][field] <= threshold)
+                else:
+                    keep = (slot for slot in _iter_bits(boundary) if values[slot][field] >= threshold)
+                result |= self._to_bits(keep)
+        return result
+
+    def _bits(self, query: ProxyQuery) -> int:
+        bits = int.from_bytes(self._all, 'little')
+        for attr, keys in (('status', None if query.status is None else (query.status,)), ('location', query.regions),
+                           ('protocol', query.protocols), ('anonymity', query.anonymity)):
+            if keys is not None and bits:
+                bits &= self._any_of(attr, keys)
+        if query.max_latency_ms is not None and bits:
+            bits = self._range(bits, 'latency', self.LATENCY_BUCKETS, 4, query.max_latency_ms, True)
+        if query.min_speed is not None and bits:
+            bits = self._range(bits, 'speed', self.SPEED_BUCKETS, 5, query.min_speed, False)
+        return bits
+
+    def select(self, query: ProxyQuery) -> list:
+        """返回满足查询条件的记录 (按槽位顺序，无特定含义)。"""
+        records = self._records
+        return [records[slot] for slot in _iter_bits(self._bits(query))]
+
+    def count(self, query: ProxyQuery) -> int:
+        return _popcount(self._bits(query))
+
+    def count_by(self, attr: str, query: ProxyQuery) -> dict:
+        """按某个分类属性 (status / location / protocol / anonymity) 统计满足查询条件的记录数。"""
+        bits = self._bits(query)
+        counts = {}
+        if not bits:
+            return counts
+        if _popcount(bits) * len(self._bitmaps[attr]) < len(self._all) * 8:
+            # 结果较少时逐条计数，比逐个取值做位图运算更快
+            field = self.CATEGORIES.index(attr)
+            values = self._values
+            for slot in _iter_bits(bits):
+                value = values[slot][field]
+                counts[value] = counts.get(value, 0) + 1
+        else:
+            for value, bitmap in self._bitmaps[attr].items():
+                n = _popcount(bits & int.from_bytes(bitmap, 'little'))
+                if n:
+                    counts[value] = n
+        return counts
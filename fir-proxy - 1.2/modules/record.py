@@ -0,0 +1,161 @@
+# modules/record.py
+
+import socket
+
+# 协议、状态与匿名度按下标编码存放，表外的取值原样保存
+PROTOCOLS = ('HTTP', 'HTTPS', 'SOCKS4', 'SOCKS5')
+STATUSES = ('Working', 'Unavailable', 'Failed')
+ANONYMITY_LEVELS = ('Unknown', 'Transparent', 'Anonymous', 'Elite')
+
+
+def _encode(table, value):
+    try:
+        return table.index(value)
+    except ValueError:
+        return value
+
+
+def _decode(table, code):
+    return table[code] if type(code) is int else code
+
+
+def _pack_address(address):
+    """把 'IPv4:端口' 打包为一个整数 (IP << 16 | 端口)，其他形式 (域名、IPv6 等) 原样返回。"""
+    if not isinstance(address, str):
+        return address
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit() or int(port) > 0xFFFF:
+        return address
+    try:
+        packed = socket.inet_aton(host)
+    except OSError:
+        return address
+    # inet_aton 也接受 '1.2' 之类的简写，只有能原样还原的才打包
+    if socket.inet_ntoa(packed) != host or str(int(port)) != port:
+        return address
+    return int.from_bytes(packed, 'big') << 16 | int(port)
+
+
+def _unpack_address(packed):
+    if type(packed) is not int:
+        return packed
+    return f"{socket.inet_ntoa((packed >> 16).to_bytes(4, 'big'))}:{packed & 0xFFFF}"
+
+
+class ProxyRecord:
+    """
+    代理池中的一条代理记录，取代原先的自由格式字典以节省内存。
+    地址打包为整数，协议、状态与匿名度编码为下标，其余字段各占一个槽位。
+    对外保留字典式接口 (get / [] / setdefault / update / keys)，现有按键访问的代码无需改动；
+    未设置的字段与字典中缺少的键表现一致，表外的键存放在附加字典中。
+    记录按对象本身比较与哈希，可直接用作字典键；读取地址需要解包，热路径上应尽量复用已有的地址字符串。
+    """
+    FIELDS = ('proxy', 'protocol', 'status', 'anonymity', 'latency', 'speed', 'score', 'location', 'consecutive_failures')
+    _FIELD_SET = frozenset(FIELDS)
+    __slots__ = ('_address', '_protocol', '_status', '_anonymity', 'latency', 'speed', 'score', 'location',
+                 'consecutive_failures', '_extra')
+
+    def __init__(self, **fields):
+        self._extra = None
+        self.update(fields)
+
+    @classmethod
+    def from_dict(cls, data):
+        """由代理信息字典构造记录，已是记录时原样返回。"""
+        if isinstance(data, cls):
+            return data
+        record = cls()
+        record.update(data)
+        return record
+
+    def to_dict(self) -> dict:
+        """转换回代理信息字典，用于导出与跨进程同步。"""
+        return {key: self[key] for key in self.keys()}
+
+    @property
+    def proxy(self):
+        return _unpack_address(self._address)
+
+    @proxy.setter
+    def proxy(self, value):
+        self._address = _pack_address(value)
+
+    @property
+    def protocol(self):
+        return _decode(PROTOCOLS, self._protocol)
+
+    @protocol.setter
+    def protocol(self, value):
+        self._protocol = _encode(PROTOCOLS, value)
+
+    @property
+    def status(self):
+        return _decode(STATUSES, self._status)
+
+    @status.setter
+    def status(self, value):
+        self._status = _encode(STATUSES, value)
+
+    @property
+    def anonymity(self):
+        return _decode(ANONYMITY_LEVELS, self._anonymity)
+
+    @anonymity.setter
+    def anonymity(self, value):
+        self._anonymity = _encode(ANONYMITY_LEVELS, value)
+
+    # --- 字典式接口 ---
+    def get(self, key, default=None):
+        if key in self._FIELD_SET:
+            return getattr(self, key, default)
+        return self._extra.get(key, default) if self._extra else default
+
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        if key in self._FIELD_SET:
+            return hasattr(self, key)
+        return bool(self._extra) and key in self._extra
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, data):
+        for key, value in data.items():
+            self[key] = value
+
+    def keys(self):
+        keys = [key for key in self.FIELDS if hasattr(self, key)]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"ProxyRecord({self.to_dict()!r})"
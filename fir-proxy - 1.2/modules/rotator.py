@@ -1,73 +1,384 @@
 # modules/rotator.py
 
+import bisect
+import heapq
+import random
 import threading
-from collections import defaultdict
+from contextlib import contextmanager
+
+from .query import ProxyQuery, QueryIndex
+from .record import ProxyRecord
+from .scoring import ProxyScorer
+
+
+class _CandidateIndex:
+    """
+    满足一组筛选条件 (ProxyQuery) 的代理，按分数从高到低 (同分按加入顺序) 有序维护，
+    并附带该组代理的轮换游标与按地区的计数。代理变化时增量插入或删除，选择时无需扫描和排序。
+    proxies 与 region_counts 发布后不再修改: 写入方在私有副本上修改，publish() 时整体替换引用，
+    读取方先取得引用再使用，无需加锁。
+    """
+    __slots__ = ('query', 'matches', 'keys', 'proxies', 'region_counts', 'cursor', '_pending', '_pending_counts')
+
+    def __init__(self, query):
+        self.query = query
+        self.matches = query.matches
+        self.keys = []        # 与 proxies (有未发布的修改时为 _pending) 一一对应的排序键 (-分数, 加入序号)，仅写入方使用
+        self.proxies = []
+        self.region_counts = {}
+        self.cursor = -1
+        self._pending = None
+        self._pending_counts = None
+
+    def _writable(self):
+        # 同一批写入只复制一次，之后在私有副本上原地修改
+        if self._pending is None:
+            self._pending = list(self.proxies)
+            self._pending_counts = dict(self.region_counts)
+        return self._pending, self._pending_counts
+
+    def insert(self, key, p_info):
+        proxies, counts = self._writable()
+        i = bisect.bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        proxies.insert(i, p_info)
+        region = p_info.get('location', 'Unknown')
+        counts[region] = counts.get(region, 0) + 1
+
+    def remove(self, key, p_info):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            proxies, counts = self._writable()
+            del self.keys[i]
+            del proxies[i]
+            region = p_info.get('location', 'Unknown')
+            counts[region] -= 1
+            if not counts[region]:
+                del counts[region]
+
+    def publish(self):
+        if self._pending is not None:
+            self.proxies, self.region_counts = self._pending, self._pending_counts
+            self._pending = self._pending_counts = None
+
 
 class ProxyRotator:
-    """代理轮换器，负责管理、轮换和筛选代理。"""
+    """
+    代理轮换器，负责管理、轮换和筛选代理。
+    代理以 ProxyRecord 按地址存放在哈希表中；每组用过的筛选条件各有一份有序候选列表，在代理增删改时增量维护，
+    因此按地址查找为 O(1)，选择下一个代理为 O(1)，更新一个代理为 O(log n) 次比较加一次列表复制。
+    另有按属性的查询索引 (QueryIndex)，用于首次构建候选列表以及界面、导出的任意条件查询与计数；
+    没有候选列表的查询与计数使用已发布版本的只读副本，同样不加锁。
+
+    读写分离: 写入 (增删改、失败上报、载入快照) 持有锁，在候选列表的私有副本上修改；
+    读取 (选择代理、查询、统计) 不等待锁，只读取已发布的不可变列表与按地址的哈希表。
+    有未发布的写入时，读取方若能立即拿到锁就顺带发布，否则 (如批量写入进行中) 直接使用上一版本，
+    因此逐连接的上游选择不会等待批量重测等写入，连续的多次写入也只需复制一次列表。
+    批量写入可放在 batch() 中，期间的修改在批次结束前对读取方不可见。
+    代理记录本身在原处更新，读取方可能短暂看到刚失效的代理仍在候选列表中，由连接失败后的重试兜底。
+    """
+    # 选择策略: 'round_robin' 按分数顺序轮换; 'least_conn' 选当前打开连接最少的;
+    # 'p2c' 随机取两个候选，选 EWMA 建连耗时 × (连接数 + 1) 较小者; 'weighted' 按分数加权随机
+    STRATEGIES = ('round_robin', 'least_conn', 'p2c', 'weighted')
+    # 建连耗时 EWMA 的平滑系数，越大越偏重最近的观测
+    EWMA_ALPHA = 0.3
+    # weighted 策略的拒绝采样次数上限，超过后退回逐个加权的抽样
+    WEIGHTED_TRIES = 32
+    # 最多保留的候选列表组数 (不含全部可用代理这一组)，超出时丢弃并在下次使用时重建
+    MAX_INDEXES = 32
+    # 全部可用代理
+    WORKING = ProxyQuery()
+
     def __init__(self):
-        self.all_proxies = []
-        self.proxies_by_country = defaultdict(list)
-        self.indices = defaultdict(lambda: -1)
+        self._proxies = {}        # 代理地址 -> 代理信息，保持加入顺序
+        self._order = {}          # 代理记录 -> 加入序号，同分代理按此排序
+        self._next_order = 0
+        self._indexes = {}        # ProxyQuery -> _CandidateIndex
+        self._query_index = QueryIndex()
         self.current_proxy = None
-        self.lock = threading.Lock()
-        
-        # 新增：保存当前激活的过滤器状态
-        self.current_filter_region = "All"
-        self.current_filter_quality_latency_ms = None
+        self.lock = threading.RLock()
+        self._batch_depth = 0
+        self._dirty = False
+        # 已发布状态的版本号: 每次发布写入、重建候选列表或切换筛选条件时加一，供外部缓存判断是否需要更新
+        self.version = 0
+        self._reset_indexes()
+        # (版本号, 该版本查询索引的只读副本)，由 _published_view() 按需更新
+        self._query_view = (self.version, self._query_index.frozen())
+
+        # 当前激活的筛选条件
+        self.current_query = self.WORKING
+
+        self.strategy = 'round_robin'
+        # 运行期负载信息: 代理地址 -> 建连耗时 EWMA (秒)，以及返回某代理当前打开连接数的函数
+        self._latency_ewma = {}
+        self._load_source = None
+        # 每个代理最近的验证与转发结果，用于计算分数
+        self.scorer = ProxyScorer()
+        # 由 report_failure (熔断) 标记为不可用、尚未被验证结果覆盖的代理地址，restore 只恢复这些代理
+        self._tripped = set()
+        # 代理移出代理池时以其地址调用的函数 (如丢弃该上游的熔断状态)
+        self._remove_listeners = []
+
+    def add_remove_listener(self, listener):
+        """登记一个函数 (代理地址 -> None)，代理被移除、清空或被快照替换掉时调用。在持有锁时调用，不应回调轮换器。"""
+        self._remove_listeners.append(listener)
+
+    def _removed(self, addresses):
+        """已移出代理池的地址: 清理按地址保存的运行期状态并通知监听者。调用方需持有锁。"""
+        for proxy_address in addresses:
+            self._tripped.discard(proxy_address)
+            for listener in self._remove_listeners:
+                listener(proxy_address)
+
+    def _reset_indexes(self, keys=()):
+        """按 _proxies 重建查询索引、全部可用代理这一组及 keys 中的各组候选列表，并整体替换。调用方需持有锁。"""
+        self._query_index = QueryIndex()
+        for p_info in self._proxies.values():
+            self._query_index.add(p_info)
+        working = self._build_index(self.WORKING)
+        indexes = {self.WORKING: working}
+        for key in keys:
+            indexes.setdefault(key, self._build_index(key))
+        self._indexes, self._working = indexes, working
+        self.version += 1
+
+    def _sort_key(self, p_info):
+        return (-p_info.get('score', 0), self._order[p_info])
+
+    def _published_sort_key(self):
+        """供读取已发布副本的结果排序: 其中的代理可能已被未发布的写入移除，没有加入序号时排在同分代理之后。"""
+        order, last = self._order, self._next_order
+        return lambda p_info: (-p_info.get('score', 0), order.get(p_info, last))
+
+    def _build_index(self, query, source=None):
+        """由查询索引 (默认为写入方的查询索引，调用方需持有锁) 构建候选列表。"""
+        index = _CandidateIndex(query)
+        if source is None:
+            entries = sorted((self._sort_key(p), p) for p in self._query_index.select(query))
+        else:
+            sort_key = self._published_sort_key()
+            entries = sorted((sort_key(p), p) for p in source.select(query))
+        index.keys = [key for key, _ in entries]
+        index.proxies = [p for _, p in entries]
+        for p_info in index.proxies:
+            region = p_info.get('location', 'Unknown')
+            index.region_counts[region] = index.region_counts.get(region, 0) + 1
+        return index
+
+    def _candidates(self, query):
+        """
+        返回筛选条件对应的候选列表。首次使用某组条件时加锁，先发布已提交的写入再构建，此后的读取不加锁。
+        本线程的 batch() 进行中时状态尚未提交，只按已发布版本临时构建一份，不保存也不参与增量维护。
+        """
+        index = self._indexes.get(query)
+        if index is not None:
+            return index
+        with self.lock:
+            index = self._indexes.get(query)
+            if index is None:
+                if self._batch_depth:
+                    return self._build_index(query, self._published_view())
+                self._publish()
+                index = self._build_index(query)
+                indexes = self._indexes if len(self._indexes) <= self.MAX_INDEXES else {self.WORKING: self._working}
+                indexes[query] = index
+                self._indexes = indexes
+            return index
+
+    def _effective_candidates(self) -> list:
+        """当前筛选条件下已发布的候选列表，无符合条件者时放宽为全部可用代理。"""
+        self._refresh()
+        proxies = self._candidates(self.current_query).proxies
+        return proxies or self._working.proxies
+
+    def _publish(self):
+        """发布写入产生的候选列表。调用方需持有锁，batch() 内推迟到批次结束。"""
+        if self._batch_depth:
+            return
+        for index in self._indexes.values():
+            index.publish()
+        if self._dirty:
+            self.version += 1
+        self._dirty = False
+
+    def _refresh(self):
+        """读取前调用: 有未发布的写入且锁空闲时发布，锁被占用时不等待，沿用已发布的版本。"""
+        if self._dirty and self.lock.acquire(blocking=False):
+            try:
+                self._publish()
+            finally:
+                self.lock.release()
+
+    def _published_view(self) -> QueryIndex:
+        """
+        已发布版本的查询索引只读副本，版本变化后首次使用时复制一次。
+        与 _refresh() 相同，锁被占用或批量写入进行中 (状态尚未提交) 时不等待，沿用上一版本的副本。
+        """
+        self._refresh()
+        version, view = self._query_view
+        if version == self.version or not self.lock.acquire(blocking=False):
+            return view
+        try:
+            if not self._batch_depth:
+                self._publish()
+                view = self._query_index.frozen()
+                self._query_view = (self.version, view)
+            return view
+        finally:
+            self.lock.release()
+
+    @contextmanager
+    def batch(self):
+        """批量写入: 期间的增删改只在结束时发布一次，读取方在此之前看到的仍是批次开始前的状态。"""
+        with self.lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                self._publish()
+
+    def _index(self, p_info):
+        self._query_index.add(p_info)
+        key = self._sort_key(p_info)
+        for index in self._indexes.values():
+            if index.matches(p_info):
+                index.insert(key, p_info)
+
+    def _unindex(self, p_info):
+        # 查询索引在 _index() 时按记录的新字段原地更新，这里无需移除
+        key = self._sort_key(p_info)
+        for index in self._indexes.values():
+            if index.matches(p_info):
+                index.remove(key, p_info)
 
     def clear(self):
         """清空所有代理，并重置内部状态。"""
         with self.lock:
-            self.all_proxies = []
-            self.proxies_by_country.clear()
-            self.indices.clear()
+            removed = list(self._proxies)
+            self._proxies = {}
+            self._order = {}
+            self._reset_indexes()
             self.current_proxy = None
-    
+            self._latency_ewma = {}
+            self.scorer.clear()
+            self._removed(removed)
+
     def set_filters(self, region="All", quality_latency_ms=None):
+        """设置轮换器当前使用的筛选条件 (地区, 延迟上限)。"""
+        self.set_query(ProxyQuery.from_filters(region, quality_latency_ms))
+
+    def set_query(self, query: ProxyQuery):
         """设置轮换器当前使用的筛选条件。"""
         with self.lock:
-            self.current_filter_region = region
-            self.current_filter_quality_latency_ms = quality_latency_ms
+            self.current_query = query
+            self.version += 1
+
+    def set_strategy(self, strategy: str) -> bool:
+        """设置选择策略，未知策略返回 False 且保持不变。"""
+        if strategy not in self.STRATEGIES:
+            return False
+        with self.lock:
+            self.strategy = strategy
+        return True
+
+    def set_load_source(self, load_source):
+        """设置返回某代理当前打开连接数的函数 (代理地址 -> int)，供 least_conn 与 p2c 策略使用。"""
+        self._load_source = load_source
+
+    def observe_latency(self, proxy_address: str, seconds: float):
+        """记录一次经该代理建立隧道的耗时，更新其 EWMA。位于逐连接路径上，不加锁，并发时偶尔丢失一次观测无妨。"""
+        previous = self._latency_ewma.get(proxy_address)
+        if previous is None:
+            self._latency_ewma[proxy_address] = seconds
+        else:
+            self._latency_ewma[proxy_address] = previous + self.EWMA_ALPHA * (seconds - previous)
+
+    def record_outcome(self, proxy_address: str, ok: bool):
+        """记录一次经该代理的实际转发成败，计入其结果历史，下次验证时参与打分。不加锁。"""
+        self.scorer.record_traffic(proxy_address, ok)
+
+    def _load(self, p_info) -> int:
+        return self._load_source(p_info.get('proxy')) if self._load_source else 0
+
+    def _latency(self, p_info) -> float:
+        """代理的建连耗时 EWMA，尚无观测时以验证时测得的延迟代替。"""
+        ewma = self._latency_ewma.get(p_info.get('proxy'))
+        return ewma if ewma is not None else p_info.get('latency') or 1.0
+
+    def _choose(self, index, candidates):
+        """
+        按当前策略从已发布的候选列表中选出一个代理，除 least_conn 的负载扫描外均为 O(1)。
+        游标的更新不加锁，并发选择偶尔选到同一个代理无妨。
+        """
+        strategy = self.strategy
+        if strategy == 'p2c' and len(candidates) > 1:
+            a, b = random.sample(candidates, 2)
+            cost_a = self._latency(a) * (self._load(a) + 1)
+            cost_b = self._latency(b) * (self._load(b) + 1)
+            return a if cost_a <= cost_b else b
+        if strategy == 'weighted':
+            # 候选按分数降序排列，首个即最高分: 均匀抽取后以 分数/最高分 的概率接受
+            top = candidates[0].get('score', 0)
+            if top > 0:
+                for _ in range(self.WEIGHTED_TRIES):
+                    p_info = random.choice(candidates)
+                    if random.random() * top < p_info.get('score', 0):
+                        return p_info
+                weights = [max(p.get('score', 0), 0) for p in candidates]
+                return random.choices(candidates, weights=weights)[0]
+        if strategy == 'least_conn':
+            # 从游标处向后找连接数最少的代理，遇到空闲代理立即选中，负载相同时依次轮换
+            count = len(candidates)
+            best, best_load = 0, None
+            for step in range(1, count + 1):
+                i = (index.cursor + step) % count
+                load = self._load(candidates[i])
+                if best_load is None or load < best_load:
+                    best, best_load = i, load
+                    if not load:
+                        break
+            index.cursor = best
+            return candidates[best]
+
+        cursor = index.cursor = (index.cursor + 1) % len(candidates)
+        return candidates[cursor]
 
     def add_proxy(self, proxy_info: dict):
-        """添加一个新代理，如果代理地址已存在则忽略。"""
+        """添加一个新代理 (字典或 ProxyRecord)，如果代理地址已存在则忽略。"""
+        proxy_info = ProxyRecord.from_dict(proxy_info)
         with self.lock:
             proxy_address = proxy_info.get('proxy')
-            if any(p.get('proxy') == proxy_address for p in self.all_proxies):
-                return 
+            if proxy_address in self._proxies:
+                return
 
             proxy_info.setdefault('consecutive_failures', 0)
             proxy_info.setdefault('status', 'Working')
-            self.all_proxies.append(proxy_info)
-            country = proxy_info.get('location', 'Unknown')
-            self.proxies_by_country[country].append(proxy_info)
+            self._proxies[proxy_address] = proxy_info
+            self._order[proxy_info] = self._next_order
+            self._next_order += 1
+            self._index(proxy_info)
+            self._dirty = True
 
     def remove_proxy(self, proxy_address: str):
         """根据代理地址移除一个代理。"""
         with self.lock:
-            proxy_to_remove = None
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    proxy_to_remove = p_info
-                    break
-            
-            if proxy_to_remove:
-                self.all_proxies.remove(proxy_to_remove)
-                
-                country = proxy_to_remove.get('location', 'Unknown')
-                if country in self.proxies_by_country:
-                    try:
-                        self.proxies_by_country[country].remove(proxy_to_remove)
-                        if not self.proxies_by_country[country]:
-                            del self.proxies_by_country[country]
-                    except ValueError:
-                        pass
-                
-                if self.current_proxy and self.current_proxy.get('proxy') == proxy_address:
-                    self.current_proxy = None
-                return True
-            return False
+            proxy_to_remove = self._proxies.get(proxy_address)
+            if not proxy_to_remove:
+                return False
+
+            self._unindex(proxy_to_remove)
+            self._query_index.remove(proxy_to_remove)
+            del self._proxies[proxy_address]
+            del self._order[proxy_to_remove]
+            self._dirty = True
+
+            if self.current_proxy is proxy_to_remove:
+                self.current_proxy = None
+            self._latency_ewma.pop(proxy_address, None)
+            self.scorer.forget(proxy_address)
+            self._removed((proxy_address,))
+            return True
 
     def report_failure(self, proxy_address: str):
         """
@@ -75,115 +386,166 @@ class ProxyRotator:
         这个方法是线程安全的。
         """
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info['status'] = 'Unavailable'
-                    # 可以在这里增加失败计数，但为了即时响应，直接设为不可用更有效
-                    # p_info['consecutive_failures'] = p_info.get('consecutive_failures', 0) + 1
-                    return
+            p_info = self._proxies.get(proxy_address)
+            if p_info and p_info.get('status') != 'Unavailable':
+                self._tripped.add(proxy_address)
+                self._unindex(p_info)
+                p_info['status'] = 'Unavailable'
+                # 可以在这里增加失败计数，但为了即时响应，直接设为不可用更有效
+                # p_info['consecutive_failures'] = p_info.get('consecutive_failures', 0) + 1
+                self._index(p_info)
+                self._dirty = True
+
+    def restore(self, proxy_address: str) -> bool:
+        """
+        把被 report_failure 标记为不可用的代理恢复为可用，供熔断冷却结束后的试探使用。
+        此后已由验证结果 (update_proxy) 改写状态的代理保持验证结果不变。代理不存在时返回 False。
+        """
+        with self.lock:
+            p_info = self._proxies.get(proxy_address)
+            if not p_info:
+                return False
+            if proxy_address in self._tripped:
+                self._tripped.discard(proxy_address)
+            else:
+                return True
+            if p_info.get('status') == 'Unavailable':
+                self._unindex(p_info)
+                p_info['status'] = 'Working'
+                self._index(p_info)
+                self._dirty = True
+            return True
 
     def get_proxy_by_address(self, proxy_address: str):
         """根据代理地址查询代理的详细信息。"""
-        with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    return p_info
-            return None
+        return self._proxies.get(proxy_address)
 
     def update_proxy(self, proxy_address: str, update_data: dict):
         """更新指定代理的信息，例如状态、延迟等。"""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    p_info.update(update_data)
-                    return True
-            return False
+            p_info = self._proxies.get(proxy_address)
+            if not p_info:
+                return False
+            if 'status' in update_data:
+                self._tripped.discard(proxy_address) # 验证结果优先于熔断造成的状态
+            self._unindex(p_info)
+            p_info.update(update_data)
+            self._index(p_info)
+            self._dirty = True
+            return True
 
     def get_all_proxies_for_revalidation(self):
         """获取所有代理的副本，用于重新验证。"""
-        with self.lock:
-            return list(self.all_proxies)
+        return list(self._proxies.values())
 
     def get_active_proxies_count(self) -> int:
         """统计当前状态为 'Working' 的代理数量。"""
-        with self.lock:
-            return sum(1 for p in self.all_proxies if p.get('status') == 'Working')
+        self._refresh()
+        return len(self._working.proxies)
 
-    def get_available_regions_with_counts(self, quality_latency_ms=None) -> dict:
-        """按地区统计 'Working' 状态的代理数量，支持按延迟筛选。"""
-        with self.lock:
-            counts = defaultdict(int)
-            for p_info in self.all_proxies:
-                if p_info.get('status') != 'Working':
-                    continue
-                
-                if quality_latency_ms is not None:
-                    latency_ms = p_info.get('latency', float('inf')) * 1000
-                    if latency_ms > quality_latency_ms:
-                        continue
+    def get_available_regions_with_counts(self, quality_latency_ms=None, query=None) -> dict:
+        """按地区统计 'Working' 状态的代理数量，支持按延迟或任意查询条件 (忽略其中的地区条件) 筛选。"""
+        if query is None:
+            query = ProxyQuery(max_latency_ms=quality_latency_ms)
+        elif query.regions is not None:
+            query = query.replace(regions=None)
+        self._refresh()
+        index = self._indexes.get(query)
+        if index is not None:
+            return dict(index.region_counts)
 
-                region = p_info.get('location', 'Unknown')
-                counts[region] += 1
-            return dict(counts)
+        # 界面上随输入变化的条件不值得为其建立候选列表，直接由查询索引统计
+        counts = self._published_view().count_by('location', query)
+        if None in counts:
+            counts['Unknown'] = counts.get('Unknown', 0) + counts.pop(None)
+        return counts
 
+    def query(self, query: ProxyQuery, limit=None) -> list:
+        """返回满足查询条件的代理，按分数从高到低排序，limit 限制返回数量。"""
+        self._refresh()
+        index = self._indexes.get(query)
+        if index is not None:
+            proxies = index.proxies
+            return proxies[:limit] if limit is not None else list(proxies)
+        matched = self._published_view().select(query)
+        sort_key = self._published_sort_key()
+        if limit is not None and limit < len(matched):
+            return heapq.nsmallest(limit, matched, key=sort_key)
+        matched.sort(key=sort_key)
+        return matched
 
-    def get_next_proxy(self):
-        """根据内部存储的筛选条件，轮换获取下一个可用代理，并按分数排序。"""
-        with self.lock:
-            candidate_proxies = []
-            
-            # 使用内部存储的过滤器
-            effective_region = self.current_filter_region
-            effective_latency = self.current_filter_quality_latency_ms
-
-            for p in self.all_proxies:
-                if p.get('status') == 'Working':
-                    region_match = (effective_region == "All" or p.get('location') == effective_region)
-                    
-                    quality_match = True
-                    if effective_latency is not None:
-                        latency_ms = p.get('latency', float('inf')) * 1000
-                        quality_match = (latency_ms <= effective_latency)
-
-                    if region_match and quality_match:
-                        candidate_proxies.append(p)
-            
-            if not candidate_proxies:
-                # 如果当前条件下无代理, 尝试放宽条件(不限区域和延迟)
-                if effective_region != "All" or effective_latency is not None:
-                    original_region = self.current_filter_region
-                    original_latency = self.current_filter_quality_latency_ms
-                    self.set_filters("All", None)
-                    result = self.get_next_proxy()
-                    self.set_filters(original_region, original_latency) # 恢复之前的过滤器
-                    return result
+    def count(self, query: ProxyQuery) -> int:
+        """统计满足查询条件的代理数量。"""
+        return self._published_view().count(query)
 
+    def get_next_proxy(self):
+        """根据内部存储的筛选条件，按当前选择策略获取下一个可用代理。"""
+        self._refresh()
+        # 如果当前条件下无代理, 放宽条件(不限区域和延迟)，不改变已保存的过滤器
+        index = self._candidates(self.current_query)
+        candidates = index.proxies
+        if not candidates:
+            index = self._working
+            candidates = index.proxies
+            if not candidates:
                 self.current_proxy = None
                 return None
 
-            candidate_proxies.sort(key=lambda p: p.get('score', 0), reverse=True)
-            
-            quality_key = f"lt{effective_latency}" if effective_latency is not None else "any"
-            index_key = f"{effective_region}_{quality_key}"
-            current_idx = self.indices.get(index_key, -1)
-            next_idx = (current_idx + 1) % len(candidate_proxies)
-            self.indices[index_key] = next_idx
-            
-            self.current_proxy = candidate_proxies[next_idx]
-            return self.current_proxy
+        self.current_proxy = self._choose(index, candidates)
+        return self.current_proxy
+
+    def get_version(self) -> int:
+        """发布未发布的写入 (锁空闲时) 后返回当前版本号；版本号不变时 get_available_proxies() 的结果也不变。"""
+        self._refresh()
+        return self.version
+
+    def get_available_proxies(self) -> list:
+        """按当前筛选条件返回全部可用代理，按分数从高到低排序（无符合条件者时放宽为全部）。"""
+        return list(self._effective_candidates())
+
+    def get_top_proxies(self, count: int) -> list:
+        """按当前筛选条件返回分数最高的若干个可用代理（无符合条件者时放宽为全部）。"""
+        return self._effective_candidates()[:count]
 
     def get_current_proxy(self):
-        """获取当前正在使用的代理。"""
-        with self.lock:
-            if self.current_proxy and self.current_proxy.get('status') != 'Working':
-                self.current_proxy = None
-            return self.current_proxy
+        """获取当前正在使用的代理，已失效时返回 None。"""
+        current = self.current_proxy
+        if current and current.get('status') != 'Working':
+            return None
+        return current
 
     def set_current_proxy_by_address(self, proxy_address: str):
         """根据地址手动设置当前代理，代理必须可用。"""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address and p_info.get('status') == 'Working':
-                    self.current_proxy = p_info
-                    return p_info
-            return None
\ No newline at end of file
+            p_info = self._proxies.get(proxy_address)
+            if p_info and p_info.get('status') == 'Working':
+                self.current_proxy = p_info
+                return p_info
+            return None
+
+    def snapshot(self) -> dict:
+        """导出代理列表、当前代理与筛选条件的可序列化副本，用于同步给其他进程。"""
+        with self.lock:
+            return {
+                'proxies': [p.to_dict() for p in self._proxies.values()],
+                'current': self.current_proxy.get('proxy') if self.current_proxy else None,
+                'query': self.current_query,
+            }
+
+    def load_snapshot(self, snapshot: dict):
+        """用 snapshot() 导出的数据替换全部状态，轮换位置保持不变。"""
+        records = [ProxyRecord.from_dict(p_info) for p_info in snapshot['proxies']]
+        with self.lock:
+            cursors = {key: index.cursor for key, index in self._indexes.items()}
+            previous = self._proxies
+            self._proxies = {p_info.get('proxy'): p_info for p_info in records}
+            self._removed([address for address in previous if address not in self._proxies])
+            # 快照中的状态以导出方为准，本地熔断造成的不可用记录不再有效，恢复与否由导出方的 restore 决定
+            self._tripped = set()
+            self._order = {p_info: i for i, p_info in enumerate(self._proxies.values())}
+            self._next_order = len(self._order)
+            self._reset_indexes(cursors)
+            for key, cursor in cursors.items():
+                self._indexes[key].cursor = cursor
+            self.current_proxy = self._proxies.get(snapshot['current'])
+            self.current_query = snapshot['query']
@@ -0,0 +1,278 @@
+# modules/scanner.py
+
+import errno
+import os
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+from operator import itemgetter
+
+from .aio_engine import _raise_nofile_limit
+
+# 非阻塞 connect 已发出、尚未完成时返回的错误码 (Windows 为 WSAEWOULDBLOCK)
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)}
+# 文件描述符耗尽，此时不能判定候选不可达，应稍后重试
+_FD_EXHAUSTED = {errno.EMFILE, errno.ENFILE}
+# 关闭时直接发送 RST，不在本机留下 TIME_WAIT，也不占用对端的连接状态
+_LINGER_RESET = struct.pack('HH' if os.name == 'nt' else 'ii', 1, 0)
+
+_END = object()
+
+
+def _nofile_soft_limit():
+    """当前进程的文件描述符软上限，无此限制接口 (Windows) 时返回 None。"""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return None
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+class ConnectScanner:
+    """
+    TCP 连通性批量预检: 在一个 selector (Linux 上为 epoll) 上同时发起数千个非阻塞 connect，
+    每个 connect 有独立的截止时间，连通即关闭并产出该候选，超时或被拒即丢弃；
+    也可在连通后于同一 selector 上做一次握手探测 (见 scan 的 probe 参数)，只产出真正应答代理握手的候选。
+    候选按需从可迭代对象中取出，同时在途的连接数受 max_inflight 与进程文件描述符上限约束，
+    因此百万级候选也只占用有限的内存与描述符。
+    """
+    TIMEOUT = 1.5
+    # 握手探测等待应答的时限 (秒)，正常代理一个往返即可应答
+    PROBE_TIMEOUT = 2.0
+    MAX_INFLIGHT = 10000
+    # 为其他连接 (验证阶段、日志、界面等) 保留的文件描述符数
+    FD_RESERVE = 256
+    # select() 在 Windows 上最多等待 512 个套接字
+    SELECT_LIMIT = 500
+    # 检查取消信号的间隔 (秒)
+    CANCEL_POLL = 0.2
+
+    def __init__(self, timeout=None, max_inflight=None, fd_reserve=None, probe_timeout=None):
+        self.timeout = timeout or self.TIMEOUT
+        self.probe_timeout = probe_timeout or self.PROBE_TIMEOUT
+        self.max_inflight = max_inflight or self.MAX_INFLIGHT
+        self.fd_reserve = self.FD_RESERVE if fd_reserve is None else fd_reserve
+
+    def _budget(self, selector) -> int:
+        """本次扫描同时在途的连接数上限。"""
+        _raise_nofile_limit()
+        budget = self.max_inflight
+        soft = _nofile_soft_limit()
+        if soft is not None:
+            budget = min(budget, soft - self.fd_reserve)
+        if isinstance(selector, selectors.SelectSelector):
+            budget = min(budget, self.SELECT_LIMIT)
+        return max(1, budget)
+
+    @staticmethod
+    def _connect(address: str):
+        """
+        对 'host:port' 发起非阻塞 connect。
+        返回 (套接字, 是否已连通)；地址无效或立即失败时返回 (None, False)，描述符耗尽时抛出 OSError。
+        """
+        try:
+            host, port_str = address.rsplit(':', 1)
+            host = host.strip('[]')
+            port = int(port_str)
+            if ':' in host:
+                socket.inet_pton(socket.AF_INET6, host)
+                family, target = socket.AF_INET6, (host, port)
+            else:
+                try:
+                    socket.inet_aton(host)
+                    family, target = socket.AF_INET, (host, port)
+                except OSError:
+                    # 域名只在少数来源中出现，就地解析
+                    family, _, _, _, target = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        except (ValueError, OSError):
+            return None, False
+
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError as e:
+            if e.errno in _FD_EXHAUSTED:
+                raise
+            return None, False
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+            err = sock.connect_ex(target)
+        except OSError:
+            sock.close()
+            return None, False
+        if err == 0:
+            return sock, True
+        if err in _IN_PROGRESS:
+            return sock, False
+        sock.close()
+        if err in _FD_EXHAUSTED:
+            raise OSError(err, os.strerror(err))
+        return None, False
+
+    def scan(self, candidates, key=None, probe=None, cancel_event=None):
+        """
+        逐个产出能在 timeout 秒内建立 TCP 连接的候选 (连通即产出，与输入顺序无关)。
+        key(候选) 给出 'host:port' 地址，默认候选本身即地址。
+        给定 probe 时，连通后再做一次握手探测: probe(候选) 返回 (探测报文, 应答检查函数) 或 None (不探测)，
+        连通后立即发送探测报文，检查函数对已收到的应答返回 None (尚不完整)、True 或 False，
+        只有在 probe_timeout 秒内得到 True 的候选才会产出。cancel_event 被设置后尽快停止。
+        """
+        for item, passed in self.results(candidates, key, probe, cancel_event):
+            if passed:
+                yield item
+
+    def results(self, candidates, key=None, probe=None, cancel_event=None):
+        """同 scan，但每个候选都会产出一次 (候选, 是否通过)，调用方可据此得知某个候选的检测已结束。"""
+        key = key or (lambda item: item)
+        selector = selectors.DefaultSelector()
+        budget = self._budget(selector)
+        inflight = {}            # 套接字 -> 候选
+        probing = {}             # 握手探测中的套接字 -> (应答检查函数, 已收到的应答)
+        connect_deadlines = deque()   # (截止时间, 套接字)，超时相同，按发起顺序即按截止时间排列
+        probe_deadlines = deque()
+        iterator = iter(candidates)
+        waiting = _END           # 因描述符耗尽而尚未发起的候选
+        expired = []
+
+        def finish(sock):
+            item = inflight.pop(sock)
+            probing.pop(sock, None)
+            selector.unregister(sock)
+            sock.close()
+            return item
+
+        def connected(sock, item):
+            """连接建立后开始握手探测；无需探测时返回 True，表示候选已通过。"""
+            request = probe(item) if probe else None
+            if request is None:
+                return True
+            payload, check = request
+            try:
+                sent = sock.send(payload)
+            except OSError:
+                sent = 0
+            if sent != len(payload):
+                return False
+            if sock not in inflight:
+                inflight[sock] = item
+                selector.register(sock, selectors.EVENT_READ)
+            else:
+                selector.modify(sock, selectors.EVENT_READ)
+            probing[sock] = (check, bytearray())
+            probe_deadlines.append((time.monotonic() + self.probe_timeout, sock))
+            return False
+
+        def expire(deadlines, phase_of, now):
+            # 结束已超时的连接 (已离开该阶段的连接在队首时一并清出)
+            while deadlines:
+                deadline, sock = deadlines[0]
+                if phase_of(sock) and deadline > now:
+                    break
+                deadlines.popleft()
+                if phase_of(sock):
+                    expired.append(finish(sock))
+
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                # 补足在途连接
+                while len(inflight) < budget:
+                    if waiting is _END:
+                        waiting = next(iterator, _END)
+                        if waiting is _END:
+                            break
+                    try:
+                        sock, is_connected = self._connect(key(waiting))
+                    except OSError:
+                        # 描述符耗尽，本轮不再发起，等已有连接结束后重试
+                        break
+                    item, waiting = waiting, _END
+                    if sock is None:
+                        yield item, False
+                        continue
+                    if is_connected:
+                        if connected(sock, item):
+                            sock.close()
+                            yield item, True
+                        elif sock not in inflight:
+                            sock.close()
+                            yield item, False
+                        continue
+                    inflight[sock] = item
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    connect_deadlines.append((time.monotonic() + self.timeout, sock))
+
+                if not inflight:
+                    if waiting is _END:
+                        return
+                    time.sleep(self.CANCEL_POLL) # 描述符被其他连接占满，稍后重试
+                    continue
+
+                heads = [d[0][0] for d in (connect_deadlines, probe_deadlines) if d]
+                timeout = min(self.CANCEL_POLL, max(0.0, min(heads) - time.monotonic())) if heads else self.CANCEL_POLL
+                for selector_key, _ in selector.select(timeout):
+                    sock = selector_key.fileobj
+                    state = probing.get(sock)
+                    if state is None:
+                        # connect 完成
+                        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                            yield finish(sock), False
+                        elif connected(sock, inflight[sock]):
+                            yield finish(sock), True
+                        elif sock not in probing:
+                            yield finish(sock), False
+                        continue
+                    # 收到探测应答
+                    check, reply = state
+                    try:
+                        data = sock.recv(4096)
+                    except OSError:
+                        data = b''
+                    reply += data
+                    verdict = check(reply) if data else False
+                    if verdict is None:
+                        continue
+                    yield finish(sock), bool(verdict)
+
+                now = time.monotonic()
+                expire(connect_deadlines, lambda sock: sock in inflight and sock not in probing, now)
+                expire(probe_deadlines, lambda sock: sock in probing, now)
+                for item in expired:
+                    yield item, False
+                expired.clear()
+        finally:
+            for sock in inflight:
+                sock.close()
+            selector.close()
+
+
+def detect_protocols(scanner: ConnectScanner, addresses, probe, protocols=('SOCKS5', 'SOCKS4', 'HTTP'), cancel_event=None):
+    """
+    对每个 'host:port' 地址同时探测 protocols 中的各个协议 (每个协议一条连接，在同一个 selector 上并行进行)。
+    probe 为 ProxyChecker 提供的握手探测函数，接收 {'proxy', 'protocol'}。
+    某个地址的各协议探测都结束后立即产出 (地址, 支持的协议列表，按 protocols 的顺序)，重复的地址只探测一次。
+    """
+    seen = set()
+    pending = {}   # 探测中的地址 -> [尚未结束的探测数, 支持的协议集合]
+
+    def expand():
+        for address in addresses:
+            if address in seen:
+                continue
+            seen.add(address)
+            pending[address] = [len(protocols), set()]
+            for proto in protocols:
+                yield {'proxy': address, 'protocol': proto}
+
+    for p_info, passed in scanner.results(expand(), key=itemgetter('proxy'), probe=probe, cancel_event=cancel_event):
+        state = pending[p_info['proxy']]
+        state[0] -= 1
+        if passed:
+            state[1].add(p_info['protocol'])
+        if state[0] == 0:
+            del pending[p_info['proxy']]
+            yield p_info['proxy'], [proto for proto in protocols if proto in state[1]]
@@ -0,0 +1,107 @@
+# modules/scoring.py
+
+from collections import deque
+
+# 匿名度加分
+ANONYMITY_BONUS = {'Elite': 50, 'Anonymous': 20}
+
+
+def compute_score(latency, speed, anonymity, success_rate=1.0, jitter=0.0):
+    """
+    代理分数: 延迟越低、速度越快、匿名度越高分数越高。
+    延迟项按抖动 (延迟标准差 / 平均延迟) 打折，总分再乘以成功率。
+    只有一次测量时 (成功率 1、无抖动) 与单次测量的分数一致。
+    """
+    score = 0
+    if latency and latency != float('inf'):
+        score += (1 / latency) * 50 / (1 + jitter)
+    score += (speed or 0) * 10
+    score += ANONYMITY_BONUS.get(anonymity, 0)
+    return score * success_rate
+
+
+class ProxyHistory:
+    """单个代理最近的验证与实际转发结果 (固定大小的环形缓冲区)，以及延迟、速度的 EWMA。"""
+    __slots__ = ('outcomes', 'latency', 'latency_var', 'speed')
+
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window)   # True 为成功
+        self.latency = None                    # 验证延迟 EWMA (秒)
+        self.latency_var = 0.0                 # 验证延迟的指数加权方差
+        self.speed = None                      # 下载速度 EWMA (Mbps)
+
+    def add(self, ok, latency=None, speed=None, alpha=0.3):
+        self.outcomes.append(ok)
+        if latency is not None and latency != float('inf'):
+            if self.latency is None:
+                self.latency = latency
+            else:
+                diff = latency - self.latency
+                increment = alpha * diff
+                self.latency += increment
+                self.latency_var = (1 - alpha) * (self.latency_var + diff * increment)
+        if speed is not None:
+            self.speed = speed if self.speed is None else self.speed + alpha * (speed - self.speed)
+
+    @property
+    def success_rate(self) -> float:
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    @property
+    def jitter(self) -> float:
+        """延迟的变异系数 (标准差 / 均值)。"""
+        if not self.latency:
+            return 0.0
+        return self.latency_var ** 0.5 / self.latency
+
+
+class ProxyScorer:
+    """
+    按代理地址维护 ProxyHistory，并据此计算分数，取代按单次测量结果打分。
+    验证结果带延迟与速度样本；实际转发只记录成败 (建连耗时与验证延迟量纲不同，不混入延迟 EWMA)。
+    记录转发结果位于逐连接路径上，与 ProxyRotator.observe_latency 一样不加锁，并发时偶尔丢失一次记录无妨。
+    """
+    WINDOW = 32
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, window=None):
+        self.window = window or self.WINDOW
+        self._histories = {}   # 代理地址 -> ProxyHistory
+
+    def _history(self, proxy_address):
+        history = self._histories.get(proxy_address)
+        if history is None:
+            history = self._histories.setdefault(proxy_address, ProxyHistory(self.window))
+        return history
+
+    def record_check(self, proxy_address: str, ok: bool, latency=None, speed=None):
+        """记录一次验证结果，验证成功时带上测得的延迟 (秒) 与速度 (Mbps)。"""
+        self._history(proxy_address).add(bool(ok), latency, speed, self.EWMA_ALPHA)
+
+    def record_traffic(self, proxy_address: str, ok: bool):
+        """记录一次经该代理的实际转发 (建立隧道) 的成败。"""
+        self._history(proxy_address).add(bool(ok))
+
+    def get(self, proxy_address: str):
+        return self._histories.get(proxy_address)
+
+    def score(self, proxy_address: str, anonymity, latency=None, speed=None) -> float:
+        """
+        按历史计算分数。尚无延迟或速度样本时使用传入的 latency / speed (例如从存储恢复的记录)。
+        """
+        history = self._histories.get(proxy_address)
+        if history is None:
+            return compute_score(latency, speed, anonymity)
+        return compute_score(
+            history.latency if history.latency is not None else latency,
+            history.speed if history.speed is not None else speed,
+            anonymity, history.success_rate, history.jitter
+        )
+
+    def forget(self, proxy_address: str):
+        self._histories.pop(proxy_address, None)
+
+    def clear(self):
+        self._histories = {}
@@ -1,19 +1,99 @@
 # modules/server.py
 
+import os
+import queue
 import socket
 import threading
+import time
 import select
-import struct
-import socks 
-from urllib.parse import urlparse
+
+from .aio_engine import AsyncioEngine
+from .handshake import (
+    negotiate, open_tunnel, parse_proxy_info, is_upstream_fault, ProxyHandshakeError, TargetConnectError
+)
+from .http11 import (
+    HttpParseError, parse_request_head, parse_response_head, request_body_framer, response_body_framer,
+    CONNECT_ESTABLISHED, BAD_REQUEST, BAD_GATEWAY, SERVICE_UNAVAILABLE,
+)
+from .admission import AdmissionController
+from .breaker import CircuitBreakers
+from .metrics import Metrics, MetricsEndpoint
+from .pool import UpstreamPool
+from .sticky import StickySessions
+from .socks5 import (
+    Socks5Handshake, Socks5ParseError, build_method_reply, build_reply,
+    METHOD_NO_AUTH, REPLY_SUCCEEDED, REPLY_GENERAL_FAILURE, REPLY_HOST_UNREACHABLE,
+)
+from .workers import WorkerGroup, WORKERS_SUPPORTED
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Linux 上可用 os.splice 经由管道在内核中搬运数据，无需复制到用户态
+SPLICE_SUPPORTED = hasattr(os, 'splice')
+SPLICE_PIPE_SIZE = 1 << 20
+RELAY_BUFFER_MIN = 16 * 1024
+RELAY_BUFFER_MAX = 256 * 1024
 
 class ProxyServer:
     """本地代理服务，将进入的请求通过代理池转发。支持HTTP和SOCKS5。"""
-    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+    # 服务引擎: 'thread' 为每连接一个线程; 'asyncio' 为单事件循环承载所有连接
+    ENGINES = ('thread', 'asyncio')
+    # 会话粘滞: 'off' 关闭; 'client' 按客户端地址; 'target' 按目标主机;
+    # 'user' 按 SOCKS5 / Proxy-Authorization 用户名 (无用户名时按客户端地址)
+    SESSION_AFFINITY_MODES = ('off', 'client', 'target', 'user')
+
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue, engine='thread'):
         self._rotator = rotator
         self._log_queue = log_queue
         self._running = False
 
+        self.engine = engine if engine in self.ENGINES else 'thread'
+        self._aio_engine = None
+        # 上游连接超时与空闲超时 (秒)。空闲超时用于 asyncio 引擎的空闲隧道，
+        # 以及两种引擎中 keep-alive 客户端等待下一个请求、等待上游应答时的读超时
+        self.connect_timeout = 10
+        self.idle_timeout = 300
+
+        # 准入控制: 同时处理的客户端连接总数与每个上游的并发连接数上限 (0 为不限制)，以及监听队列长度
+        self._admission = AdmissionController(max_connections=2000, max_per_upstream=256)
+        self.listen_backlog = 128
+
+        # 上游预热连接池，pool_size 为 0 时关闭
+        self.pool_size = 2
+        self.pool_top_n = 3
+        self.pool_idle_timeout = 30
+        self._pool = None
+
+        # 竞速连接: 同时尝试的候选上游数 (1 为关闭) 及相邻两次尝试的错开时间 (秒)
+        self.race_count = 1
+        self.race_delay = 0.3
+
+        # 失败重试: 每个请求最多尝试的轮数 (每轮换一批上游) 及总时限 (秒)
+        self.max_attempts = 3
+        self.retry_deadline = 15
+
+        # 隧道转发方式: 'auto' 在支持时使用 splice，否则使用可复用缓冲区; 也可强制 'splice' / 'buffered'
+        self.relay_mode = 'auto'
+
+        # SOCKS5 乐观应答: 解析完请求立即回复成功，客户端的首段数据与上游连接同时在途，每条隧道省去一个往返。
+        # 上游连接失败时只能直接断开客户端，无法再返回错误码
+        self.socks5_early_reply = False
+
+        # 多进程工作模式: 工作进程数 (1 为单进程, 0 为按 CPU 核数)，进程间以 SO_REUSEPORT 共享监听端口
+        self.workers = 1
+        self.reuse_port = False
+        self._worker_group = None
+        self.settings = {}
+
+        # 运行指标，以 Prometheus 文本格式在 metrics_port 上提供 (0 为关闭)
+        self.metrics = Metrics()
+        self.metrics_host = '127.0.0.1'
+        self.metrics_port = 1802
+        self._metrics_endpoint = None
+
         self._http_host = http_host
         self._http_port = http_port
         self._http_server_socket = None
@@ -27,6 +107,18 @@ class ProxyServer:
         # 新增: 轮换模式状态
         self.rotate_per_request = False
 
+        # 会话粘滞模式，启用时优先于上面的轮换模式
+        self.session_affinity = 'off'
+        self._sticky = StickySessions(rotator)
+
+        # 上游熔断: 失败比例过高的上游退出轮换，冷却后以少量试探连接决定是否恢复
+        self._breakers = CircuitBreakers()
+        if rotator is not None:
+            # 移出代理池的上游不再需要熔断状态，否则随免费代理的更替无限增长
+            rotator.add_remove_listener(self._breakers.forget)
+            # 负载感知的选择策略需要知道每个上游当前打开的连接数
+            rotator.set_load_source(self._admission.upstream_load)
+
     def log(self, message):
         self._log_queue.put(f"[Server] {message}")
 
@@ -36,12 +128,77 @@ class ProxyServer:
         mode = "逐请求轮换" if per_request else "固定当前"
         self.log(f"服务轮换模式已切换为: {mode}")
 
+    def set_engine(self, engine: str):
+        """选择服务引擎，仅在服务停止时生效。"""
+        if engine not in self.ENGINES:
+            self.log(f"[!] 未知的服务引擎: {engine}，保持 {self.engine}")
+            return
+        if self._running and engine != self.engine:
+            self.log("服务运行中，引擎切换将在下次启动时生效。")
+        self.engine = engine
+
+    def configure(self, settings: dict):
+        """应用配置中的 server 设置。超时对新连接立即生效，引擎、连接池与工作进程在下次启动服务时生效。"""
+        self.settings = dict(settings)
+        self.set_engine(settings.get('engine', self.engine))
+        self.connect_timeout = settings.get('connect_timeout', self.connect_timeout)
+        self.idle_timeout = settings.get('idle_timeout', self.idle_timeout)
+        self.pool_size = settings.get('pool_size', self.pool_size)
+        self.pool_top_n = settings.get('pool_top_n', self.pool_top_n)
+        self.pool_idle_timeout = settings.get('pool_idle_timeout', self.pool_idle_timeout)
+        self.relay_mode = settings.get('relay_mode', self.relay_mode)
+        self.race_count = settings.get('race_count', self.race_count)
+        self.race_delay = settings.get('race_delay', self.race_delay)
+        self.max_attempts = settings.get('max_attempts', self.max_attempts)
+        self.retry_deadline = settings.get('retry_deadline', self.retry_deadline)
+        self.workers = settings.get('workers', self.workers)
+        self.socks5_early_reply = settings.get('socks5_early_reply', self.socks5_early_reply)
+        self.metrics_port = settings.get('metrics_port', self.metrics_port)
+        self._admission.max_connections = settings.get('max_connections', self._admission.max_connections)
+        self._admission.max_per_upstream = settings.get('max_per_upstream', self._admission.max_per_upstream)
+        self.listen_backlog = settings.get('listen_backlog', self.listen_backlog)
+        affinity = settings.get('session_affinity', self.session_affinity)
+        self.session_affinity = affinity if affinity in self.SESSION_AFFINITY_MODES else 'off'
+        self._sticky.ttl = settings.get('session_ttl', self._sticky.ttl)
+        self._breakers.window = settings.get('breaker_window', self._breakers.window)
+        self._breakers.failure_ratio = settings.get('breaker_failure_ratio', self._breakers.failure_ratio)
+        self._breakers.min_calls = settings.get('breaker_min_calls', self._breakers.min_calls)
+        self._breakers.cooldown = settings.get('breaker_cooldown', self._breakers.cooldown)
+        self._breakers.half_open_trials = settings.get('breaker_half_open_trials', self._breakers.half_open_trials)
+        strategy = settings.get('selection_strategy')
+        if strategy and not self._rotator.set_strategy(strategy):
+            self.log(f"[!] 未知的选择策略: {strategy}，保持 {self._rotator.strategy}")
+
     def start_all(self):
         """启动所有代理服务（HTTP & SOCKS5）。"""
         if self._running:
             return
         self._running = True
 
+        if self.metrics_port:
+            self._metrics_endpoint = MetricsEndpoint(self.metrics, self.metrics_host, self.metrics_port, self._log_queue)
+            self._metrics_endpoint.start()
+
+        workers = self.workers or os.cpu_count() or 1
+        if workers > 1:
+            if WORKERS_SUPPORTED:
+                self._worker_group = WorkerGroup(self, workers)
+                self._worker_group.start()
+                return
+            self.log("[!] 当前系统不支持 SO_REUSEPORT，多进程模式不可用，以单进程运行。")
+
+        if self.pool_size > 0:
+            self._pool = UpstreamPool(
+                self._rotator, self._log_queue, size_per_proxy=self.pool_size, top_n=self.pool_top_n,
+                idle_timeout=self.pool_idle_timeout, connect_timeout=self.connect_timeout
+            )
+            self._pool.start()
+
+        if self.engine == 'asyncio':
+            self._aio_engine = AsyncioEngine(self)
+            self._aio_engine.start()
+            return
+
         self._http_thread = threading.Thread(target=self._run_http_server, daemon=True)
         self._http_thread.start()
 
@@ -53,11 +210,30 @@ class ProxyServer:
         if not self._running:
             return
         self._running = False
+
+        if self._worker_group:
+            self._worker_group.stop()
+            self._worker_group = None
+        if self._metrics_endpoint:
+            self._metrics_endpoint.stop()
+            self._metrics_endpoint = None
+        if self._aio_engine:
+            self._aio_engine.stop()
+            self._aio_engine = None
+        if self._pool:
+            self._pool.stop()
+            self._pool = None
         
-        if self._http_server_socket:
-            self._http_server_socket.close()
-        if self._socks5_server_socket:
-            self._socks5_server_socket.close()
+        for server_socket in (self._http_server_socket, self._socks5_server_socket):
+            if server_socket:
+                try:
+                    # Linux 上仅 close() 不会唤醒阻塞在 accept() 中的线程
+                    server_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                server_socket.close()
+        self._http_server_socket = None
+        self._socks5_server_socket = None
 
         if self._http_thread and self._http_thread.is_alive():
             self._http_thread.join()
@@ -66,13 +242,19 @@ class ProxyServer:
             
         self.log("所有代理服务已停止。")
 
+    def _create_listener(self, host, port):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((host, port))
+        server_socket.listen(self.listen_backlog)
+        return server_socket
+
     def _run_http_server(self):
         """HTTP服务监听循环。"""
         try:
-            self._http_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._http_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._http_server_socket.bind((self._http_host, self._http_port))
-            self._http_server_socket.listen(20)
+            self._http_server_socket = self._create_listener(self._http_host, self._http_port)
             self.log(f"HTTP 代理服务接口已启动于 {self._http_host}:{self._http_port}")
         except Exception as e:
             self.log(f"[!] 启动 HTTP 服务失败: {e}")
@@ -81,6 +263,10 @@ class ProxyServer:
         while self._running:
             try:
                 client_socket, _ = self._http_server_socket.accept()
+                self.metrics.add(('firproxy_accepts_total', 'http'))
+                if not self._admission.try_admit():
+                    self._reject(client_socket, 'http')
+                    continue
                 handler = threading.Thread(target=self._handle_http_client, args=(client_socket,), daemon=True)
                 handler.start()
             except OSError:
@@ -90,10 +276,7 @@ class ProxyServer:
     def _run_socks5_server(self):
         """SOCKS5服务监听循环。"""
         try:
-            self._socks5_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socks5_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._socks5_server_socket.bind((self._socks5_host, self._socks5_port))
-            self._socks5_server_socket.listen(20)
+            self._socks5_server_socket = self._create_listener(self._socks5_host, self._socks5_port)
             self.log(f"SOCKS5 代理服务接口已启动于 {self._socks5_host}:{self._socks5_port}")
         except Exception as e:
             self.log(f"[!] 启动 SOCKS5 服务失败: {e}")
@@ -102,137 +285,512 @@ class ProxyServer:
         while self._running:
             try:
                 client_socket, _ = self._socks5_server_socket.accept()
+                self.metrics.add(('firproxy_accepts_total', 'socks5'))
+                if not self._admission.try_admit():
+                    self._reject(client_socket, 'socks5')
+                    continue
                 handler = threading.Thread(target=self._handle_socks5_client, args=(client_socket,), daemon=True)
                 handler.start()
             except OSError:
                 break
         self.log("SOCKS5 代理服务循环已退出。")
         
-    def _get_upstream_connection(self, target_host, target_port):
-        """从轮换器获取一个上游代理，并用它来连接目标地址。"""
+    def _rejection(self, listener):
+        """超出并发上限时立即发给客户端的拒绝应答: HTTP 503，或 SOCKS5 的方法协商应答加一般性失败应答。"""
+        self.metrics.add(('firproxy_listener_errors_total', listener, 'overloaded'))
+        self.metrics.add(('firproxy_connections_closed_total', listener))
+        if listener == 'http':
+            return SERVICE_UNAVAILABLE
+        return build_method_reply(METHOD_NO_AUTH) + build_reply(REPLY_GENERAL_FAILURE)
+
+    def _reject(self, client_socket, listener):
+        """在监听线程中直接拒绝客户端，不为其创建处理线程。"""
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(self._rejection(listener))
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def _select_upstream_proxy(self):
+        """按当前轮换模式从轮换器选出一个上游代理。"""
         if self.rotate_per_request:
             # 逐请求轮换模式：每次都获取下一个代理
-            upstream_proxy_info = self._rotator.get_next_proxy()
+            return self._rotator.get_next_proxy()
+        # 普通模式：使用当前固定的代理；当前代理已失效时自动切换到下一个
+        current = self._rotator.get_current_proxy()
+        if current:
+            return current
+        next_proxy = self._rotator.get_next_proxy()
+        if next_proxy:
+            self.log(f"当前代理已失效，自动切换到: {next_proxy.get('proxy')}")
+        return next_proxy
+
+    def _session_key(self, client_host, target_host, username=None):
+        """按会话粘滞模式计算会话键，未启用时返回 None。"""
+        mode = self.session_affinity
+        if mode == 'user' and username:
+            return f"user:{username}"
+        if mode == 'target':
+            return f"target:{target_host}"
+        if mode in ('client', 'user'):
+            return f"client:{client_host}"
+        return None
+
+    def _usable(self, proxy_address):
+        """上游未达到并发上限且其熔断器放行。半开的上游被放行即占用一个试探名额，应只对确实要尝试的上游调用。"""
+        return self._admission.has_capacity(proxy_address) and self._breakers.allow(proxy_address)
+
+    def _poll_breakers(self):
+        """冷却结束的熔断上游重新加入轮换，以试探连接决定是否恢复。"""
+        for addr in self._breakers.poll():
+            if self._rotator.restore(addr):
+                self.log(f"上游代理 {addr} 熔断冷却结束，恢复试探。")
+            else:
+                self._breakers.forget(addr)
+
+    def _pick_candidates(self, tried, session=None):
+        """
+        选出本轮要尝试的上游代理。首轮按会话粘滞或轮换模式选取（竞速模式下再补充若干备选），
+        选中的代理已达到并发上限或处于熔断时溢出到下一个可用的代理；重试轮从分数最高的可用代理中选取尚未尝试过的。
+        """
+        self._poll_breakers()
+        count = max(1, self.race_count)
+        if not tried:
+            primary = self._sticky.pick(session) if session else self._select_upstream_proxy()
+            if primary and not self._usable(primary.get('proxy')):
+                primary = self._spill_over(primary)
+            if not primary:
+                return []
+            # 粘滞会话不参与竞速，否则会话会随竞速结果漂移
+            return self._race_candidates(primary) if count > 1 and not session else [primary]
+        fresh = []
+        for p_info in self._rotator.get_available_proxies():
+            if len(fresh) >= count:
+                break
+            addr = p_info.get('proxy')
+            if addr not in tried and self._usable(addr):
+                fresh.append(p_info)
+        return fresh
+
+    def _spill_over(self, full_proxy):
+        """选中的上游已达到并发上限或处于熔断时，按分数顺序找下一个可用的上游，都不可用时返回 None。"""
+        for p_info in self._rotator.get_available_proxies():
+            addr = p_info.get('proxy')
+            if addr != full_proxy.get('proxy') and self._usable(addr):
+                return p_info
+        return None
+
+    def _connect_via(self, upstream_proxy_info, target_host, target_port, timeout=None):
+        """经指定上游代理连接目标地址，优先使用连接池中的预热连接。"""
+        timeout = timeout or self.connect_timeout
+        started = time.monotonic()
+        remote_socket = None
+        pooled = self._pool.acquire(upstream_proxy_info) if self._pool else None
+        if pooled:
+            try:
+                _, _, proto = parse_proxy_info(upstream_proxy_info)
+                pooled.settimeout(timeout)
+                negotiate(pooled, proto, target_host, target_port, greeted=True)
+                pooled.settimeout(None)
+                remote_socket = pooled
+            except TargetConnectError:
+                # 上游正常应答但目标不可达，换一条连接结果相同，直接报告给客户端
+                pooled.close()
+                raise
+            except (OSError, ProxyHandshakeError):
+                # 预热连接可能已被上游关闭，回退到新建连接
+                pooled.close()
+        if remote_socket is None:
+            remote_socket = open_tunnel(upstream_proxy_info, target_host, target_port, timeout=timeout)
+        self._record_connect(upstream_proxy_info.get('proxy'), time.monotonic() - started)
+        return remote_socket
+
+    def _record_connect(self, addr, elapsed):
+        """记录一次成功的建连: 更新指标与熔断器，并把耗时与结果反馈给轮换器供负载感知策略与打分使用。"""
+        self._breakers.record_success(addr)
+        self._rotator.observe_latency(addr, elapsed)
+        self._rotator.record_outcome(addr, True)
+        self.metrics.add(('firproxy_upstream_connects_total', addr))
+        self.metrics.observe(('firproxy_upstream_connect_seconds', addr), elapsed)
+
+    def _race_candidates(self, primary):
+        """竞速模式的候选列表: 按轮换模式选出的代理排在首位，其后是分数最高的其他可用代理。"""
+        candidates = [primary]
+        for p_info in self._rotator.get_top_proxies(self.race_count):
+            if len(candidates) >= self.race_count:
+                break
+            if p_info.get('proxy') != primary.get('proxy') and self._usable(p_info.get('proxy')):
+                candidates.append(p_info)
+        return candidates
+
+    def _log_upstream_error(self, addr, error):
+        if isinstance(error, TimeoutError):
+            error = "连接超时"
+        if isinstance(error, ValueError):
+            self.log(f"[!] {error}")
         else:
-            # 普通模式：使用当前固定的代理
-            upstream_proxy_info = self._rotator.get_current_proxy()
-
-        if not upstream_proxy_info:
-            self.log("[!] 代理池为空或无符合条件的代理，无法转发请求。")
-            return None
-
-        addr = upstream_proxy_info.get('proxy')
-        proto = upstream_proxy_info.get('protocol')
-
-        if not addr or not proto:
-            self.log(f"[!] 代理信息格式不正确: {upstream_proxy_info}")
-            return None
+            self.log(f"[!] 上游代理 {addr} 错误: {error or type(error).__name__}")
+
+    def _close_upstream(self, proxy_address, remote_socket):
+        """关闭经 _get_upstream_connection 获得的上游连接，并归还该上游的并发名额。"""
+        remote_socket.close()
+        self._admission.release_upstream(proxy_address)
+
+    def _on_upstream_failure(self, proxy_info, error):
+        """记录一次上游连接失败。上游自身的故障计入结果历史与熔断器，熔断时反馈给轮换器，使其退出轮换。"""
+        addr = proxy_info.get('proxy')
+        self._log_upstream_error(addr, error)
+        kind = 'target' if isinstance(error, TargetConnectError) else 'upstream'
+        self.metrics.add(('firproxy_upstream_errors_total', addr, kind))
+        if not is_upstream_fault(error):
+            return
+        self._rotator.record_outcome(addr, False)
+        if self._breakers.record_failure(addr):
+            self._rotator.report_failure(addr)
+            self.metrics.add(('firproxy_upstream_breaker_trips_total', addr))
+            self.log(f"上游代理 {addr} 已被标记为不可用。")
+
+    def _race_upstream_connection(self, candidates, target_host, target_port, timeout):
+        """
+        按 race_delay 错开依次经多个候选上游连接目标，采用最先完成握手的连接，返回 (代理信息, socket)。
+        阻塞的 connect 无法中途取消，落败的尝试会在完成后立即关闭，其间发生的失败照常上报。全部失败时返回 None。
+        """
+        results = queue.Queue()
+        lock = threading.Lock()
+        state = {'decided': False}
+
+        def discard(p_info, sock, error):
+            if sock:
+                sock.close()
+            else:
+                self._on_upstream_failure(p_info, error)
 
-        upstream_addr, upstream_port_str = addr.split(':')
-        
-        proxy_type_map = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}
-        upstream_protocol = proxy_type_map.get(proto.upper())
+        def attempt(p_info):
+            sock, error = None, None
+            try:
+                sock = self._connect_via(p_info, target_host, target_port, timeout)
+            except Exception as e:
+                error = e
+            with lock:
+                if not state['decided']:
+                    results.put((p_info, sock, error))
+                    return
+            discard(p_info, sock, error)  # 竞速已有结果
+
+        pending = list(candidates)
+        in_flight = 0
+        winner = None
+        while pending or in_flight:
+            if pending:
+                threading.Thread(target=attempt, args=(pending.pop(0),), daemon=True).start()
+                in_flight += 1
+            try:
+                p_info, sock, error = results.get(timeout=self.race_delay if pending else None)
+            except queue.Empty:
+                continue  # 当前尝试尚未完成，启动下一个候选
+            in_flight -= 1
+            if sock:
+                winner = (p_info, sock)
+                break
+            self._on_upstream_failure(p_info, error)
 
-        if not upstream_protocol:
-            self.log(f"[!] 不支持的上游代理协议: {proto}")
-            return None
-        
-        remote_socket = socks.socksocket()
-        try:
-            remote_socket.set_proxy(proxy_type=upstream_protocol, addr=upstream_addr, port=int(upstream_port_str))
-            remote_socket.connect((target_host, target_port))
+        with lock:
+            state['decided'] = True
+        while True:
+            try:
+                discard(*results.get_nowait())
+            except queue.Empty:
+                break
+        return winner
+
+    def _get_upstream_connection(self, target_host, target_port, session=None):
+        """
+        从轮换器获取上游代理并用它来连接目标地址，返回 (代理信息, socket)，全部失败时返回 None。
+        返回的连接占用该上游的一个并发名额，须经 _close_upstream 关闭。
+        失败时在总时限内换下一批上游重试，上游自身的故障会立即反馈给轮换器。
+        session 为会话粘滞的会话键，重试成功时会话改绑到新的代理。
+        """
+        deadline = time.monotonic() + self.retry_deadline
+        tried = set()
+        for attempt_no in range(max(1, self.max_attempts)):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            candidates = self._pick_candidates(tried, session)
+            if not candidates:
+                if not tried:
+                    self.log("[!] 代理池为空、无符合条件的代理或代理均已达到并发上限，无法转发请求。")
+                break
+            tried.update(p.get('proxy') for p in candidates)
+            timeout = min(self.connect_timeout, remaining)
+
+            if len(candidates) > 1:
+                winner = self._race_upstream_connection(candidates, target_host, target_port, timeout)
+                if not winner:
+                    continue
+                upstream_proxy_info, remote_socket = winner
+                if session:
+                    self._sticky.bind(session, upstream_proxy_info.get('proxy'))
+                elif self.rotate_per_request or attempt_no or upstream_proxy_info is not self._rotator.get_current_proxy():
+                    self.log(f"竞速: {upstream_proxy_info.get('proxy')} -> {target_host}:{target_port}")
+                self._admission.acquire_upstream(upstream_proxy_info.get('proxy'))
+                return winner
+
+            upstream_proxy_info = candidates[0]
+            addr = upstream_proxy_info.get('proxy')
+            try:
+                remote_socket = self._connect_via(upstream_proxy_info, target_host, target_port, timeout)
+            except Exception as e:
+                self._on_upstream_failure(upstream_proxy_info, e)
+                continue
             # --- MODIFIED: Log rotation for per-request mode ---
-            if self.rotate_per_request:
+            if session:
+                if attempt_no:
+                    self._sticky.bind(session, addr)
+                    self.log(f"会话 {session} 改用: {addr}")
+            elif self.rotate_per_request:
                 self.log(f"轮换: {addr} -> {target_host}:{target_port}")
+            elif attempt_no:
+                self.log(f"重试: {addr} -> {target_host}:{target_port}")
             # 固定模式的日志在UI点击轮换时已记录，此处不再重复
-            return remote_socket
-        except Exception as e:
-            self.log(f"[!] 上游代理 {addr} 错误: {e}")
-            # 可以在此处增加代理失败计数的逻辑
-            remote_socket.close()
-            return None
+            self._admission.acquire_upstream(addr)
+            return upstream_proxy_info, remote_socket
+
+        if tried:
+            self.log(f"[!] 已尝试 {len(tried)} 个上游代理，均无法连接 {target_host}:{target_port}")
+        return None
+
+    def _recv_head(self, sock, buf, parse):
+        """读取直到 buf 中有一个完整的报文头，返回 (报文头, 原始字节)；连接在新报文开始前关闭时返回 None。"""
+        while True:
+            parsed = parse(buf)
+            if parsed:
+                head, consumed = parsed
+                raw = bytes(buf[:consumed])
+                del buf[:consumed]
+                return head, raw
+            data = sock.recv(65536)
+            if not data:
+                if buf:
+                    raise HttpParseError("报文头未接收完整时连接已关闭")
+                return None
+            buf += data
+
+    def _relay_body(self, src, dst, buf, framer, meter):
+        """按 framer 给出的边界把报文体从 src 原样转发到 dst，多读到的字节留在 buf 中属于下一个报文。meter 为字节计数的指标 key。"""
+        while not framer.done:
+            if not buf:
+                data = src.recv(65536)
+                if not data:
+                    if framer.mode == 'eof':
+                        return
+                    raise ConnectionResetError("报文体未接收完整时连接已关闭")
+                buf += data
+            n = framer.feed(buf)
+            if n:
+                dst.sendall(buf[:n])
+                del buf[:n]
+                self.metrics.add(meter, n)
+
+    def _relay_response(self, remote_socket, client_socket, remote_buf, request_method, meter):
+        """转发一个完整的响应（含 1xx 中间响应），返回 (最终响应头, 报文体 framer)；上游未作任何应答即关闭时返回 None。"""
+        while True:
+            received = self._recv_head(remote_socket, remote_buf, parse_response_head)
+            if received is None:
+                return None
+            response, raw = received
+            client_socket.sendall(raw)
+            self.metrics.add(meter, len(raw))
+            if 100 <= response.status < 200 and response.status != 101:
+                continue
+            framer = response_body_framer(response, request_method)
+            if response.status != 101:
+                self._relay_body(remote_socket, client_socket, remote_buf, framer, meter)
+            return response, framer
 
     def _handle_http_client(self, client_socket):
-        """处理单个HTTP客户端连接。"""
+        """处理单个HTTP客户端连接。支持 keep-alive: 同一连接上的每个请求都按其自身的目标地址转发。"""
         remote_socket = None
+        upstream_addr = None
+        remote_target = None
+        client_buf = bytearray()
+        remote_buf = bytearray()
         try:
-            request_data = client_socket.recv(8192)
-            if not request_data:
-                return
-
-            first_line = request_data.split(b'\r\n')[0].decode('utf-8', 'ignore')
-            method, url, _ = first_line.split()
-
-            if method == 'CONNECT':
-                target_host, target_port_str = url.split(':')
-                target_port = int(target_port_str)
-            else:
-                parsed_url = urlparse(url)
-                target_host = parsed_url.hostname
-                target_port = parsed_url.port or 80
-
-            remote_socket = self._get_upstream_connection(target_host, target_port)
-            if not remote_socket:
-                # 可以给客户端一个更友好的错误响应
-                client_socket.sendall(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
-                return
-
-            if method == 'CONNECT':
-                client_socket.sendall(b'HTTP/1.1 200 Connection Established\r\n\r\n')
-            else:
-                remote_socket.sendall(request_data)
-
-            self._forward_data(client_socket, remote_socket)
+            client_host = client_socket.getpeername()[0]
+            # 空闲的 keep-alive 客户端不能无限占用处理线程与准入名额
+            client_socket.settimeout(self.idle_timeout)
+            while self._running:
+                try:
+                    received = self._recv_head(client_socket, client_buf, parse_request_head)
+                    if received is None:
+                        return
+                    request = received[0]
+                    target_host, target_port = request.target_address()
+                    body_framer = request_body_framer(request)
+                    session = self._session_key(client_host, target_host, request.proxy_username())
+                except (HttpParseError, ValueError):
+                    self.metrics.add(('firproxy_listener_errors_total', 'http', 'bad_request'))
+                    client_socket.sendall(BAD_REQUEST)
+                    return
+
+                if request.method == 'CONNECT':
+                    if remote_socket:
+                        self._close_upstream(upstream_addr, remote_socket)
+                    remote_socket = None
+                    upstream = self._get_upstream_connection(target_host, target_port, session)
+                    if not upstream:
+                        self.metrics.add(('firproxy_listener_errors_total', 'http', 'no_upstream'))
+                        client_socket.sendall(BAD_GATEWAY)
+                        return
+                    upstream_proxy_info, remote_socket = upstream
+                    upstream_addr = upstream_proxy_info.get('proxy')
+                    client_socket.sendall(CONNECT_ESTABLISHED)
+                    if client_buf:
+                        remote_socket.sendall(client_buf)  # 客户端在隧道建立前已发送的数据
+                    self._forward_data(client_socket, remote_socket, 'http', upstream_addr)
+                    return
+
+                # 同一目标 (及同一会话) 的后续请求复用上游连接；逐请求轮换模式下每个请求都换新的上游，会话粘滞时除外
+                reused = (remote_socket is not None and remote_target == (target_host, target_port, session)
+                          and (session or not self.rotate_per_request))
+                if not reused:
+                    if remote_socket:
+                        self._close_upstream(upstream_addr, remote_socket)
+                    remote_socket = None
+                    remote_buf.clear()
+                    remote_target = (target_host, target_port, session)
+                    upstream = self._get_upstream_connection(target_host, target_port, session)
+                    if not upstream:
+                        self.metrics.add(('firproxy_listener_errors_total', 'http', 'no_upstream'))
+                        client_socket.sendall(BAD_GATEWAY)
+                        return
+                    upstream_proxy_info, remote_socket = upstream
+                    upstream_addr = upstream_proxy_info.get('proxy')
+                    remote_socket.settimeout(self.idle_timeout)
+                    meter_out = ('firproxy_bytes_total', 'http', upstream_addr, 'out')
+                    meter_in = ('firproxy_bytes_total', 'http', upstream_addr, 'in')
+
+                request_bytes = request.to_bytes()
+                remote_socket.sendall(request_bytes)
+                self.metrics.add(meter_out, len(request_bytes))
+                self._relay_body(client_socket, remote_socket, client_buf, body_framer, meter_out)
+                result = self._relay_response(remote_socket, client_socket, remote_buf, request.method, meter_in)
+
+                if result is None and reused and body_framer.mode == 'none':
+                    # 复用的上游连接可能已被目标服务器关闭，无请求体时换新连接重发一次
+                    self._close_upstream(upstream_addr, remote_socket)
+                    remote_socket = None
+                    remote_buf.clear()
+                    upstream = self._get_upstream_connection(target_host, target_port, session)
+                    if upstream:
+                        upstream_proxy_info, remote_socket = upstream
+                        upstream_addr = upstream_proxy_info.get('proxy')
+                        remote_socket.settimeout(self.idle_timeout)
+                        meter_out = ('firproxy_bytes_total', 'http', upstream_addr, 'out')
+                        meter_in = ('firproxy_bytes_total', 'http', upstream_addr, 'in')
+                        remote_socket.sendall(request_bytes)
+                        self.metrics.add(meter_out, len(request_bytes))
+                        result = self._relay_response(remote_socket, client_socket, remote_buf, request.method, meter_in)
+                if result is None:
+                    self.metrics.add(('firproxy_listener_errors_total', 'http', 'no_response'))
+                    client_socket.sendall(BAD_GATEWAY)
+                    return
+
+                response, response_framer = result
+                if response.status == 101:
+                    # 协议升级 (如 WebSocket)，之后按隧道方式转发
+                    if remote_buf:
+                        client_socket.sendall(remote_buf)
+                    if client_buf:
+                        remote_socket.sendall(client_buf)
+                    self._forward_data(client_socket, remote_socket, 'http', upstream_addr)
+                    return
+
+                upstream_reusable = response.keep_alive and response_framer.mode != 'eof'
+                if not upstream_reusable:
+                    self._close_upstream(upstream_addr, remote_socket)
+                    remote_socket = None
+                if not (request.keep_alive and upstream_reusable):
+                    return
         except Exception as e:
-            if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
-                 self.log(f"处理 HTTP 请求时出错: {e}")
+            if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError, HttpParseError)):
+                self.metrics.add(('firproxy_listener_errors_total', 'http', 'exception'))
+                self.log(f"处理 HTTP 请求时出错: {e}")
         finally:
-            if remote_socket: remote_socket.close()
+            self.metrics.add(('firproxy_connections_closed_total', 'http'))
+            self._admission.release()
+            if remote_socket: self._close_upstream(upstream_addr, remote_socket)
             if client_socket: client_socket.close()
 
     def _handle_socks5_client(self, client_socket):
-        """处理单个SOCKS5客户端连接。"""
+        """处理单个SOCKS5客户端连接。握手报文按缓冲区增量解析，客户端提前发来的数据在隧道建立后转发给上游。"""
         remote_socket = None
         try:
-            data = client_socket.recv(2)
-            if not data or data[0] != 5: return 
-            nmethods = data[1]
-            client_socket.recv(nmethods)
-            client_socket.sendall(b"\x05\x00")
-
-            data = client_socket.recv(4)
-            if not data or data[0] != 5 or data[1] != 1: return
-            
-            atyp = data[3]
-            if atyp == 1:
-                addr = socket.inet_ntoa(client_socket.recv(4))
-            elif atyp == 3:
-                domain_len = client_socket.recv(1)[0]
-                addr = client_socket.recv(domain_len).decode('utf-8')
-            else:
-                # 暂不支持IPv6
-                client_socket.sendall(b"\x05\x08\x00\x01\x00\x00\x00\x00\x00\x00")
-                return
-            
-            port = struct.unpack('!H', client_socket.recv(2))[0]
-
-            remote_socket = self._get_upstream_connection(addr, port)
-            if not remote_socket:
-                client_socket.sendall(b"\x05\x04\x00\x01\x00\x00\x00\x00\x00\x00") # Host unreachable
+            handshake = Socks5Handshake()
+            while handshake.request is None:
+                data = client_socket.recv(4096)
+                if not data: return
+                try:
+                    reply = handshake.feed(data)
+                except Socks5ParseError as e:
+                    self.metrics.add(('firproxy_listener_errors_total', 'socks5', 'bad_request'))
+                    if e.reply: client_socket.sendall(e.reply)
+                    return
+                if reply: client_socket.sendall(reply)
+            request = handshake.request
+
+            early_reply = self.socks5_early_reply
+            if early_reply:
+                client_socket.sendall(build_reply(REPLY_SUCCEEDED))
+
+            session = self._session_key(client_socket.getpeername()[0], request.host, handshake.username)
+            upstream = self._get_upstream_connection(request.host, request.port, session)
+            if not upstream:
+                self.metrics.add(('firproxy_listener_errors_total', 'socks5', 'no_upstream'))
+                if not early_reply:
+                    client_socket.sendall(build_reply(REPLY_HOST_UNREACHABLE))
                 return
+            upstream_proxy_info, remote_socket = upstream
+            upstream_addr = upstream_proxy_info.get('proxy')
 
-            client_socket.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            if not early_reply:
+                client_socket.sendall(build_reply(REPLY_SUCCEEDED))
+            early_data = handshake.take_early_data()
+            if early_data:
+                remote_socket.sendall(early_data)
 
-            self._forward_data(client_socket, remote_socket)
+            self._forward_data(client_socket, remote_socket, 'socks5', upstream_addr)
         except Exception as e:
             if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
+                self.metrics.add(('firproxy_listener_errors_total', 'socks5', 'exception'))
                 self.log(f"处理 SOCKS5 请求时出错: {e}")
         finally:
-            if remote_socket: remote_socket.close()
+            self.metrics.add(('firproxy_connections_closed_total', 'socks5'))
+            self._admission.release()
+            if remote_socket: self._close_upstream(upstream_addr, remote_socket)
             if client_socket: client_socket.close()
 
-    def _forward_data(self, sock1, sock2):
-        """在两个socket之间双向转发数据，直到任意一方关闭。"""
+    def _forward_data(self, client_socket, remote_socket, listener, upstream_addr):
+        """在客户端与上游之间双向转发数据，直到任意一方关闭。"""
+        # splice 与 sendall 都依赖阻塞模式的 socket
+        client_socket.settimeout(None)
+        remote_socket.settimeout(None)
+        # 每个方向的字节计数指标 key: 从该 socket 读到的数据计入对应方向
+        meters = {
+            client_socket: ('firproxy_bytes_total', listener, upstream_addr, 'out'),
+            remote_socket: ('firproxy_bytes_total', listener, upstream_addr, 'in'),
+        }
+        if self.relay_mode != 'buffered' and SPLICE_SUPPORTED:
+            self._forward_data_splice(client_socket, remote_socket, meters)
+        else:
+            self._forward_data_buffered(client_socket, remote_socket, meters)
+
+    def _forward_data_buffered(self, sock1, sock2, meters):
+        """用每个方向一块预分配缓冲区做 recv_into 转发，缓冲区在读满时成倍增大。"""
+        buffers = {sock1: bytearray(RELAY_BUFFER_MIN), sock2: bytearray(RELAY_BUFFER_MIN)}
+        views = {sock: memoryview(buf) for sock, buf in buffers.items()}
         while self._running:
             try:
                 readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
@@ -240,9 +798,49 @@ class ProxyServer:
                     break
                 for sock in readable:
                     other_sock = sock2 if sock is sock1 else sock1
-                    data = sock.recv(8192)
-                    if not data:
+                    view = views[sock]
+                    n = sock.recv_into(view)
+                    if not n:
                         return
-                    other_sock.sendall(data)
+                    other_sock.sendall(view[:n])
+                    self.metrics.add(meters[sock], n)
+                    if n == len(view) and n < RELAY_BUFFER_MAX:
+                        # 批量传输: 增大缓冲区以减少 Python 层的往返次数
+                        view.release()
+                        buffers[sock] = bytearray(min(n * 2, RELAY_BUFFER_MAX))
+                        views[sock] = memoryview(buffers[sock])
             except (ConnectionResetError, BrokenPipeError, OSError, select.error):
-                break
\ No newline at end of file
+                break
+
+    def _forward_data_splice(self, sock1, sock2, meters):
+        """Linux 快速路径: 每个方向一对管道，socket -> 管道 -> socket 全程在内核中完成。"""
+        pipes = {sock1: os.pipe(), sock2: os.pipe()}
+        chunk = 65536
+        if fcntl is not None and hasattr(fcntl, 'F_SETPIPE_SZ'):
+            try:
+                for _, w in pipes.values():
+                    chunk = fcntl.fcntl(w, fcntl.F_SETPIPE_SZ, SPLICE_PIPE_SIZE)
+            except OSError:
+                chunk = 65536  # 超出 /proc/sys/fs/pipe-max-size 时保持默认大小
+        fds = {sock1: sock1.fileno(), sock2: sock2.fileno()}
+        try:
+            while self._running:
+                try:
+                    readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
+                    if exceptional or not readable:
+                        break
+                    for sock in readable:
+                        other_fd = fds[sock2] if sock is sock1 else fds[sock1]
+                        pipe_r, pipe_w = pipes[sock]
+                        n = os.splice(fds[sock], pipe_w, chunk, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                        if not n:
+                            return
+                        self.metrics.add(meters[sock], n)
+                        while n:
+                            n -= os.splice(pipe_r, other_fd, n, flags=os.SPLICE_F_MOVE)
+                except (ConnectionResetError, BrokenPipeError, OSError, select.error):
+                    break
+        finally:
+            for r, w in pipes.values():
+                os.close(r)
+                os.close(w)
@@ -0,0 +1,162 @@
+# modules/socks5.py
+
+import ipaddress
+import struct
+
+# 本地 SOCKS5 服务端使用的应答码
+REPLY_SUCCEEDED = 0x00
+REPLY_GENERAL_FAILURE = 0x01
+REPLY_HOST_UNREACHABLE = 0x04
+REPLY_COMMAND_NOT_SUPPORTED = 0x07
+REPLY_ADDRESS_NOT_SUPPORTED = 0x08
+
+METHOD_NO_AUTH = 0x00
+METHOD_USERPASS = 0x02
+METHOD_NO_ACCEPTABLE = 0xFF
+
+CMD_CONNECT = 0x01
+
+
+class Socks5ParseError(Exception):
+    """客户端发来的 SOCKS5 报文无效。reply 为断开前应发给客户端的应答，None 表示直接断开。"""
+    def __init__(self, message, reply=None):
+        super().__init__(message)
+        self.reply = reply
+
+
+class Socks5Request:
+    __slots__ = ('command', 'host', 'port')
+
+    def __init__(self, command, host, port):
+        self.command = command
+        self.host = host
+        self.port = port
+
+
+def parse_greeting(buf):
+    """解析客户端问候，返回 (客户端支持的认证方式集合, 消耗字节数)；数据不足时返回 None。"""
+    if len(buf) < 2:
+        return None
+    if buf[0] != 5:
+        raise Socks5ParseError("不是 SOCKS5 请求")
+    end = 2 + buf[1]
+    if len(buf) < end:
+        return None
+    return set(buf[2:end]), end
+
+
+def parse_request(buf):
+    """解析客户端请求，返回 (Socks5Request, 消耗字节数)；数据不足时返回 None。支持 IPv4、域名与 IPv6 地址。"""
+    if len(buf) < 5:
+        return None
+    if buf[0] != 5:
+        raise Socks5ParseError("SOCKS5 请求版本错误")
+    atyp = buf[3]
+    if atyp == 1:
+        end = 10
+    elif atyp == 3:
+        end = 7 + buf[4]
+    elif atyp == 4:
+        end = 22
+    else:
+        raise Socks5ParseError(f"不支持的地址类型: {atyp}", build_reply(REPLY_ADDRESS_NOT_SUPPORTED))
+    if len(buf) < end:
+        return None
+
+    if atyp == 1:
+        host = str(ipaddress.IPv4Address(bytes(buf[4:8])))
+    elif atyp == 4:
+        host = str(ipaddress.IPv6Address(bytes(buf[4:20])))
+    else:
+        host = bytes(buf[5:end - 2]).decode('utf-8', 'replace')
+    port = struct.unpack('!H', buf[end - 2:end])[0]
+    if buf[1] != CMD_CONNECT:
+        raise Socks5ParseError(f"不支持的命令: {buf[1]}", build_reply(REPLY_COMMAND_NOT_SUPPORTED))
+    return Socks5Request(buf[1], host, port), end
+
+
+def parse_userpass(buf):
+    """解析用户名/密码认证子协商 (RFC 1929)，返回 (用户名, 密码, 消耗字节数)；数据不足时返回 None。"""
+    if len(buf) < 2:
+        return None
+    if buf[0] != 1:
+        raise Socks5ParseError("用户名/密码认证版本错误")
+    ulen = buf[1]
+    if len(buf) < 3 + ulen:
+        return None
+    plen = buf[2 + ulen]
+    end = 3 + ulen + plen
+    if len(buf) < end:
+        return None
+    username = bytes(buf[2:2 + ulen]).decode('utf-8', 'replace')
+    password = bytes(buf[3 + ulen:end]).decode('utf-8', 'replace')
+    return username, password, end
+
+
+def build_method_reply(method: int) -> bytes:
+    return bytes((5, method))
+
+
+def build_reply(code: int) -> bytes:
+    """构造对客户端请求的应答，绑定地址固定为 0.0.0.0:0。"""
+    return bytes((5, code, 0, 1)) + b"\x00\x00\x00\x00\x00\x00"
+
+
+class Socks5Handshake:
+    """
+    与 I/O 无关的 SOCKS5 服务端握手状态机，两种服务引擎共用。
+    调用方把收到的字节原样 feed() 进来，按返回值把应答发给客户端；
+    请求解析完成后 request 不为 None，缓冲区中剩余的字节是客户端已提前发出的首段数据，应转发给上游。
+    客户端提供用户名/密码认证时优先选用它，任何凭据都会被接受，用户名仅作为会话粘滞的会话键。
+    """
+    __slots__ = ('buffer', 'request', 'username', '_state')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.request = None
+        self.username = None
+        self._state = 'greeting'
+
+    def feed(self, data) -> bytes:
+        """喂入客户端数据，返回需要立即发给客户端的应答（可能为空）。"""
+        self.buffer += data
+        out = b""
+        if self._state == 'greeting':
+            parsed = parse_greeting(self.buffer)
+            if parsed is None:
+                return out
+            methods, consumed = parsed
+            del self.buffer[:consumed]
+            if METHOD_USERPASS in methods:
+                self._state = 'auth'
+                out = build_method_reply(METHOD_USERPASS)
+            elif METHOD_NO_AUTH in methods:
+                self._state = 'request'
+                out = build_method_reply(METHOD_NO_AUTH)
+            else:
+                raise Socks5ParseError("客户端未提供可接受的认证方式", build_method_reply(METHOD_NO_ACCEPTABLE))
+        if self._state == 'auth':
+            parsed = parse_userpass(self.buffer)
+            if parsed is None:
+                return out
+            self.username, _, consumed = parsed
+            del self.buffer[:consumed]
+            self._state = 'request'
+            out += b"\x01\x00"
+        try:
+            parsed = parse_request(self.buffer)
+        except Socks5ParseError as e:
+            # 问候与请求在同一批数据中到达时，方法协商应答需先于错误应答发出
+            if out and e.reply:
+                e.reply = out + e.reply
+            raise
+        if parsed is not None:
+            self.request, consumed = parsed
+            del self.buffer[:consumed]
+        return out
+
+    def take_early_data(self) -> bytes:
+        """取出请求之后客户端已经发来的数据。"""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
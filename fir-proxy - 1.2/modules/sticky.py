@@ -0,0 +1,128 @@
+# modules/sticky.py
+
+import bisect
+import hashlib
+import threading
+import time
+
+
+def _hash(value: str) -> int:
+    # 使用稳定哈希而非内置 hash()，多进程模式下各工作进程对同一会话得到相同的映射
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ConsistentHashRing:
+    """
+    一致性哈希环：每个节点对应若干虚拟节点，节点增减时只有落在该节点上的键会改变归属。
+    创建后不再修改，节点变化时由 updated() 派生新环，可在多个线程间无锁共享。
+    """
+    def __init__(self, nodes=(), replicas=40, _points=None):
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        if _points is None:
+            _points = sorted(self._points_of(self.nodes))
+        self._points = _points
+        self._hashes = [h for h, _ in _points]
+        self._owners = [node for _, node in _points]
+
+    def _points_of(self, nodes):
+        return [(_hash(f"{node}#{i}"), node) for node in nodes for i in range(self.replicas)]
+
+    def updated(self, nodes):
+        """返回节点集合为 nodes 的新环，只为新增的节点计算哈希，未变化时返回自身。"""
+        nodes = frozenset(nodes)
+        if nodes == self.nodes:
+            return self
+        removed = self.nodes - nodes
+        points = [point for point in self._points if point[1] not in removed] if removed else list(self._points)
+        added = nodes - self.nodes
+        if added:
+            points.extend(self._points_of(added))
+            points.sort() # 原有部分已有序，timsort 只需合并新增的一段
+        return ConsistentHashRing(nodes, self.replicas, points)
+
+    def get(self, key: str):
+        """返回键所属的节点，环为空时返回 None。"""
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[idx]
+
+
+class _RingSnapshot:
+    """某个轮换器版本下的可用代理 (地址 -> 代理信息) 与对应的哈希环，发布后不再修改。"""
+    __slots__ = ('version', 'available', 'ring')
+
+    def __init__(self, version, available, ring):
+        self.version = version
+        self.available = available
+        self.ring = ring
+
+
+class StickySessions:
+    """
+    会话粘滞：把会话键（客户端地址、目标主机或认证用户名）固定映射到一个上游代理。
+    新会话按一致性哈希在当前可用代理中选取；已建立的会话在 ttl 秒内未使用才过期，
+    期间只要其代理仍然可用就保持不变。某个代理失效时，只有绑定在它上面的会话会迁移。
+    可用代理与哈希环按轮换器的版本号缓存为不可变快照，版本变化时由一个线程增量更新后整体替换，
+    其余线程在更新期间继续使用上一版本，选择路径上不扫描代理池，也不等待重建。
+    """
+    PURGE_INTERVAL = 60
+
+    def __init__(self, rotator, ttl=600):
+        self._rotator = rotator
+        self.ttl = ttl
+        self._snapshot = _RingSnapshot(None, {}, ConsistentHashRing())
+        self._sessions = {}       # 会话键 -> (代理地址, 过期时间)
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._next_purge = time.monotonic() + self.PURGE_INTERVAL
+
+    def _current(self):
+        """返回当前版本的快照；已有其他线程在更新时直接使用上一版本 (首次使用时等待其完成)。"""
+        snapshot = self._snapshot
+        version = self._rotator.get_version()
+        if snapshot.version == version:
+            return snapshot
+        if not self._rebuild_lock.acquire(blocking=snapshot.version is None):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            if snapshot.version != version:
+                available = {p['proxy']: p for p in self._rotator.get_available_proxies()}
+                snapshot = self._snapshot = _RingSnapshot(version, available, snapshot.ring.updated(available))
+            return snapshot
+        finally:
+            self._rebuild_lock.release()
+
+    def pick(self, session_key: str):
+        """返回会话应使用的上游代理信息，没有可用代理时返回 None。"""
+        snapshot = self._current()
+        available = snapshot.available
+        if not available:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_purge:
+                self._purge(now)
+            entry = self._sessions.get(session_key)
+            addr = entry[0] if entry and entry[1] > now else None
+            if addr not in available:
+                addr = snapshot.ring.get(session_key)
+            self._sessions[session_key] = (addr, now + self.ttl)
+        return available[addr]
+
+    def bind(self, session_key: str, proxy_address: str):
+        """把会话改绑到指定代理，例如会话原本的代理连接失败、由重试选中了其他代理时。"""
+        with self._lock:
+            self._sessions[session_key] = (proxy_address, time.monotonic() + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def _purge(self, now):
+        expired = [key for key, (_, expires) in self._sessions.items() if expires <= now]
+        for key in expired:
+            del self._sessions[key]
+        self._next_purge = now + self.PURGE_INTERVAL
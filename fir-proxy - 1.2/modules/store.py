@@ -0,0 +1,215 @@
+# modules/store.py
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from .record import ProxyRecord
+
+_COLUMNS = ('protocol', 'status', 'anonymity', 'latency', 'speed', 'score', 'location', 'consecutive_failures')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxies (
+    address TEXT PRIMARY KEY,
+    protocol TEXT,
+    status TEXT,
+    anonymity TEXT,
+    latency REAL,
+    speed REAL,
+    score REAL,
+    location TEXT,
+    consecutive_failures INTEGER,
+    extra TEXT,
+    first_seen REAL,
+    last_seen REAL,
+    last_checked REAL
+);
+CREATE TABLE IF NOT EXISTS checks (
+    address TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    latency REAL,
+    speed REAL
+);
+CREATE INDEX IF NOT EXISTS checks_by_address ON checks (address, checked_at);
+"""
+
+_UPSERT = f"""
+INSERT INTO proxies (address, {', '.join(_COLUMNS)}, extra, first_seen)
+VALUES (?, {', '.join('?' for _ in _COLUMNS)}, ?, ?)
+ON CONFLICT (address) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in _COLUMNS)}, extra = excluded.extra
+"""
+
+
+class ProxyStore:
+    """
+    代理池的持久化存储 (SQLite，WAL 模式)。
+    保存代理记录、历次验证结果以及最后可用 / 最后检测时间，重启后可直接从库中恢复代理池。
+    写操作先放入队列，由后台线程按 FLUSH_INTERVAL 秒或 BATCH_SIZE 条合并为一个事务提交，
+    调用方 (界面线程) 不会因磁盘写入而阻塞；WAL 模式下读取与后台写入互不阻塞。
+    """
+    FLUSH_INTERVAL = 1.0
+    BATCH_SIZE = 500
+    HISTORY_DAYS = 7   # 验证历史保留天数
+
+    def __init__(self, path: str, log_queue=None):
+        self.path = path
+        self._log_queue = log_queue
+        self._queue = queue.Queue()
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _log(self, message):
+        if self._log_queue:
+            self._log_queue.put(f"[Store] {message}")
+
+    # --- 读取 ---
+    def load(self, max_age_hours=None) -> list:
+        """
+        读取库中的全部代理记录，返回 ProxyRecord 列表 (按分数从高到低)。
+        给定 max_age_hours 时，先删除超过该时长未曾验证可用的代理及过期的验证历史。
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                now = time.time()
+                conn.execute("DELETE FROM checks WHERE checked_at < ?", (now - self.HISTORY_DAYS * 86400,))
+                if max_age_hours:
+                    cutoff = now - max_age_hours * 3600
+                    pruned = conn.execute(
+                        "DELETE FROM proxies WHERE COALESCE(last_seen, first_seen, 0) < ?", (cutoff,)
+                    ).rowcount
+                    if pruned:
+                        self._log(f"已清理 {pruned} 个超过 {max_age_hours} 小时未验证可用的代理。")
+            rows = conn.execute(
+                f"SELECT address, {', '.join(_COLUMNS)}, extra FROM proxies ORDER BY score DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        records = []
+        for row in rows:
+            record = ProxyRecord(proxy=row[0])
+            for key, value in zip(_COLUMNS, row[1:-1]):
+                if value is not None:
+                    record[key] = value
+            if row[-1]:
+                record.update(json.loads(row[-1]))
+            records.append(record)
+        return records
+
+    def recent_checks(self, limit: int) -> dict:
+        """
+        返回每个代理最近 limit 次验证结果 {代理地址: [(是否可用, 延迟, 速度), ...]}，按时间从旧到新，
+        用于启动时恢复评分历史。
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT address, ok, latency, speed FROM checks ORDER BY address, checked_at"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        checks = {}
+        for address, ok, latency, speed in rows:
+            checks.setdefault(address, []).append((bool(ok), latency, speed))
+        return {address: entries[-limit:] for address, entries in checks.items()}
+
+    def history(self, proxy_address: str, limit: int = 20) -> list:
+        """返回某个代理最近的验证结果 [(时间戳, 是否可用, 延迟, 速度), ...]，最新的在前。"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT checked_at, ok, latency, speed FROM checks WHERE address = ? ORDER BY checked_at DESC LIMIT ?",
+                (proxy_address, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    # --- 写入 (异步，批量提交) ---
+    def save(self, proxy_info):
+        """保存 (插入或覆盖) 一条代理记录。入队时即复制字段，之后对记录的修改不影响本次写入。"""
+        values = [proxy_info.get(key) for key in _COLUMNS]
+        extra = {key: value for key, value in proxy_info.items()
+                 if key != 'proxy' and key not in _COLUMNS}
+        self._queue.put(('save', proxy_info.get('proxy'), values,
+                         json.dumps(extra, ensure_ascii=False) if extra else None, time.time()))
+
+    def record_check(self, proxy_address: str, ok: bool, latency=None, speed=None):
+        """记录一次验证结果，同时更新最后检测时间，验证可用时还更新最后可用时间。"""
+        self._queue.put(('check', proxy_address, bool(ok), latency, speed, time.time()))
+
+    def delete(self, proxy_address: str):
+        self._queue.put(('delete', proxy_address))
+
+    def clear(self):
+        self._queue.put(('clear',))
+
+    def _apply(self, conn, op):
+        kind = op[0]
+        if kind == 'save':
+            _, address, values, extra, now = op
+            conn.execute(_UPSERT, (address, *values, extra, now))
+        elif kind == 'check':
+            _, address, ok, latency, speed, now = op
+            conn.execute("INSERT INTO checks (address, checked_at, ok, latency, speed) VALUES (?, ?, ?, ?, ?)",
+                         (address, now, int(ok), latency, speed))
+            if ok:
+                conn.execute("UPDATE proxies SET last_checked = ?, last_seen = ? WHERE address = ?", (now, now, address))
+            else:
+                conn.execute("UPDATE proxies SET last_checked = ? WHERE address = ?", (now, address))
+        elif kind == 'delete':
+            conn.execute("DELETE FROM proxies WHERE address = ?", (op[1],))
+            conn.execute("DELETE FROM checks WHERE address = ?", (op[1],))
+        elif kind == 'clear':
+            conn.execute("DELETE FROM proxies")
+            conn.execute("DELETE FROM checks")
+
+    def _write_loop(self):
+        conn = self._connect()
+        closing = False
+        try:
+            while not closing:
+                op = self._queue.get()
+                batch = []
+                deadline = time.monotonic() + self.FLUSH_INTERVAL
+                while True:
+                    if op is None:
+                        closing = True
+                        break
+                    batch.append(op)
+                    if len(batch) >= self.BATCH_SIZE:
+                        break
+                    try:
+                        op = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                if not batch:
+                    continue
+                try:
+                    with conn:
+                        for op in batch:
+                            self._apply(conn, op)
+                except sqlite3.Error as e:
+                    self._log(f"[!] 写入 {len(batch)} 条变更失败: {e}")
+        finally:
+            conn.close()
+
+    def close(self, timeout=5):
+        """提交队列中剩余的变更并停止后台写入线程。"""
+        self._queue.put(None)
+        self._writer.join(timeout)
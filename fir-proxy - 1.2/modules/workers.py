@@ -0,0 +1,209 @@
+# modules/workers.py
+
+import multiprocessing
+import queue
+import socket
+import threading
+import time
+from collections import deque
+
+from .rotator import ProxyRotator
+
+# 多个进程监听同一端口依赖 SO_REUSEPORT (Linux / BSD / macOS)，Windows 上不可用
+WORKERS_SUPPORTED = hasattr(socket, 'SO_REUSEPORT')
+# 工作进程向协调进程上报运行指标的间隔 (秒)
+METRICS_REPORT_INTERVAL = 1.0
+
+
+class _EventLog:
+    """供工作进程内的 ProxyServer 使用的日志队列，把日志转交给协调进程。"""
+    def __init__(self, events, index):
+        self._events = events
+        self._index = index
+
+    def put(self, message):
+        self._events.put(('log', f"[Worker {self._index}] {message}"))
+
+
+class _WorkerRotator(ProxyRotator):
+    """
+    工作进程内的轮换器: 状态来自协调进程的快照，失败报告与熔断恢复在本地生效的同时上报协调进程。
+    载入快照后，此前的熔断记录只保留在协调进程中，恢复与否以协调进程的状态为准。
+    转发结果数量大，不逐条上报，而是按代理缓存最近的结果，随运行指标定期一并上报。
+    """
+    def __init__(self, events):
+        super().__init__()
+        self._events = events
+        self._outcomes = {}   # 代理地址 -> 尚未上报的转发结果
+
+    def record_outcome(self, proxy_address: str, ok: bool):
+        super().record_outcome(proxy_address, ok)
+        pending = self._outcomes.get(proxy_address)
+        if pending is None:
+            pending = self._outcomes.setdefault(proxy_address, deque(maxlen=self.scorer.window))
+        pending.append(ok)
+
+    def take_outcomes(self) -> dict:
+        """取出尚未上报的转发结果 {代理地址: [成败, ...]}。"""
+        outcomes, self._outcomes = self._outcomes, {}
+        return {address: list(pending) for address, pending in outcomes.items()}
+
+    def report_failure(self, proxy_address: str):
+        super().report_failure(proxy_address)
+        self._events.put(('failure', proxy_address))
+
+    def restore(self, proxy_address: str) -> bool:
+        restored = super().restore(proxy_address)
+        if restored:
+            self._events.put(('restore', proxy_address))
+        return restored
+
+
+def _worker_main(index, listen, settings, snapshot, control, events):
+    """工作进程入口: 以 SO_REUSEPORT 监听与协调进程相同的端口，持续接收轮换器快照并定期上报运行指标。"""
+    from .server import ProxyServer
+
+    rotator = _WorkerRotator(events)
+    rotator.load_snapshot(snapshot['rotator'])
+    server = ProxyServer(*listen, rotator=rotator, log_queue=_EventLog(events, index))
+    server.configure(settings)
+    server.workers = 1
+    server.metrics_port = 0  # 指标由协调进程汇总后统一提供
+    server.reuse_port = True
+    server.rotate_per_request = snapshot['rotate_per_request']
+    server.start_all()
+    try:
+        next_report = time.monotonic() + METRICS_REPORT_INTERVAL
+        while True:
+            try:
+                message = control.get(timeout=max(0, next_report - time.monotonic()))
+            except queue.Empty:
+                message = False
+            if message is None:
+                break
+            if message:
+                rotator.load_snapshot(message['rotator'])
+                server.rotate_per_request = message['rotate_per_request']
+            if time.monotonic() >= next_report:
+                events.put(('metrics', (index, server.metrics.collect())))
+                outcomes = rotator.take_outcomes()
+                if outcomes:
+                    events.put(('outcomes', outcomes))
+                next_report = time.monotonic() + METRICS_REPORT_INTERVAL
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop_all()
+
+
+class WorkerGroup:
+    """
+    多进程工作模式的协调者，运行在主进程中。
+    启动 N 个工作进程共同监听 HTTP 与 SOCKS5 端口，由内核在它们之间分配新连接；
+    主进程的轮换器是唯一的状态来源，变化时以快照形式推送给各工作进程，
+    工作进程上报的上游失败则回写到主进程的轮换器，再随下一次快照同步给所有进程。
+    """
+    SYNC_INTERVAL = 1.0
+    STOP_TIMEOUT = 5
+
+    def __init__(self, server, count):
+        self._server = server
+        self.count = count
+        # 使用 spawn 启动，避免在已有 GUI 与多个线程的进程中 fork
+        self._ctx = multiprocessing.get_context('spawn')
+        self._events = self._ctx.Queue()
+        self._controls = []
+        self._processes = []
+        self._last_snapshot = None
+        self._last_state = None   # 上次推送时的 (轮换器版本, 当前代理, 轮换模式)
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def log(self, message):
+        self._server.log(message)
+
+    def _snapshot(self):
+        s = self._server
+        return {'rotator': s._rotator.snapshot(), 'rotate_per_request': s.rotate_per_request}
+
+    def _state(self):
+        """决定是否需要推送快照的状态，比生成并比较整份快照廉价得多。"""
+        s = self._server
+        current = s._rotator.current_proxy
+        return s._rotator.get_version(), current.get('proxy') if current else None, s.rotate_per_request
+
+    def start(self):
+        s = self._server
+        listen = (s._http_host, s._http_port, s._socks5_host, s._socks5_port)
+        settings = dict(s.settings)
+        self._last_state = self._state()
+        self._last_snapshot = self._snapshot()
+        for index in range(1, self.count + 1):
+            control = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_worker_main, args=(index, listen, settings, self._last_snapshot, control, self._events), daemon=True
+            )
+            process.start()
+            self._controls.append(control)
+            self._processes.append(process)
+
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._sync_loop, daemon=True),
+            threading.Thread(target=self._event_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.log(f"多进程模式已启动: {self.count} 个工作进程 (PID {', '.join(str(p.pid) for p in self._processes)})")
+
+    def stop(self):
+        self._stop_event.set()
+        for control in self._controls:
+            control.put(None)
+        for process in self._processes:
+            process.join(self.STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._events.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._controls = []
+        self._processes = []
+
+    def _sync_loop(self):
+        """定期检查主进程轮换器的版本号，有变化时才生成并推送快照。"""
+        while not self._stop_event.wait(self.SYNC_INTERVAL):
+            state = self._state()
+            if state == self._last_state:
+                continue
+            # 先取状态再生成快照: 两者之间的写入会使版本号再变，下一轮再推送一次
+            self._last_state = state
+            snapshot = self._snapshot()
+            self._last_snapshot = snapshot
+            for control in self._controls:
+                control.put(snapshot)
+
+    def _event_loop(self):
+        """转发工作进程的日志，并把它们上报的失败、熔断恢复与转发结果应用到主进程的轮换器。"""
+        while True:
+            try:
+                event = self._events.get()
+            except (EOFError, OSError):
+                break
+            if event is None:
+                break
+            kind, payload = event
+            if kind == 'log':
+                self._server._log_queue.put(payload)
+            elif kind == 'failure':
+                self._server._rotator.report_failure(payload)
+            elif kind == 'restore':
+                self._server._rotator.restore(payload)
+            elif kind == 'outcomes':
+                for address, outcomes in payload.items():
+                    for ok in outcomes:
+                        self._server._rotator.record_outcome(address, ok)
+            elif kind == 'metrics':
+                index, totals = payload
+                self._server.metrics.set_remote(index, totals)